@@ -10,6 +10,7 @@ from sqlalchemy.exc import NoResultFound
 from sqlalchemy.orm import Session
 
 from mork.auth import authenticate_api_key
+from mork.crud import update_users_statuses
 from mork.db import get_session
 from mork.models.users import (
     ServiceName,
@@ -19,6 +20,7 @@ from mork.models.users import (
 from mork.schemas.users import (
     DeletionStatus,
     UserRead,
+    UserStatusBulkUpdate,
     UserStatusRead,
     UserStatusUpdate,
 )
@@ -113,6 +115,35 @@ async def read_user(
     return response_user
 
 
+@router.patch("/status")
+async def update_users_status(
+    session: Annotated[Session, Depends(get_session)],
+    statuses: Annotated[
+        list[UserStatusUpdate],
+        Body(max_length=10000, description="The new deletion statuses"),
+    ],
+) -> list[UserStatusBulkUpdate]:
+    """Update the deletion status of many users at once.
+
+    Each status is reported as not updated if the user status is not found.
+    """
+    updated = update_users_statuses(
+        session,
+        [(item.id, item.service_name, item.status) for item in statuses],
+    )
+    session.commit()
+
+    response = [
+        UserStatusBulkUpdate(
+            **item.model_dump(), updated=(item.id, item.service_name) in updated
+        )
+        for item in statuses
+    ]
+    logger.debug("Updated %s of %s user statuses", len(updated), len(statuses))
+
+    return response
+
+
 @router.get("/{user_id}/status/{service_name}")
 async def read_user_status(
     session: Annotated[Session, Depends(get_session)],
@@ -6,6 +6,11 @@ from sentry_sdk.scrubber import DEFAULT_PII_DENYLIST, EventScrubber
 
 from mork import __version__
 from mork.conf import settings
+from mork.db import MorkDB
+from mork.edx.mongo.database import OpenEdxMongoDB
+from mork.edx.mysql.database import OpenEdxMySQLDB
+from mork.mail import EmailRateLimiter, SMTPConnectionPool
+from mork.utils import load_svg_datauris
 
 from .probe import LivenessProbe
 
@@ -57,6 +62,32 @@ def init_sentry(**_kwargs):
         sentry_sdk.set_tag("application", "celery")
 
 
+@signals.worker_init.connect
+def init_worker(sender, **_kwargs):
+    """Share the worker concurrency with its pool processes, to pace emails."""
+    app.conf.worker_concurrency = sender.concurrency
+
+
+@signals.worker_process_init.connect
+def init_worker_process(**_kwargs):
+    """Open the database connections and load the static files reused by tasks."""
+    OpenEdxMongoDB.get_process_connection()
+    OpenEdxMySQLDB.get_process_engine()
+    MorkDB.get_process_engine()
+    load_svg_datauris(settings.STATIC_PATH, settings.STATIC_DATAURIS_PATH)
+
+
+@signals.worker_process_shutdown.connect
+@signals.worker_shutdown.connect
+def shutdown_worker_process(**_kwargs):
+    """Close the database, SMTP and Redis connections of a worker process."""
+    OpenEdxMongoDB.close_process_connection()
+    OpenEdxMySQLDB.dispose_process_engine()
+    MorkDB.dispose_process_engine()
+    SMTPConnectionPool.close_process_pool()
+    EmailRateLimiter.close_process_limiter()
+
+
 # Using a string here avoids serializing the configuration object in subprocesses.
 # - namespace='CELERY' means that all celery-related configuration keys
 #   must have the `CELERY_` prefix.
@@ -1,22 +1,30 @@
 """Mork Celery deletion tasks."""
 
-from datetime import datetime
 from logging import getLogger
 from uuid import UUID
 
 from celery import chain, group
-from sqlalchemy import insert, select
+from sqlalchemy import delete, insert, select
 from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from sqlalchemy.orm import selectinload
 
 from mork.celery.celery_app import app
-from mork.celery.tasks.edx import delete_edx_platform_user
-from mork.celery.tasks.sarbacane import delete_sarbacane_platform_user
+from mork.celery.tasks.edx import delete_edx_platform_user, delete_edx_platform_users
+from mork.celery.tasks.sarbacane import (
+    delete_sarbacane_platform_user,
+    delete_sarbacane_platform_users,
+)
+from mork.celery.utils import (
+    get_service_status,
+    scan_inactive_users,
+    update_statuses_in_mork,
+)
 from mork.conf import settings
 from mork.db import MorkDB
 from mork.edx.mysql import crud
 from mork.edx.mysql.database import OpenEdxMySQLDB
-from mork.exceptions import UserDeleteError
-from mork.models.tasks import EmailStatus
+from mork.exceptions import UserDeleteError, UserStatusError
+from mork.models.tasks import EmailOutbox, EmailStatus
 from mork.models.users import (
     DeletionReason,
     DeletionStatus,
@@ -24,41 +32,36 @@ from mork.models.users import (
     User,
     UserServiceStatus,
 )
+from mork.schemas.users import UserRead
 
 logger = getLogger(__name__)
 
 
 @app.task
-def delete_inactive_users(limit: int = 0, dry_run: bool = True):
+def delete_inactive_users(
+    limit: int = 0, dry_run: bool = True, incremental: bool = False
+):
     """Celery task to delete inactive users accounts."""
     edx_db = OpenEdxMySQLDB()
+    mork_db = MorkDB()
 
-    threshold_date = datetime.now() - settings.DELETION_PERIOD
-    total = crud.get_inactive_users_count(edx_db.session, threshold_date)
-
-    if limit:
-        total = min(total, limit)
-
-    for batch_offset in range(0, total, settings.EDX_MYSQL_QUERY_BATCH_SIZE):
-        batch_limit = min(settings.EDX_MYSQL_QUERY_BATCH_SIZE, total - batch_offset)
-        inactive_users = crud.get_inactive_users(
-            edx_db.session,
-            threshold_date,
-            offset=batch_offset,
-            limit=batch_limit,
-        )
-
-        delete_group = group(
-            [
-                delete_user.s(
-                    email=user.email, reason=DeletionReason.GDPR, dry_run=dry_run
-                )
-                for user in inactive_users
-            ]
+    for users_batch in scan_inactive_users(
+        edx_db.session,
+        mork_db.session,
+        task_name="delete_inactive_users",
+        period=settings.DELETION_PERIOD,
+        limit=limit,
+        incremental=incremental,
+        checkpoint=not dry_run,
+    ):
+        delete_users_batch.delay(
+            emails=[user.email for user in users_batch],
+            reason=DeletionReason.GDPR,
+            dry_run=dry_run,
         )
-        delete_group.delay()
 
     edx_db.session.close()
+    mork_db.session.close()
 
 
 @app.task
@@ -83,6 +86,189 @@ def delete_user(
     delete_chain.delay()
 
 
+@app.task(
+    bind=True,
+    retry_kwargs={"max_retries": settings.DELETE_MAX_RETRIES},
+)
+def delete_users_batch(
+    self,
+    emails: list[str],
+    reason: DeletionReason = DeletionReason.USER_REQUESTED,
+    dry_run: bool = True,
+) -> dict[str, dict[str, str]]:
+    """Celery task that deletes a batch of users.
+
+    Each deletion stage is run once for the whole batch. A failure for a user does
+    not fail the batch: the deletion of this user from the failing service is handed
+    over to the per-user service task, which is retried on failure. So are users
+    whose new statuses could not be saved in Mork.
+
+    Returns the new deletion status of each user for each service.
+    """
+    if dry_run:
+        logger.info(f"Dry run: {len(emails)} users would have been deleted")
+        return {}
+
+    logger.debug(f"Starting deletion of {len(emails)} users")
+
+    remove_email_statuses(emails)
+    try:
+        user_ids = mark_users_for_deletion(emails, reason)
+    except UserDeleteError as exc:
+        logger.exception(exc)
+        raise self.retry(exc=exc) from exc
+
+    mork_db = MorkDB()
+    users = [
+        UserRead.model_validate(user)
+        for user in mork_db.session.scalars(
+            select(User)
+            .options(selectinload(User.service_statuses))
+            .where(User.id.in_(user_ids.values()))
+        )
+    ]
+    mork_db.session.close()
+
+    service_tasks = {
+        ServiceName.EDX: (delete_edx_platform_users, delete_edx_platform_user),
+        ServiceName.SARBACANE: (
+            delete_sarbacane_platform_users,
+            delete_sarbacane_platform_user,
+        ),
+    }
+    results = {email: {} for email in emails}
+    for service, (delete_users, delete_user_task) in service_tasks.items():
+        users_to_delete = [
+            user
+            for user in users
+            if get_service_status(user, service) == DeletionStatus.TO_DELETE
+        ]
+        statuses = delete_users(users_to_delete)
+        try:
+            _update_service_statuses(service, statuses)
+        except UserStatusError:
+            # The per-user task updates the status once the deletion is done again
+            statuses = dict.fromkeys(statuses)
+
+        for user in users_to_delete:
+            if user.id not in statuses:
+                continue
+            if statuses[user.id] is None:
+                delete_user_task.delay(user.id)
+                results[user.email][service.value] = DeletionStatus.TO_DELETE.value
+            else:
+                results[user.email][service.value] = statuses[user.id].value
+
+    return results
+
+
+def mark_users_for_deletion(
+    emails: list[str], reason: DeletionReason
+) -> dict[str, UUID]:
+    """Mark a batch of users for deletion across all services in Mork database.
+
+    Returns the Mork id of each user found in the edX database.
+    """
+    logger.debug("Marking users for deletion")
+
+    edx_mysql_db = OpenEdxMySQLDB()
+    try:
+        auth_users = crud.get_users(edx_mysql_db.session, emails)
+    except (SQLAlchemyError, DBAPIError) as exc:
+        edx_mysql_db.session.rollback()
+        msg = "Failed to read users from edX MySQL"
+        logger.error(msg)
+        raise UserDeleteError(msg) from exc
+    finally:
+        edx_mysql_db.session.close()
+
+    if len(auth_users) < len(set(emails)):
+        logger.warning(
+            f"{len(set(emails)) - len(auth_users)} users not found in edx database"
+        )
+
+    mork_db = MorkDB()
+
+    # Skip users already marked for deletion
+    user_ids = dict(
+        mork_db.session.execute(
+            select(User.email, User.id).where(
+                User.email.in_([auth_user.email for auth_user in auth_users])
+            )
+        ).all()
+    )
+    new_users = [
+        auth_user for auth_user in auth_users if auth_user.email not in user_ids
+    ]
+    if not new_users:
+        mork_db.session.close()
+        return user_ids
+
+    # Add users to Mork database
+    inserted_users = mork_db.session.execute(
+        insert(User).returning(User.email, User.id),
+        [
+            {
+                "username": auth_user.username,
+                "edx_user_id": auth_user.id,
+                "email": auth_user.email,
+                "reason": reason,
+            }
+            for auth_user in new_users
+        ],
+    ).all()
+
+    # Mark for deletion across all services
+    mork_db.session.execute(
+        insert(UserServiceStatus),
+        [
+            {
+                "user_id": user_id,
+                "service_name": service,
+                "status": DeletionStatus.TO_DELETE,
+            }
+            for _, user_id in inserted_users
+            for service in ServiceName
+            if service != ServiceName.BREVO
+        ],
+    )
+
+    try:
+        mork_db.session.commit()
+    except (SQLAlchemyError, DBAPIError) as exc:
+        mork_db.session.rollback()
+        logger.error(f"Failed to mark users to be deleted - {exc}")
+        raise UserDeleteError("Failed to mark users to be deleted") from exc
+    finally:
+        mork_db.session.close()
+
+    user_ids.update(dict(inserted_users))
+    return user_ids
+
+
+def _update_service_statuses(
+    service: ServiceName, statuses: dict[UUID, DeletionStatus | None]
+):
+    """Update the deletion status of a batch of users for a service."""
+    new_statuses = [
+        (user_id, service, status)
+        for user_id, status in statuses.items()
+        if status is not None
+    ]
+    if not new_statuses:
+        return
+
+    updated = update_statuses_in_mork(new_statuses)
+    if updated is None:
+        msg = f"Failed to update deletion statuses for {service.value}"
+        logger.error(msg)
+        raise UserStatusError(msg)
+
+    for user_id, _, _ in new_statuses:
+        if (user_id, service) not in updated:
+            logger.warning(f"Status of user {user_id} for {service.value} not found")
+
+
 @app.task
 def mark_user_for_deletion(email: str, reason: DeletionReason) -> UUID:
     """Mark user for deletion across all services in Mork database."""
@@ -154,18 +340,21 @@ def mark_user_for_deletion(email: str, reason: DeletionReason) -> UUID:
 
 @app.task
 def remove_email_status(email: str):
-    """Delete the email status in the Mork database."""
+    """Delete the email status and the queued email in the Mork database."""
     logger.debug("Removing user email status")
     mork_db = MorkDB()
-    user_to_delete = (
-        mork_db.session.query(EmailStatus).filter(EmailStatus.email == email).first()
-    )
-    if not user_to_delete:
-        logger.warning("Email status not found")
-        return
-
     try:
-        mork_db.session.delete(user_to_delete)
+        # Waits for a drainer sending the queued email to record its status
+        mork_db.session.execute(delete(EmailOutbox).where(EmailOutbox.email == email))
+        user_to_delete = (
+            mork_db.session.query(EmailStatus)
+            .filter(EmailStatus.email == email)
+            .first()
+        )
+        if user_to_delete:
+            mork_db.session.delete(user_to_delete)
+        else:
+            logger.warning("Email status not found")
         mork_db.session.commit()
     except (SQLAlchemyError, DBAPIError):
         mork_db.session.rollback()
@@ -173,3 +362,22 @@ def remove_email_status(email: str):
         return
     finally:
         mork_db.session.close()
+
+
+def remove_email_statuses(emails: list[str]):
+    """Delete the email statuses and queued emails of a batch of users."""
+    logger.debug("Removing users email statuses")
+    mork_db = MorkDB()
+    try:
+        mork_db.session.execute(
+            delete(EmailOutbox).where(EmailOutbox.email.in_(emails))
+        )
+        mork_db.session.execute(
+            delete(EmailStatus).where(EmailStatus.email.in_(emails))
+        )
+        mork_db.session.commit()
+    except (SQLAlchemyError, DBAPIError):
+        mork_db.session.rollback()
+        logger.error("Failed to delete email statuses")
+    finally:
+        mork_db.session.close()
@@ -1,9 +1,11 @@
 """Mork Celery edx tasks."""
 
+from functools import cache
 from logging import getLogger
 from uuid import UUID
 
 from mongoengine.errors import OperationError
+from pymongo.errors import PyMongoError
 from sqlalchemy.exc import DBAPIError, SQLAlchemyError
 
 from mork.celery.celery_app import app
@@ -24,6 +26,7 @@ from mork.exceptions import (
     UserStatusError,
 )
 from mork.models.users import DeletionStatus, ServiceName
+from mork.schemas.users import UserRead
 
 logger = getLogger(__name__)
 
@@ -62,7 +65,7 @@ def delete_edx_platform_user(self, user_id: UUID):
         raise self.retry(exc=exc) from exc
 
     try:
-        delete_edx_mongo_user(username=user.username)
+        delete_edx_mongo_user(username=user.username, author_id=user.edx_user_id)
     except UserDeleteError as exc:
         logger.exception(exc)
         raise self.retry(exc=exc) from exc
@@ -80,6 +83,34 @@ def delete_edx_platform_user(self, user_id: UUID):
     logger.info(f"Completed deletion process for user {user_id}")
 
 
+def delete_edx_platform_users(
+    users: list[UserRead],
+) -> dict[UUID, DeletionStatus | None]:
+    """Delete a batch of users from the edX platform.
+
+    Returns the new edX deletion status of each user, or None if the deletion of
+    the user failed.
+    """
+    try:
+        protected_emails = delete_edx_mysql_users(emails=[user.email for user in users])
+        delete_edx_mongo_users(
+            authors={user.edx_user_id: user.username for user in users}
+        )
+    except UserDeleteError as exc:
+        logger.error(f"Failed to delete users from edX: {exc}")
+        return {user.id: None for user in users}
+
+    statuses = {}
+    for user in users:
+        if user.email in protected_emails:
+            logger.info(f"User {user.id} is protected")
+            statuses[user.id] = DeletionStatus.PROTECTED
+        else:
+            statuses[user.id] = DeletionStatus.DELETED
+
+    return statuses
+
+
 def delete_edx_mysql_user(email: str):
     """Delete user's data from edX MySQL database."""
     logger.debug("Deleting user's data from edX MySQL")
@@ -104,16 +135,89 @@ def delete_edx_mysql_user(email: str):
         db.session.close()
 
 
-def delete_edx_mongo_user(username: str):
-    """Delete user's data from edX MongoDB database."""
+def delete_edx_mysql_users(emails: list[str]) -> list[str]:
+    """Delete a batch of users' data from edX MySQL database.
+
+    Returns the emails of the protected users that have not been deleted.
+    """
+    logger.debug("Deleting users' data from edX MySQL")
+
+    db = OpenEdxMySQLDB()
+    try:
+        protected_emails = mysql.delete_users(db.session, emails=emails)
+        db.session.commit()
+    except (SQLAlchemyError, DBAPIError) as exc:
+        db.session.rollback()
+        msg = "Failed to delete users from edX MySQL"
+        logger.error(msg)
+        raise UserDeleteError(msg) from exc
+    finally:
+        db.session.close()
+
+    return protected_emails
+
+
+@cache
+def check_comments_query_plan(field: str) -> bool | None:
+    """Check that edX comments are matched on a field with an index.
+
+    The query plan is only checked once per process, a collection scan being
+    logged as an error as it makes anonymizing each user take minutes on large
+    forums.
+    """
+    if not settings.EDX_MONGO_CHECK_QUERY_PLAN:
+        return None
+
+    try:
+        indexed = mongo.is_authors_query_indexed(field)
+    except (OperationError, PyMongoError) as exc:
+        logger.warning(f"Failed to check comments query plan on {field}: {exc}")
+        return None
+
+    if not indexed:
+        logger.error(
+            f"Matching comments on {field} requires a collection scan (COLLSCAN), "
+            "an index should be created on this field"
+        )
+    return indexed
+
+
+def delete_edx_mongo_user(username: str, author_id: int | None = None):
+    """Delete user's data from edX MongoDB database.
+
+    Comments are matched on the author id when it is provided, or on the username.
+    """
     logger.debug("Deleting user's data from edX MongoDB")
 
-    db = OpenEdxMongoDB()
+    OpenEdxMongoDB()
     try:
-        mongo.anonymize_comments(username)
-    except OperationError as exc:
+        if author_id is not None:
+            check_comments_query_plan("author_id")
+        check_comments_query_plan("author_username")
+        mongo.anonymize_comments(username, author_id=author_id)
+    except (OperationError, PyMongoError) as exc:
+        msg = f"Failed to delete comments: {exc}"
+        logger.error(msg)
+        raise UserDeleteError(msg) from exc
+
+
+def delete_edx_mongo_users(authors: dict[int, str]):
+    """Delete a batch of users' data from edX MongoDB database.
+
+    Comments are matched on the author ids, or on the usernames for comments left
+    without the author id.
+
+    Parameters:
+    authors (dict[int, str]): The usernames of the users by edX id.
+    """
+    logger.debug("Deleting users' data from edX MongoDB")
+
+    OpenEdxMongoDB()
+    try:
+        check_comments_query_plan("author_id")
+        check_comments_query_plan("author_username")
+        mongo.anonymize_authors_comments(authors)
+    except (OperationError, PyMongoError) as exc:
         msg = f"Failed to delete comments: {exc}"
         logger.error(msg)
         raise UserDeleteError(msg) from exc
-    finally:
-        db.disconnect()
@@ -1,49 +1,82 @@
 """Mork Celery emailing tasks."""
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from logging import getLogger
 
-from celery import group
+from celery.utils.time import rate
 from sqlalchemy import select
+from sqlalchemy.orm import Session
 
 from mork.celery.celery_app import app
+from mork.celery.utils import scan_inactive_users
 from mork.conf import settings
+from mork.crud import (
+    claim_warning_emails,
+    create_email_statuses,
+    enqueue_warning_emails,
+)
 from mork.db import MorkDB
-from mork.edx.mysql import crud
 from mork.edx.mysql.database import OpenEdxMySQLDB
 from mork.exceptions import EmailSendError
-from mork.mail import send_email
+from mork.mail import EmailRateLimiter, send_email, send_emails
 from mork.models.tasks import EmailStatus
 
 logger = getLogger(__name__)
 
 
 @app.task
-def warn_inactive_users(limit: int = 0, dry_run: bool = True):
+def warn_inactive_users(
+    limit: int = 0, dry_run: bool = True, incremental: bool = False
+):
     """Celery task to warn inactive users by email."""
-    db = OpenEdxMySQLDB()
+    edx_db = OpenEdxMySQLDB()
+    mork_db = MorkDB()
 
-    threshold_date = datetime.now() - settings.WARNING_PERIOD
-    total = crud.get_inactive_users_count(db.session, threshold_date)
+    for users_batch in scan_inactive_users(
+        edx_db.session,
+        mork_db.session,
+        task_name="warn_inactive_users",
+        period=settings.WARNING_PERIOD,
+        limit=limit,
+        incremental=incremental,
+        checkpoint=not dry_run,
+    ):
+        # Skip users already warned before creating their tasks
+        already_sent = get_emails_already_sent(
+            mork_db.session, [user.email for user in users_batch]
+        )
+        users_to_warn = [user for user in users_batch if user.email not in already_sent]
+        logger.debug(
+            f"Skipping {len(users_batch) - len(users_to_warn)} users already warned"
+        )
+        if not users_to_warn:
+            continue
 
-    if limit:
-        total = min(total, limit)
+        if settings.EMAIL_DELIVERY == "outbox":
+            if dry_run:
+                logger.info(
+                    f"Dry run: {len(users_to_warn)} emails would have been queued"
+                )
+            else:
+                # Queued emails are committed along with the scan checkpoint
+                enqueue_warning_emails(
+                    mork_db.session,
+                    [(user.email, user.username) for user in users_to_warn],
+                    max_attempts=settings.EMAIL_MAX_RETRIES,
+                )
+            continue
 
-    for batch_offset in range(0, total, settings.EDX_MYSQL_QUERY_BATCH_SIZE):
-        batch_limit = min(settings.EDX_MYSQL_QUERY_BATCH_SIZE, total - batch_offset)
-        inactive_users = crud.get_inactive_users(
-            db.session,
-            threshold_date,
-            offset=batch_offset,
-            limit=batch_limit,
+        warn_users_batch.delay(
+            users=[(user.email, user.username) for user in users_to_warn],
+            dry_run=dry_run,
         )
-        send_email_group = group(
-            [
-                warn_user.s(email=user.email, username=user.username, dry_run=dry_run)
-                for user in inactive_users
-            ]
-        )
-        send_email_group.delay()
+
+    edx_db.session.close()
+    mork_db.session.close()
+
+    if settings.EMAIL_DELIVERY == "outbox" and not dry_run:
+        for _ in range(settings.EMAIL_OUTBOX_DRAINERS):
+            drain_email_outbox.delay()
 
 
 @app.task(
@@ -73,6 +106,137 @@ def warn_user(self, email: str, username: str, dry_run: bool = True):
     mark_email_status(email)
 
 
+@app.task
+def warn_users_batch(users: list[tuple[str, str]], dry_run: bool = True) -> dict:
+    """Celery task that warns a batch of users by sending emails.
+
+    Emails are sent over a single SMTP connection, at the `EMAIL_RATE_LIMIT` rate.
+    Users who failed to receive their email are handed over to the `warn_user`
+    task, to be retried individually.
+
+    Parameters:
+    users (list): The `(email, username)` of the users to warn.
+    dry_run (bool): If True, no email is sent.
+
+    Returns the status of each email: `already_sent`, `sent` or `failed`.
+    """
+    db = MorkDB()
+    already_sent = get_emails_already_sent(db.session, [email for email, _ in users])
+    db.session.close()
+    users_to_warn = [
+        (email, username) for email, username in users if email not in already_sent
+    ]
+    statuses = dict.fromkeys(already_sent, "already_sent")
+
+    if dry_run:
+        logger.info(f"Dry run: {len(users_to_warn)} emails would have been sent")
+        return statuses
+
+    logger.debug(f"Sending {len(users_to_warn)} emails")
+    errors = send_emails(users_to_warn, interval=get_send_interval())
+    logger.info(f"Email rate limit usage: {EmailRateLimiter.get_process_usage()}")
+
+    # Write flags that emails were correctly sent to these users
+    sent = [email for email, _ in users_to_warn if email not in errors]
+    mark_emails_status(sent)
+    statuses.update(dict.fromkeys(sent, "sent"))
+
+    for email, username in users_to_warn:
+        if email in errors:
+            logger.warning(f"Sending email to {email=} failed, retrying it alone")
+            warn_user.delay(email=email, username=username, dry_run=False)
+            statuses[email] = "failed"
+
+    return statuses
+
+
+@app.task
+def drain_email_outbox(batch_size: int = 0) -> dict:
+    """Celery task that sends the pending emails of the email outbox.
+
+    Pending emails are claimed by batches of `EMAIL_OUTBOX_BATCH_SIZE`, skipping
+    the ones claimed by concurrent drainers. Each batch is sent over a single SMTP
+    connection at the `EMAIL_RATE_LIMIT` rate, and its emails are marked sent in
+    the transaction of their claim.
+
+    The outbox is drained in a single pass. Failed emails are left pending, to be
+    retried by a drain scheduled after a backoff of `EMAIL_RETRY_BACKOFF` seconds
+    doubled at each attempt, up to `EMAIL_MAX_RETRIES` attempts.
+
+    Returns the number of `sent` and `failed` emails.
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    interval = get_send_interval()
+    counts = {"sent": 0, "failed": 0}
+    # Emails failing during this drain are only claimed again by a later one
+    started_at = datetime.now()
+    retry_delays = []
+
+    db = MorkDB()
+    try:
+        while emails := claim_warning_emails(
+            db.session,
+            batch_size,
+            max_attempts=settings.EMAIL_MAX_RETRIES,
+            until=started_at,
+        ):
+            # Emails sent by the warn_user task are not sent again
+            already_sent = get_emails_already_sent(
+                db.session, [email.email for email in emails]
+            )
+            errors = send_emails(
+                [
+                    (email.email, email.username)
+                    for email in emails
+                    if email.email not in already_sent
+                ],
+                interval=interval,
+            )
+
+            sent_date = datetime.now()
+            for email in emails:
+                if email.email in errors:
+                    email.attempts += 1
+                    delay = settings.EMAIL_RETRY_BACKOFF * 2 ** (email.attempts - 1)
+                    email.next_attempt_at = sent_date + timedelta(seconds=delay)
+                    if email.attempts < settings.EMAIL_MAX_RETRIES:
+                        retry_delays.append(delay)
+                else:
+                    email.sent_date = sent_date
+            sent = [email.email for email in emails if email.email not in errors]
+            create_email_statuses(db.session, sent, sent_date=sent_date)
+            db.session.commit()
+
+            logger.debug(f"Sent {len(sent)} emails of the outbox")
+            counts["sent"] += len(sent)
+            counts["failed"] += len(errors)
+    finally:
+        db.session.close()
+        logger.info(f"Email rate limit usage: {EmailRateLimiter.get_process_usage()}")
+
+    if retry_delays:
+        logger.info(f"Retrying {len(retry_delays)} failed emails of the outbox")
+        drain_email_outbox.apply_async(
+            kwargs={"batch_size": batch_size}, countdown=min(retry_delays)
+        )
+
+    return counts
+
+
+def get_send_interval() -> float:
+    """Get the interval between two emails sent by a batch task.
+
+    Batches are paced at the `EMAIL_RATE_LIMIT` rate, unless the rate limit shared
+    by all senders is enabled. As for Celery task rate limits, this rate applies
+    per worker, and is thus shared by its pool processes.
+    """
+    if settings.EMAIL_GLOBAL_RATE_LIMIT:
+        return 0
+    email_rate = rate(settings.EMAIL_RATE_LIMIT)
+    senders = app.conf.worker_concurrency or 1
+    return senders / email_rate if email_rate else 0
+
+
 def check_email_already_sent(email: str):
     """Check if an email has already been sent to the user."""
     db = MorkDB()
@@ -88,3 +252,23 @@ def mark_email_status(email: str):
     db.session.add(EmailStatus(email=email, sent_date=datetime.now()))
     db.session.commit()
     db.session.close()
+
+
+def get_emails_already_sent(session: Session, emails: list[str]) -> set[str]:
+    """Get the emails that have already been sent among the given ones."""
+    if not emails:
+        return set()
+
+    query = select(EmailStatus.email).where(EmailStatus.email.in_(emails))
+    return set(session.execute(query).scalars().all())
+
+
+def mark_emails_status(emails: list[str]):
+    """Mark the statuses of many emails in database with a single insert."""
+    if not emails:
+        return
+
+    db = MorkDB()
+    create_email_statuses(db.session, emails, sent_date=datetime.now())
+    db.session.commit()
+    db.session.close()
@@ -1,9 +1,15 @@
 """Mork Celery sarbacane tasks."""
 
+import asyncio
+import json
+import time
+from functools import cache
+from itertools import batched
 from logging import getLogger
 from uuid import UUID
 
 import httpx
+import redis
 
 from mork.celery.celery_app import app
 from mork.celery.utils import (
@@ -18,9 +24,16 @@ from mork.exceptions import (
     UserStatusError,
 )
 from mork.models.users import DeletionStatus, ServiceName
+from mork.sarbacane import SarbacaneClient
+from mork.schemas.users import UserRead
 
 logger = getLogger(__name__)
 
+CONTACT_LISTS_CACHE_KEY = "mork:sarbacane:contact_lists"
+
+# Contact lists cached by the current worker process, when not shared with Redis
+_contact_lists_cache = {}
+
 
 @app.task(
     bind=True,
@@ -64,44 +77,121 @@ def delete_sarbacane_platform_user(self, user_id: UUID):
     logger.info(f"Completed deletion process for user {user_id}")
 
 
+def delete_sarbacane_platform_users(
+    users: list[UserRead],
+) -> dict[UUID, DeletionStatus | None]:
+    """Delete a batch of users from the Sarbacane platform.
+
+    Returns the new Sarbacane deletion status of each user, or None if the deletion of
+    the user failed.
+    """
+    if not settings.SARBACANE_API_URL:
+        logger.info("Sarbacane API URL not set, skipping deletion.")
+        return {}
+
+    try:
+        errors = delete_sarbacane_users([user.email for user in users])
+    except UserDeleteError as exc:
+        logger.error(f"Failed to delete users from Sarbacane: {exc}")
+        return {user.id: None for user in users}
+    finally:
+        logger.info(f"Sarbacane budget usage: {SarbacaneClient.get_budget_usage()}")
+
+    statuses = {}
+    for user in users:
+        if user.email in errors:
+            logger.error(
+                f"Failed to delete user {user.id} from Sarbacane: {errors[user.email]}"
+            )
+            statuses[user.id] = None
+        else:
+            statuses[user.id] = DeletionStatus.DELETED
+
+    return statuses
+
+
 def delete_sarbacane_user(email: str):
     """Delete user contact on Sarbacane."""
-    logger.debug("Delete user contact on Sarbacane")
+    errors = asyncio.run(_delete_sarbacane_contacts([email]))
+    if errors:
+        raise errors[email]
 
-    headers = {
-        "accountId": f"{settings.SARBACANE_ACCOUNT_ID}",
-        "apiKey": f"{settings.SARBACANE_API_KEY}",
-    }
 
-    with httpx.Client(base_url=settings.SARBACANE_API_URL, headers=headers) as client:
-        try:
-            lists_response = client.get("/lists")
-            blacklists_response = client.get("/blacklists")
-        except httpx.RequestError as exc:
-            msg = "Network error while retrieving lists of contacts"
-            logger.error(msg)
-            raise UserDeleteError(msg) from exc
+def delete_sarbacane_users(emails: list[str]) -> dict[str, UserDeleteError]:
+    """Delete many user contacts on Sarbacane.
+
+    Emails are deleted from each list and blacklist by chunks of
+    `SARBACANE_DELETE_BATCH_SIZE` emails per request.
+
+    Returns the first error met for each email whose deletion failed.
+    """
+    return asyncio.run(_delete_sarbacane_contacts(emails))
 
-        list_ids = {contact_list["id"] for contact_list in lists_response.json()}
-        blacklist_ids = {blacklist["id"] for blacklist in blacklists_response.json()}
 
-        for list_id in list_ids:
-            _delete_contact(client, f"/lists/{list_id}/contacts", email)
+async def _delete_sarbacane_contacts(emails: list[str]) -> dict[str, UserDeleteError]:
+    """Delete contacts from all Sarbacane lists and blacklists concurrently.
 
+    At most `SARBACANE_CONCURRENCY` requests are sent at once, within the rate limit
+    budget of the Sarbacane client. All deletions are awaited before reporting the
+    first error met for each email.
+    """
+    logger.debug(f"Delete {len(emails)} user contacts on Sarbacane")
+
+    async with SarbacaneClient() as client:
+        list_ids, blacklist_ids = await get_contact_lists(client)
+
+        endpoints = [f"/lists/{list_id}/contacts" for list_id in list_ids]
         for blacklist_id in blacklist_ids:
-            _delete_contact(client, f"/blacklists/{blacklist_id}/unsubscribers", email)
-            _delete_contact(client, f"/blacklists/{blacklist_id}/complaints", email)
+            endpoints.append(f"/blacklists/{blacklist_id}/unsubscribers")
+            endpoints.append(f"/blacklists/{blacklist_id}/complaints")
+
+        deletions = [
+            (endpoint, emails_chunk)
+            for endpoint in endpoints
+            for emails_chunk in batched(emails, settings.SARBACANE_DELETE_BATCH_SIZE)
+        ]
+        semaphore = asyncio.Semaphore(settings.SARBACANE_CONCURRENCY)
+        results = await asyncio.gather(
+            *(
+                _delete_contacts(client, semaphore, endpoint, emails_chunk)
+                for endpoint, emails_chunk in deletions
+            ),
+            return_exceptions=True,
+        )
+
+    errors = {}
+    for (_, emails_chunk), result in zip(deletions, results, strict=True):
+        if isinstance(result, Exception):
+            for email in emails_chunk:
+                errors.setdefault(email, result)
+    return errors
 
 
-def _delete_contact(client: httpx.Client, endpoint: str, email: str):
-    """Delete a contact from a given endpoint."""
+async def _delete_contacts(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    endpoint: str,
+    emails: tuple[str, ...],
+):
+    """Delete contacts from a given endpoint."""
     try:
-        response = client.delete(f"{endpoint}?email={email}")
+        async with semaphore:
+            response = await client.delete(endpoint, params={"email": emails})
         response.raise_for_status()
     except httpx.HTTPStatusError as exc:
-        data = exc.response.json() if exc.response.content else {}
-        if data.get("message") == "No contacts versions to delete":
+        try:
+            data = exc.response.json()
+        except ValueError:
+            data = {}
+        if (
+            isinstance(data, dict)
+            and data.get("message") == "No contacts versions to delete"
+        ):
             logger.info(f"User not found at {endpoint}")
+        elif exc.response.status_code == httpx.codes.NOT_FOUND:
+            # The list has been removed since the contact lists have been cached
+            logger.warning(f"Contact list not found at {endpoint}")
+            invalidate_contact_lists_cache()
         else:
             msg = f"Failed to delete user contact at {endpoint}"
             logger.error(msg)
@@ -110,3 +200,111 @@ def _delete_contact(client: httpx.Client, endpoint: str, email: str):
         msg = f"Network error while deleting user contact at {endpoint}"
         logger.error(msg)
         raise UserDeleteError(msg) from exc
+
+
+async def get_contact_lists(
+    client: httpx.AsyncClient,
+) -> tuple[set[str], set[str]]:
+    """Get the ids of the Sarbacane lists and blacklists of contacts.
+
+    Ids are cached for `SARBACANE_CACHE_TTL` seconds, in the current worker process
+    or in Redis if the `SARBACANE_CACHE_REDIS_URL` setting is set, to be shared by
+    all workers. The cache is disabled if the TTL is 0.
+
+    Returns the list ids and the blacklist ids.
+    """
+    contact_lists = _read_contact_lists_cache()
+    if contact_lists is not None:
+        return contact_lists
+
+    try:
+        lists_response, blacklists_response = await asyncio.gather(
+            client.get("/lists"), client.get("/blacklists")
+        )
+        lists_response.raise_for_status()
+        blacklists_response.raise_for_status()
+    except httpx.HTTPStatusError as exc:
+        msg = f"Failed to retrieve lists of contacts at {exc.request.url.path}"
+        logger.error(msg)
+        raise UserDeleteError(msg) from exc
+    except httpx.RequestError as exc:
+        msg = "Network error while retrieving lists of contacts"
+        logger.error(msg)
+        raise UserDeleteError(msg) from exc
+
+    try:
+        list_ids = {contact_list["id"] for contact_list in lists_response.json()}
+        blacklist_ids = {blacklist["id"] for blacklist in blacklists_response.json()}
+    except (ValueError, TypeError, KeyError) as exc:
+        msg = "Invalid lists of contacts"
+        logger.error(msg)
+        raise UserDeleteError(msg) from exc
+
+    # Only lists of successful responses are cached
+    _write_contact_lists_cache(list_ids, blacklist_ids)
+
+    return list_ids, blacklist_ids
+
+
+def invalidate_contact_lists_cache():
+    """Remove the cached ids of Sarbacane lists and blacklists of contacts."""
+    logger.debug("Invalidating Sarbacane contact lists cache")
+    _contact_lists_cache.clear()
+
+    if settings.SARBACANE_CACHE_REDIS_URL:
+        try:
+            _get_redis_client().delete(CONTACT_LISTS_CACHE_KEY)
+        except redis.RedisError as exc:
+            logger.error(f"Failed to invalidate contact lists in Redis: {exc}")
+
+
+@cache
+def _get_redis_client() -> redis.Redis:
+    """Get the Redis client sharing the cache between workers."""
+    return redis.Redis.from_url(settings.SARBACANE_CACHE_REDIS_URL)
+
+
+def _read_contact_lists_cache() -> tuple[set[str], set[str]] | None:
+    """Read the cached contact lists ids, or None if they are not cached."""
+    if not settings.SARBACANE_CACHE_TTL:
+        return None
+
+    if settings.SARBACANE_CACHE_REDIS_URL:
+        try:
+            cached = _get_redis_client().get(CONTACT_LISTS_CACHE_KEY)
+        except redis.RedisError as exc:
+            logger.warning(f"Failed to read contact lists from Redis: {exc}")
+            return None
+        if cached is None:
+            return None
+        contact_lists = json.loads(cached)
+        return set(contact_lists["lists"]), set(contact_lists["blacklists"])
+
+    expires_at = _contact_lists_cache.get("expires_at")
+    if expires_at is None or expires_at <= time.monotonic():
+        return None
+    return _contact_lists_cache["lists"], _contact_lists_cache["blacklists"]
+
+
+def _write_contact_lists_cache(list_ids: set[str], blacklist_ids: set[str]):
+    """Cache the contact lists ids for `SARBACANE_CACHE_TTL` seconds."""
+    if not settings.SARBACANE_CACHE_TTL:
+        return
+
+    if settings.SARBACANE_CACHE_REDIS_URL:
+        contact_lists = {"lists": sorted(list_ids), "blacklists": sorted(blacklist_ids)}
+        try:
+            _get_redis_client().set(
+                CONTACT_LISTS_CACHE_KEY,
+                json.dumps(contact_lists),
+                ex=settings.SARBACANE_CACHE_TTL,
+            )
+        except redis.RedisError as exc:
+            logger.warning(f"Failed to write contact lists to Redis: {exc}")
+        return
+
+    _contact_lists_cache.update(
+        lists=list_ids,
+        blacklists=blacklist_ids,
+        expires_at=time.monotonic() + settings.SARBACANE_CACHE_TTL,
+    )
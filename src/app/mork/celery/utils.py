@@ -1,19 +1,98 @@
 """Celery utils functions."""
 
+from datetime import datetime, timedelta
+from itertools import batched
 from logging import getLogger
+from typing import Iterator
 from uuid import UUID
 
 import httpx
+from sqlalchemy import Row, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, selectinload
 
 from mork.conf import settings
-from mork.models.users import DeletionStatus, ServiceName
+from mork.crud import update_users_statuses
+from mork.db import MorkDB
+from mork.edx.mysql import crud
+from mork.models.tasks import ScanCheckpoint
+from mork.models.users import DeletionStatus, ServiceName, User, UserServiceStatus
 from mork.schemas.users import UserRead
 
 logger = getLogger(__name__)
 
 
+def scan_inactive_users(  # noqa: PLR0913
+    edx_session: Session,
+    mork_session: Session,
+    task_name: str,
+    period: timedelta,
+    limit: int = 0,
+    incremental: bool = False,
+    checkpoint: bool = True,
+) -> Iterator[tuple[Row, ...]]:
+    """Yield batches of inactive users from edX, checkpointing the scan progress.
+
+    The scan progress of each task is stored in the `scan_checkpoints` table of the
+    Mork database: the id of the last user of each batch is saved once the batch has
+    been processed by the caller, so that an interrupted scan (or a scan stopped by
+    `limit`) is resumed from this point on the next run. In incremental mode, only
+    users who crossed the inactivity threshold since the last completed scan are
+    visited. The progress is not saved if `checkpoint` is False.
+
+    Users that can never be deleted are left out of the scan if the
+    `EDX_MYSQL_EXCLUDE_PROTECTED_USERS` setting is enabled.
+    """
+    state = mork_session.get(ScanCheckpoint, task_name)
+    if state is None:
+        state = ScanCheckpoint(task_name=task_name)
+        mork_session.add(state)
+
+    if state.last_user_id is None:
+        state.threshold_date = datetime.now() - period
+    else:
+        logger.info(f"Resuming {task_name} scan after user {state.last_user_id}")
+
+    inactive_users = crud.iter_inactive_users(
+        edx_session,
+        state.threshold_date,
+        chunk_size=settings.EDX_MYSQL_QUERY_BATCH_SIZE,
+        limit=limit,
+        last_seen_id=state.last_user_id,
+        since_date=state.completed_threshold_date if incremental else None,
+        exclude_protected=settings.EDX_MYSQL_EXCLUDE_PROTECTED_USERS,
+    )
+
+    scanned = 0
+    for users_batch in batched(inactive_users, settings.EDX_MYSQL_QUERY_BATCH_SIZE):
+        yield users_batch
+
+        scanned += len(users_batch)
+        state.last_user_id = users_batch[-1].id
+        if checkpoint:
+            mork_session.commit()
+
+    if limit and scanned >= limit:
+        logger.info(f"Scan {task_name} stopped after {scanned} users")
+        return
+
+    # The scan is completed
+    state.completed_threshold_date = state.threshold_date
+    state.threshold_date = None
+    state.last_user_id = None
+    if checkpoint:
+        mork_session.commit()
+
+
 def get_user_from_mork(user_id: UUID) -> UserRead | None:
-    """Retrieve user from Mork by ID."""
+    """Retrieve user from Mork by ID.
+
+    The user is read from the Mork API, or straight from the Mork database if the
+    `USER_STATUS_REPOSITORY` setting is set to `database`.
+    """
+    if settings.USER_STATUS_REPOSITORY == "database":
+        return get_user_from_mork_db(user_id)
+
     logger.debug("Get user from Mork")
     logger.debug(f"API URL: {settings.SERVER_URL}")
 
@@ -30,6 +109,25 @@ def get_user_from_mork(user_id: UUID) -> UserRead | None:
     return UserRead.model_validate(response.json())
 
 
+def get_user_from_mork_db(user_id: UUID) -> UserRead | None:
+    """Retrieve user and its service statuses from the Mork database by ID."""
+    logger.debug("Get user from Mork database")
+
+    mork_db = MorkDB()
+    try:
+        user = mork_db.session.scalar(
+            select(User)
+            .options(selectinload(User.service_statuses))
+            .where(User.id == user_id)
+        )
+        return UserRead.model_validate(user) if user else None
+    except SQLAlchemyError as exc:
+        logger.error(f"Failed to retrieve user from Mork database: {exc}")
+        return None
+    finally:
+        mork_db.session.close()
+
+
 def get_service_status(user: UserRead, service: ServiceName) -> DeletionStatus | None:
     """Find the service status entry for a user."""
     service_status = next(
@@ -42,7 +140,14 @@ def get_service_status(user: UserRead, service: ServiceName) -> DeletionStatus |
 def update_status_in_mork(
     user_id: UUID, service: ServiceName, status: DeletionStatus
 ) -> bool:
-    """Update the user deletion status in Mork."""
+    """Update the user deletion status in Mork.
+
+    The status is updated through the Mork API, or straight in the Mork database if
+    the `USER_STATUS_REPOSITORY` setting is set to `database`.
+    """
+    if settings.USER_STATUS_REPOSITORY == "database":
+        return update_status_in_mork_db(user_id, service, status)
+
     logger.debug(f"Updating deletion status for user {user_id} in Mork to {status}")
     logger.debug(f"API URL: {settings.SERVER_URL}")
 
@@ -58,3 +163,100 @@ def update_status_in_mork(
         return False
 
     return True
+
+
+def update_status_in_mork_db(
+    user_id: UUID, service: ServiceName, status: DeletionStatus
+) -> bool:
+    """Update the user deletion status straight in the Mork database."""
+    logger.debug(
+        f"Updating deletion status for user {user_id} in Mork database to {status}"
+    )
+
+    mork_db = MorkDB()
+    try:
+        updated = mork_db.session.scalar(
+            update(UserServiceStatus)
+            .where(
+                UserServiceStatus.user_id == user_id,
+                UserServiceStatus.service_name == service,
+            )
+            .values(status=status)
+            .returning(UserServiceStatus.id)
+        )
+        if updated is None:
+            mork_db.session.rollback()
+            logger.error(f"Status of user {user_id} for {service.value} not found")
+            return False
+        mork_db.session.commit()
+    except SQLAlchemyError as exc:
+        mork_db.session.rollback()
+        logger.error(f"Failed to update user status in Mork database: {exc}")
+        return False
+    finally:
+        mork_db.session.close()
+
+    return True
+
+
+def update_statuses_in_mork(
+    statuses: list[tuple[UUID, ServiceName, DeletionStatus]],
+) -> set[tuple[UUID, ServiceName]] | None:
+    """Update the deletion statuses of many users at once in Mork.
+
+    The statuses are updated through the bulk endpoint of the Mork API, or straight
+    in the Mork database if the `USER_STATUS_REPOSITORY` setting is set to
+    `database`.
+
+    Returns the `(user_id, service_name)` pairs whose status has been updated, or
+    None if the update failed.
+    """
+    if settings.USER_STATUS_REPOSITORY == "database":
+        return update_statuses_in_mork_db(statuses)
+
+    logger.debug(f"Updating {len(statuses)} deletion statuses in Mork")
+    logger.debug(f"API URL: {settings.SERVER_URL}")
+
+    try:
+        response = httpx.patch(
+            f"{settings.SERVER_URL}/v1/users/status",
+            headers={"X-API-Key": f"{settings.API_KEYS[0]}"},
+            json=[
+                {
+                    "id": str(user_id),
+                    "service_name": service.value,
+                    "status": status.value,
+                }
+                for user_id, service, status in statuses
+            ],
+        )
+        response.raise_for_status()
+    except httpx.HTTPError as exc:
+        logger.error(f"Failed to update users statuses with Mork API: {exc}")
+        return None
+
+    return {
+        (UUID(item["id"]), ServiceName(item["service_name"]))
+        for item in response.json()
+        if item["updated"]
+    }
+
+
+def update_statuses_in_mork_db(
+    statuses: list[tuple[UUID, ServiceName, DeletionStatus]],
+) -> set[tuple[UUID, ServiceName]] | None:
+    """Update the deletion statuses of many users at once in the Mork database."""
+    logger.debug(f"Updating {len(statuses)} deletion statuses in Mork database")
+
+    mork_db = MorkDB()
+    try:
+        updated = update_users_statuses(mork_db.session, statuses)
+        mork_db.session.commit()
+    except SQLAlchemyError as exc:
+        mork_db.session.rollback()
+        logger.error(f"Failed to update users statuses in Mork database: {exc}")
+        return None
+    finally:
+        mork_db.session.close()
+
+    return updated
@@ -3,7 +3,7 @@
 import io
 from datetime import timedelta
 from pathlib import Path
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -27,6 +27,10 @@ class Settings(BaseSettings):
     API_SERVER_PORT: int = 8100
     API_KEYS: list[str] = ["APIKeyToBeChanged"]
 
+    # Repository used by workers to read and update users statuses, either through
+    # the Mork API ("api") or straight in the Mork database ("database")
+    USER_STATUS_REPOSITORY: Literal["api", "database"] = "api"
+
     # Warning task configuration
     WARNING_PERIOD: timedelta = "P5Y30D"
 
@@ -46,6 +50,7 @@ class Settings(BaseSettings):
 
     # Static path
     STATIC_PATH: Path = ROOT_PATH / "static"
+    STATIC_DATAURIS_PATH: Path = ROOT_PATH / "templates/static.json"
 
     # Mork database
     DB_ENGINE: str = "postgresql+psycopg2"
@@ -55,6 +60,9 @@ class Settings(BaseSettings):
     DB_PASSWORD: str = "pass"  # noqa: S105
     DB_PORT: int = 5432
     DB_DEBUG: bool = False
+    DB_POOL_SIZE: int = 5
+    DB_POOL_RECYCLE: int = 3600
+    DB_POOL_PRE_PING: bool = True
     TEST_DB_NAME: str = "test-mork-db"
 
     # EDX MySQL database
@@ -65,7 +73,11 @@ class Settings(BaseSettings):
     EDX_MYSQL_DB_PASSWORD: str = "password"  # noqa: S105
     EDX_MYSQL_DB_PORT: int = 3306
     EDX_MYSQL_DB_DEBUG: bool = False
+    EDX_MYSQL_DB_POOL_SIZE: int = 5
+    EDX_MYSQL_DB_POOL_RECYCLE: int = 3600
+    EDX_MYSQL_DB_POOL_PRE_PING: bool = True
     EDX_MYSQL_QUERY_BATCH_SIZE: int = 1000
+    EDX_MYSQL_EXCLUDE_PROTECTED_USERS: bool = False
 
     # EDX MongoDB database
     EDX_MONGO_DB_ENGINE: str = "mongodb"
@@ -75,11 +87,20 @@ class Settings(BaseSettings):
     EDX_MONGO_DB_PASSWORD: str = "password"  # noqa: S105
     EDX_MONGO_DB_PORT: int = 27017
     EDX_MONGO_DB_DEBUG: bool = False
+    EDX_MONGO_CHECK_QUERY_PLAN: bool = True
 
     # Sarbacane configuration
     SARBACANE_API_URL: str = "https://sarbacaneapis.com/v1"
     SARBACANE_API_KEY: str = "ToBeChanged"
     SARBACANE_ACCOUNT_ID: str = "ToBeChanged"
+    SARBACANE_CONCURRENCY: int = 10
+    SARBACANE_DELETE_BATCH_SIZE: int = 1
+    SARBACANE_RATE_LIMIT: str = "10/s"
+    SARBACANE_RATE_LIMIT_BURST: int = 10
+    SARBACANE_MAX_RETRIES: int = 3
+    SARBACANE_RETRY_BACKOFF: float = 1.0
+    SARBACANE_CACHE_TTL: int = 300
+    SARBACANE_CACHE_REDIS_URL: Optional[str] = None
 
     # Emails
     EMAIL_HOST: str = "mailcatcher"
@@ -89,10 +110,24 @@ class Settings(BaseSettings):
     EMAIL_USE_TLS: bool = False
     EMAIL_FROM: str = ""
     EMAIL_RATE_LIMIT: str = "100/m"
+    # Rate limit shared by all email senders through the Celery Redis broker,
+    # disabled if not set
+    EMAIL_GLOBAL_RATE_LIMIT: Optional[str] = None
+    EMAIL_GLOBAL_RATE_LIMIT_BURST: int = 1
     EMAIL_MAX_RETRIES: int = 3
+    EMAIL_RETRY_BACKOFF: float = 60.0
+    EMAIL_CONNECTION_MAX_MESSAGES: int = 100
+    EMAIL_CONNECTION_MAX_IDLE: int = 60
+    # Delivery of warning emails, either by one task per user ("task") or through
+    # the email outbox drained by batches ("outbox")
+    EMAIL_DELIVERY: Literal["task", "outbox"] = "task"
+    EMAIL_OUTBOX_BATCH_SIZE: int = 100
+    EMAIL_OUTBOX_DRAINERS: int = 1
     EMAIL_SITE_NAME: str = ""
     EMAIL_SITE_BASE_URL: str = ""
     EMAIL_SITE_LOGIN_URL: str = ""
+    EMAIL_TEMPLATES_AUTO_RELOAD: bool = False
+    EMAIL_TEMPLATES_BYTECODE_CACHE_PATH: Optional[Path] = None
 
     # Celery
     broker_url: str = Field("redis://redis:6379/0", alias="MORK_CELERY_BROKER_URL")
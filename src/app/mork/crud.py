@@ -0,0 +1,146 @@
+"""Module for Mork database CRUD functions."""
+
+from datetime import datetime
+from logging import getLogger
+from uuid import UUID
+
+from sqlalchemy import and_, cast, column, or_, select, update, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from mork.models.tasks import EmailOutbox, EmailStatus
+from mork.models.users import DeletionStatus, ServiceName, UserServiceStatus
+
+logger = getLogger(__name__)
+
+
+def update_users_statuses(
+    session: Session,
+    statuses: list[tuple[UUID, ServiceName, DeletionStatus]],
+) -> set[tuple[UUID, ServiceName]]:
+    """Update the deletion statuses of many users at once.
+
+    Statuses are applied with a single `UPDATE ... FROM (VALUES ...)` statement. If
+    a user status is given more than once, the last one is applied. The session is
+    not committed.
+
+    Parameters:
+    session (Session): SQLAlchemy session object.
+    statuses (list): The `(user_id, service_name, status)` tuples to apply.
+
+    Returns the `(user_id, service_name)` pairs whose status has been updated.
+    """
+    # Deduplicate statuses as a row can only be updated once by a statement
+    new_statuses = {
+        (user_id, service_name): status for user_id, service_name, status in statuses
+    }
+    if not new_statuses:
+        return set()
+
+    table = UserServiceStatus.__table__
+    new_statuses_values = values(
+        column("user_id", table.c.user_id.type),
+        column("service_name", table.c.service_name.type),
+        column("status", table.c.status.type),
+        name="new_statuses",
+    ).data([(*key, status) for key, status in new_statuses.items()])
+
+    # Enum values are sent as text and must be cast to compare with enum columns
+    updated = session.execute(
+        update(UserServiceStatus)
+        .where(
+            UserServiceStatus.user_id == new_statuses_values.c.user_id,
+            UserServiceStatus.service_name
+            == cast(new_statuses_values.c.service_name, table.c.service_name.type),
+        )
+        .values(status=cast(new_statuses_values.c.status, table.c.status.type))
+        .returning(UserServiceStatus.user_id, UserServiceStatus.service_name)
+    ).all()
+
+    logger.debug(f"Updated {len(updated)} of {len(new_statuses)} user statuses")
+
+    return {(user_id, service_name) for user_id, service_name in updated}
+
+
+def create_email_statuses(session: Session, emails: list[str], sent_date: datetime):
+    """Record that emails have been sent, with a single insert.
+
+    Emails that already have a status are ignored. The session is not committed.
+    """
+    if not emails:
+        return
+
+    session.execute(
+        insert(EmailStatus)
+        .values([{"email": email, "sent_date": sent_date} for email in emails])
+        .on_conflict_do_nothing(index_elements=["email"])
+    )
+
+
+def enqueue_warning_emails(
+    session: Session, users: list[tuple[str, str]], max_attempts: int
+) -> int:
+    """Add warning emails to the email outbox, with a single insert.
+
+    Emails already in the outbox, pending or sent, are ignored so that concurrent
+    producers never queue the same email twice. Emails given up after
+    `max_attempts` failed attempts are queued again. The session is not committed.
+
+    Parameters:
+    session (Session): SQLAlchemy session object.
+    users (list): The `(email, username)` of the users to warn.
+    max_attempts (int): The number of attempts after which emails are given up.
+
+    Returns the number of emails added to the outbox.
+    """
+    if not users:
+        return 0
+
+    statement = insert(EmailOutbox).values(
+        [{"email": email, "username": username} for email, username in users]
+    )
+    queued = session.execute(
+        statement.on_conflict_do_update(
+            index_elements=["email"],
+            set_={
+                "username": statement.excluded.username,
+                "attempts": 0,
+                "next_attempt_at": None,
+            },
+            where=and_(
+                EmailOutbox.sent_date.is_(None),
+                EmailOutbox.attempts >= max_attempts,
+            ),
+        ).returning(EmailOutbox.id)
+    ).all()
+
+    logger.debug(f"Queued {len(queued)} of {len(users)} warning emails")
+
+    return len(queued)
+
+
+def claim_warning_emails(
+    session: Session, limit: int, max_attempts: int, until: datetime
+) -> list[EmailOutbox]:
+    """Claim pending emails of the outbox, oldest first.
+
+    Claimed rows are locked with `FOR UPDATE SKIP LOCKED` until the end of the
+    transaction, so that concurrent drainers claim distinct emails. Emails that
+    failed `max_attempts` times, or to be retried after `until`, are not claimed.
+    """
+    return list(
+        session.scalars(
+            select(EmailOutbox)
+            .where(
+                EmailOutbox.sent_date.is_(None),
+                EmailOutbox.attempts < max_attempts,
+                or_(
+                    EmailOutbox.next_attempt_at.is_(None),
+                    EmailOutbox.next_attempt_at <= until,
+                ),
+            )
+            .order_by(EmailOutbox.created_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+    )
@@ -1,37 +1,115 @@
 """Mork database connection."""
 
 import logging
+import os
+from collections import Counter
+from functools import partial
 from threading import Lock
 from typing import Generator, Optional
 
 from pydantic import PostgresDsn
 from sqlalchemy import Engine as SAEngine
-from sqlalchemy import NullPool, create_engine, text
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session as SASession
 
 from mork.conf import settings
+from mork.utils import ProcessLocal
 
 logger = logging.getLogger(__name__)
 
 
+# Events of the connection pool of the current process engine, by name
+_pool_events: Counter = Counter()
+
+
+def _count_pool_event(event_name: str, *_args):
+    """Count an event of the connection pool of the current process."""
+    _pool_events[event_name] += 1
+
+
+def _create_engine() -> SAEngine:
+    """Create the engine of the current process, counting its pool events."""
+    logger.debug("Creating Mork database engine for process %s", os.getpid())
+    engine = create_engine(
+        settings.DB_URL,
+        echo=settings.DB_DEBUG,
+        pool_size=settings.DB_POOL_SIZE,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+    _pool_events.clear()
+    for event_name in ("connect", "close", "checkout", "checkin"):
+        event.listen(engine, event_name, partial(_count_pool_event, event_name))
+    return engine
+
+
+def _dispose_engine(engine: SAEngine):
+    """Close the pooled connections of the engine of the current process."""
+    logger.info(
+        "Disposing Mork database engine for process %s, pool metrics: %s",
+        os.getpid(),
+        MorkDB.get_pool_metrics(),
+    )
+    engine.dispose(close=True)
+
+
 class MorkDB:
     """Class to connect to the Mork database.
 
-    This class is used by Celery workers to start a new engine and session per process.
+    This class is used by Celery workers to start a new session per task. Sessions
+    are bound to the engine of the current process, whose connection pool is
+    created lazily and shared by all instances.
     """
 
     session = None
 
+    _process_engine = ProcessLocal(
+        _create_engine,
+        close=_dispose_engine,
+        release=lambda engine: engine.dispose(close=False),
+    )
+
     def __init__(self):
         """Initialize SqlAlchemy engine and session."""
-        # Disable pooling as SQLAlchemy connections cannot be shared accross processes,
-        # and Celery forks processes by default
-        self.engine = create_engine(
-            settings.DB_URL, echo=settings.DB_DEBUG, poolclass=NullPool
-        )
+        self.engine = self.get_process_engine()
         self.session = SASession(self.engine)
 
+    @classmethod
+    def get_process_engine(cls) -> SAEngine:
+        """Get the engine of the current process, creating it if needed."""
+        return cls._process_engine.get()
+
+    @classmethod
+    def get_pool_metrics(cls) -> dict[str, int]:
+        """Get the connection pool metrics of the current process engine.
+
+        Counters of opened (`connect`), closed (`close`), checked out and checked in
+        connections since the creation of the engine are returned along with the
+        current pool size, number of checked in, checked out and overflow
+        connections.
+        """
+        engine = cls._process_engine.peek()
+        if engine is None:
+            return {}
+
+        pool = engine.pool
+        return {
+            "connect": _pool_events["connect"],
+            "close": _pool_events["close"],
+            "checkout": _pool_events["checkout"],
+            "checkin": _pool_events["checkin"],
+            "pool_size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        }
+
+    @classmethod
+    def dispose_process_engine(cls):
+        """Close the pooled connections of the current process engine, if any."""
+        cls._process_engine.close()
+
 
 class Singleton(type):
     """Thread-safe singleton pattern metaclass."""
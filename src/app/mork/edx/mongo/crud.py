@@ -1,8 +1,9 @@
 """Module for MongoDB CRUD functions."""
 
+from collections import Counter
 from logging import getLogger
 
-from mongoengine.queryset.visitor import Q
+from pymongo import UpdateMany
 
 from mork.conf import settings
 from mork.edx.mongo.models import Comment, CommentThread
@@ -10,33 +11,172 @@ from mork.edx.mongo.models import Comment, CommentThread
 logger = getLogger(__name__)
 
 
-def anonymize_comments(username: str) -> int:
+def _anonymize_authors_comments(author_filter: dict) -> list[dict]:
+    """Anonymize the comments and threads of authors matching a filter.
+
+    Documents of all authors are counted with a single aggregation, then updated
+    with a single unordered bulk write on the `contents` collection.
+
+    Returns the number of documents anonymized for each `author_id` and
+    `author_username` pair.
+    """
+    collection = Comment._get_collection()  # noqa: SLF001
+    comment_type, thread_type = Comment.type.default, CommentThread.type.default
+
+    groups = [
+        {**group["_id"], "count": group["count"]}
+        for group in collection.aggregate(
+            [
+                {
+                    "$match": {
+                        **author_filter,
+                        "_type": {"$in": [comment_type, thread_type]},
+                    }
+                },
+                {
+                    "$group": {
+                        "_id": {
+                            "author_id": "$author_id",
+                            "author_username": "$author_username",
+                        },
+                        "count": {"$sum": 1},
+                    }
+                },
+            ]
+        )
+    ]
+    if not groups:
+        return []
+
+    anonymized_fields = {
+        "author_username": "[deleted]",
+        "body": "[deleted]",
+        "author_id": settings.EDX_FORUM_PLACEHOLDER_USER_ID,
+        "anonymous": True,
+    }
+    collection.bulk_write(
+        [
+            UpdateMany(
+                {**author_filter, "_type": comment_type},
+                {"$set": anonymized_fields},
+            ),
+            UpdateMany(
+                {**author_filter, "_type": thread_type},
+                {"$set": {**anonymized_fields, "title": "[deleted]"}},
+            ),
+        ],
+        ordered=False,
+    )
+
+    logger.info(f"Anonymized {sum(group['count'] for group in groups)} comment(s)")
+
+    return groups
+
+
+def anonymize_users_comments(usernames: list[str]) -> dict[str, int]:
+    """Anonymize comments and threads of many users at once.
+
+    Parameters:
+    usernames (list[str]): The usernames of the users to delete comments from.
+
+    Returns the number of comments anonymized for each username having comments.
+    """
+    if not usernames:
+        return {}
+
+    counts = Counter()
+    for group in _anonymize_authors_comments({"author_username": {"$in": usernames}}):
+        counts[group["author_username"]] += group["count"]
+    return dict(counts)
+
+
+def anonymize_authors_comments(authors: dict[int, str]) -> dict[int, int]:
+    """Anonymize comments and threads of many users at once.
+
+    Comments are matched on the author id, or on the username for comments left
+    without author id, usernames of other authors being possibly reused.
+
+    Parameters:
+    authors (dict[int, str]): The usernames of the users to delete comments from,
+        by edX id.
+
+    Returns the number of comments anonymized for each author id having comments.
+    """
+    if not authors:
+        return {}
+
+    author_ids = {username: author_id for author_id, username in authors.items()}
+    counts = Counter()
+    for group in _anonymize_authors_comments(
+        {
+            "$or": [
+                {"author_id": {"$in": list(authors)}},
+                {"author_username": {"$in": list(author_ids)}, "author_id": None},
+            ]
+        }
+    ):
+        author_id = group.get("author_id")
+        if author_id not in authors:
+            author_id = author_ids[group["author_username"]]
+        counts[author_id] += group["count"]
+    return dict(counts)
+
+
+def anonymize_comments(username: str, author_id: int | None = None) -> int:
     """Anonymize user comments and threads.
 
+    Comments are matched on the author id when it is provided, or on the
+    username.
+
     Parameters:
     username (str): The username of the user to delete comments from.
+    author_id (int): The edX id of the user to delete comments from.
 
     Returns the number of comments anonymized.
     """
-    comments = Comment.objects(Q(author_username=username)).all()
+    if author_id is not None:
+        return anonymize_authors_comments({author_id: username}).get(author_id, 0)
+    return anonymize_users_comments([username]).get(username, 0)
 
-    comment_count = comments.update(
-        author_username="[deleted]",
-        body="[deleted]",
-        author_id=settings.EDX_FORUM_PLACEHOLDER_USER_ID,
-        anonymous=True,
-    )
 
-    comment_threads = CommentThread.objects(Q(author_username=username)).all()
+def _get_plan_stages(plan: dict) -> list[dict]:
+    """Get the stages of a query plan and of all its input stages."""
+    stages = [plan]
+    if "inputStage" in plan:
+        stages += _get_plan_stages(plan["inputStage"])
+    for input_stage in plan.get("inputStages", []):
+        stages += _get_plan_stages(input_stage)
+    return stages
 
-    comment_count += comment_threads.update(
-        author_username="[deleted]",
-        title="[deleted]",
-        body="[deleted]",
-        author_id=settings.EDX_FORUM_PLACEHOLDER_USER_ID,
-        anonymous=True,
-    )
 
-    logger.info(f"Anonymized {comment_count} comment(s)")
+def is_authors_query_indexed(field: str) -> bool:
+    """Check with the query planner that matching authors on a field uses an index.
+
+    The filter used to anonymize comments is explained on the `contents`
+    collection, with placeholder values of the field.
+
+    Parameters:
+    field (str): The field used to match the authors of comments.
+
+    Returns True if the winning plan of the query scans an index prefixed by the
+    field, without any collection scan.
+    """
+    placeholders = {
+        "author_id": settings.EDX_FORUM_PLACEHOLDER_USER_ID,
+        "author_username": "[deleted]",
+    }
+    collection = Comment._get_collection()  # noqa: SLF001
+    explanation = collection.find(
+        {field: {"$in": [placeholders.get(field)]}, "_type": Comment.type.default}
+    ).explain()
 
-    return comment_count
+    winning_plan = explanation["queryPlanner"]["winningPlan"]
+    # Plans executed by the slot based engine wrap the classic query plan
+    stages = _get_plan_stages(winning_plan.get("queryPlan", winning_plan))
+    if any(stage["stage"] == "COLLSCAN" for stage in stages):
+        return False
+    return any(
+        stage["stage"] == "IXSCAN"
+        and next(iter(stage.get("keyPattern", {})), None) == field
+        for stage in stages
+    )
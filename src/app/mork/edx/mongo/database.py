@@ -1,26 +1,61 @@
 """Mork edx MongoDB database connection."""
 
+import logging
+import os
+
 from mongoengine import connect, disconnect
+from pymongo import MongoClient
 
 from mork.conf import settings
+from mork.utils import ProcessLocal
+
+logger = logging.getLogger(__name__)
+
+
+def _connect() -> MongoClient:
+    """Open the connection of the current process."""
+    logger.debug("Opening MongoDB connection for process %s", os.getpid())
+    return connect(
+        host=settings.EDX_MONGO_DB_HOST,
+        username=settings.EDX_MONGO_DB_USER,
+        password=settings.EDX_MONGO_DB_PASSWORD,
+        db=settings.EDX_MONGO_DB_NAME,
+    )
+
+
+def _disconnect(_connection: MongoClient):
+    """Close the default connection, opened by the current or a parent process."""
+    logger.debug("Closing MongoDB connection for process %s", os.getpid())
+    disconnect()
 
 
 class OpenEdxMongoDB:
-    """Class to connect to the Open edX MongoDB database."""
+    """Class to connect to the Open edX MongoDB database.
+
+    Unless a connection is provided, instances share the connection of the current
+    process, which is opened once and reused by all MongoDB operations.
+    """
 
     connection = None
 
+    _process_connection = ProcessLocal(_connect, close=_disconnect, release=_disconnect)
+
     def __init__(self, connection=None):
         """Instantiate the MongoDB connection."""
         if connection is not None:
             self.connection = connection
         else:
-            self.connection = connect(
-                host=settings.EDX_MONGO_DB_HOST,
-                username=settings.EDX_MONGO_DB_USER,
-                password=settings.EDX_MONGO_DB_PASSWORD,
-                db=settings.EDX_MONGO_DB_NAME,
-            )
+            self.connection = self.get_process_connection()
+
+    @classmethod
+    def get_process_connection(cls) -> MongoClient:
+        """Get the connection of the current process, opening it if needed."""
+        return cls._process_connection.get()
+
+    @classmethod
+    def close_process_connection(cls):
+        """Close the connection of the current process, if any."""
+        cls._process_connection.close()
 
     def disconnect(self):
         """Close the connection with MongoDB."""
@@ -1,12 +1,24 @@
 """Module for CRUD functions."""
 
 from datetime import datetime
+from functools import cache
+from itertools import batched, pairwise
 from logging import getLogger
-from typing import Optional
+from typing import Iterator, Optional
 
-from sqlalchemy import delete, distinct, select, union_all
-from sqlalchemy.orm import Session, load_only
-from sqlalchemy.sql.functions import count
+from sqlalchemy import (
+    Row,
+    Select,
+    delete,
+    distinct,
+    exists,
+    inspect,
+    select,
+    union_all,
+    update,
+)
+from sqlalchemy.orm import Mapper, RelationshipProperty, Session
+from sqlalchemy.orm.interfaces import ONETOMANY
 
 from mork.edx.mysql.models.auth import AuthtokenToken, AuthUser
 from mork.edx.mysql.models.certificates import (
@@ -26,57 +38,57 @@ from mork.exceptions import UserNotFound, UserProtected
 
 logger = getLogger(__name__)
 
+# Maximum number of ids passed as literals to a statement
+_IDS_CHUNK_SIZE = 1000
+
 
-def get_inactive_users_count(
+def iter_inactive_users(  # noqa: PLR0913
     session: Session,
     threshold_date: datetime,
-) -> int:
-    """Get inactive users count from edx database.
+    chunk_size: int,
+    limit: Optional[int] = None,
+    last_seen_id: Optional[int] = None,
+    since_date: Optional[datetime] = None,
+    exclude_protected: bool = False,
+) -> Iterator[Row]:
+    """Stream users from edx database who have not logged in for a specified period.
 
-    SELECT count(auth_user.id) FROM auth_user
-    """
-    query = (
-        select(count(distinct(AuthUser.id)))
-        .prefix_with("SQL_NO_CACHE", dialect="mysql")
-        .filter(AuthUser.last_login < threshold_date)
-    )
-    return session.execute(query).scalar()
+    Rows are fetched from an unbuffered server-side cursor, `chunk_size` at a time,
+    and only hold the `id`, `username` and `email` columns, so that scanning all
+    inactive users never loads them in memory as mapped objects.
 
+    When `since_date` is provided, only users who last logged in after this date,
+    i.e. who crossed the threshold since a scan performed with `since_date` as
+    threshold, are returned.
 
-def get_inactive_users(
-    session: Session,
-    threshold_date: datetime,
-    offset: Optional[int] = 0,
-    limit: Optional[int] = 0,
-) -> list[AuthUser]:
-    """Get users from edx database who have not logged in for a specified period.
-
-    SELECT auth_user.id,
-        auth_user.username,
-        auth_user.email,
-        auth_user.is_staff,
-        auth_user.is_superuser,
-        auth_user.last_login,
-    FROM auth_user LIMIT :param_1 OFFSET :param_2
+    When `exclude_protected` is set, staff members, superusers and users linked to a
+    protected table are left out with anti-joins on the protected tables.
+
+    SELECT auth_user.id, auth_user.username, auth_user.email
+    FROM auth_user
+    WHERE auth_user.last_login < :threshold_date
+        AND auth_user.last_login >= :since_date
+        AND auth_user.id > :last_seen_id
+    ORDER BY auth_user.id LIMIT :param_1
     """
     query = (
-        select(AuthUser)
+        select(AuthUser.id, AuthUser.username, AuthUser.email)
         .prefix_with("SQL_NO_CACHE", dialect="mysql")
-        .options(
-            load_only(
-                AuthUser.id,
-                AuthUser.username,
-                AuthUser.email,
-                AuthUser.is_staff,
-                AuthUser.is_superuser,
-                AuthUser.last_login,
-            ),
-        )
         .filter(AuthUser.last_login < threshold_date)
-        .offset(offset)
-        .limit(limit)
     )
-    return session.scalars(query).unique().all()
+    if since_date is not None:
+        query = query.filter(AuthUser.last_login >= since_date)
+    if last_seen_id is not None:
+        query = query.filter(AuthUser.id > last_seen_id)
+    if exclude_protected:
+        query = _exclude_protected_users(query)
+
+    query = query.order_by(AuthUser.id).execution_options(yield_per=chunk_size)
+    if limit:
+        query = query.limit(limit)
+
+    with session.execute(query) as result:
+        yield from result
 
 
 def get_user(session: Session, email: str) -> AuthUser:
@@ -90,24 +102,54 @@ def get_user(session: Session, email: str) -> AuthUser:
     return session.execute(query).scalar()
 
 
+def get_users(session: Session, emails: list[str]) -> list[Row]:
+    """Get the id, username and email of the users matching the provided emails.
+
+    Parameters:
+    session (Session): SQLAlchemy session object.
+    emails (list[str]): The emails of the users to get.
+    """
+    query = select(AuthUser.id, AuthUser.username, AuthUser.email).where(
+        AuthUser.email.in_(emails)
+    )
+    return session.execute(query).all()
+
+
+# Columns referencing users in tables that prevent them from being deleted
+_PROTECTED_COLUMNS = (
+    AuthtokenToken.user_id,
+    CertificatesCertificatehtmlviewconfiguration.changed_by_id,
+    ContentstoreVideouploadconfig.changed_by_id,
+    CourseActionStateCoursererunstate.created_user_id,
+    CourseActionStateCoursererunstate.updated_user_id,
+    CourseCreatorsCoursecreator.user_id,
+    DarkLangDarklangconfig.changed_by_id,
+    UtilRatelimitconfiguration.changed_by_id,
+    VerifyStudentHistoricalverificationdeadline.history_user_id,
+    WikiArticle.owner_id,
+    WikiArticlerevision.user_id,
+)
+
+
+def _exclude_protected_users(query: Select) -> Select:
+    """Filter out privileged users and users linked to a protected table.
+
+    AND auth_user.is_staff = 0 AND auth_user.is_superuser = 0
+    AND NOT (EXISTS (SELECT * FROM authtoken_token
+        WHERE authtoken_token.user_id = auth_user.id))
+    AND ...
+    """
+    return query.filter(
+        AuthUser.is_staff == 0,
+        AuthUser.is_superuser == 0,
+        *(~exists().where(column == AuthUser.id) for column in _PROTECTED_COLUMNS),
+    )
+
+
 def _has_protected_children(session: Session, user_id) -> bool:
     """Check if user has an entry in a protected children table."""
     union_statement = union_all(
-        select(1).where(AuthtokenToken.user_id == user_id),
-        select(1).where(
-            CertificatesCertificatehtmlviewconfiguration.changed_by_id == user_id
-        ),
-        select(1).where(ContentstoreVideouploadconfig.changed_by_id == user_id),
-        select(1).where(CourseActionStateCoursererunstate.created_user_id == user_id),
-        select(1).where(CourseActionStateCoursererunstate.updated_user_id == user_id),
-        select(1).where(CourseCreatorsCoursecreator.user_id == user_id),
-        select(1).where(DarkLangDarklangconfig.changed_by_id == user_id),
-        select(1).where(UtilRatelimitconfiguration.changed_by_id == user_id),
-        select(1).where(
-            VerifyStudentHistoricalverificationdeadline.history_user_id == user_id
-        ),
-        select(1).where(WikiArticle.owner_id == user_id),
-        select(1).where(WikiArticlerevision.user_id == user_id),
+        *(select(1).where(column == user_id) for column in _PROTECTED_COLUMNS)
     )
 
     # Execute the union query and check if any results exist
@@ -115,6 +157,119 @@ def _has_protected_children(session: Session, user_id) -> bool:
     return bool(result)
 
 
+def _get_protected_user_ids(session: Session, user_ids: list[int]) -> set[int]:
+    """Get the ids of the users having an entry in a protected children table.
+
+    One query is issued per protected column, only for the users that have not
+    already been found protected.
+    """
+    protected_ids = set()
+    for column in _PROTECTED_COLUMNS:
+        remaining_ids = [
+            user_id for user_id in user_ids if user_id not in protected_ids
+        ]
+        if not remaining_ids:
+            break
+        protected_ids.update(
+            session.scalars(
+                select(distinct(column)).where(column.in_(remaining_ids))
+            ).all()
+        )
+    return protected_ids
+
+
+@cache
+def _get_deletion_plan(
+    mapper: Mapper = None, path: tuple[RelationshipProperty, ...] = ()
+) -> list[tuple[tuple[RelationshipProperty, ...], bool]]:
+    """Walk the foreign keys graph of `auth_user` to plan the deletion of users.
+
+    Each step of the plan is the path of relationships from `auth_user` to a child
+    table, along with a flag telling if the referencing rows should be detached
+    (foreign key set to NULL) instead of deleted. The steps follow the cascades
+    configured on the models and are ordered so that children are always cleaned
+    before their parents.
+    """
+    mapper = mapper or inspect(AuthUser)
+    plan = []
+    for relationship in mapper.relationships:
+        if relationship.direction is not ONETOMANY:
+            continue
+        relationships = (*path, relationship)
+        if relationship.cascade.delete:
+            plan.extend(_get_deletion_plan(relationship.mapper, relationships))
+            plan.append((relationships, False))
+        else:
+            plan.append((relationships, True))
+    return plan
+
+
+def _get_ids(session: Session, key, foreign_key, ids: list[int]) -> list[int]:
+    """Get the `key` of the rows whose `foreign_key` is in `ids`, by chunks."""
+    return [
+        id_
+        for chunk in batched(ids, _IDS_CHUNK_SIZE)
+        for id_ in session.scalars(select(key).where(foreign_key.in_(chunk)))
+    ]
+
+
+def _execute_step(
+    session: Session,
+    user_ids: list[int],
+    relationships: tuple[RelationshipProperty, ...],
+    detach: bool,
+    resolved_ids: dict,
+) -> None:
+    """Execute a deletion plan step for the given users.
+
+    The ids of the intermediate tables are fetched first, and shared by the steps
+    through `resolved_ids`, then passed as literal lists: MySQL 5.7 cannot use a
+    semijoin for a single-table DELETE or UPDATE, and would run an
+    `IN (SELECT ...)` subquery as a dependent subquery scanning the whole table.
+    """
+    ids = user_ids
+    for depth, (relationship, child_relationship) in enumerate(
+        pairwise(relationships), start=1
+    ):
+        ((_, foreign_key),) = relationship.local_remote_pairs
+        ((key, _),) = child_relationship.local_remote_pairs
+        path = (relationships[:depth], key)
+        if path not in resolved_ids:
+            resolved_ids[path] = _get_ids(session, key, foreign_key, ids)
+        ids = resolved_ids[path]
+
+    ((_, foreign_key),) = relationships[-1].local_remote_pairs
+    for chunk in batched(ids, _IDS_CHUNK_SIZE):
+        if detach:
+            session.execute(
+                update(foreign_key.table)
+                .where(foreign_key.in_(chunk))
+                .values({foreign_key: None})
+            )
+        else:
+            session.execute(delete(foreign_key.table).where(foreign_key.in_(chunk)))
+
+
+def _delete_users(session: Session, user_ids: list[int]) -> None:
+    """Delete users and all their children entries with set-based statements."""
+    # Children are deleted before their parents, so that the ids of a parent table
+    # are still valid for all the steps of its children
+    resolved_ids = {}
+    for relationships, detach in _get_deletion_plan():
+        _execute_step(session, user_ids, relationships, detach, resolved_ids)
+
+    # Delete entries in student_courseenrollmentallowed table containing users email
+    emails = _get_ids(session, AuthUser.email, AuthUser.id, user_ids)
+    for chunk in batched(emails, _IDS_CHUNK_SIZE):
+        session.execute(
+            delete(StudentCourseenrollmentallowed.__table__).where(
+                StudentCourseenrollmentallowed.email.in_(chunk)
+            )
+        )
+
+    session.execute(delete(AuthUser.__table__).where(AuthUser.id.in_(user_ids)))
+
+
 def delete_user(session: Session, email: str) -> None:
     """Delete a user entry based on the provided email and username.
 
@@ -122,25 +277,49 @@ def delete_user(session: Session, email: str) -> None:
     session (Session): SQLAlchemy session object.
     email (str): The email of the user to delete.
     """
-    user_to_delete = session.scalar(select(AuthUser).where(AuthUser.email == email))
-    if not user_to_delete:
+    user_id = session.scalar(select(AuthUser.id).where(AuthUser.email == email))
+    if not user_id:
         msg = "User does not exist"
         logger.warning(msg)
         raise UserNotFound(msg)
 
-    if _has_protected_children(session, user_to_delete.id):
+    if _has_protected_children(session, user_id):
         msg = "User is linked to a protected table and cannot be deleted"
         logger.warning(msg)
         raise UserProtected(msg)
 
-    # Delete entries in student_courseenrollmentallowed table containing user email
-    session.execute(
-        delete(StudentCourseenrollmentallowed).where(
-            StudentCourseenrollmentallowed.email == email
-        )
-    )
-
     # Delete user from auth_user table and all its children
-    session.delete(user_to_delete)
+    _delete_users(session, [user_id])
 
     logger.debug(f"Deleting user {email=}")
+
+
+def delete_users(session: Session, emails: list[str]) -> list[str]:
+    """Delete the users matching the provided emails.
+
+    Users linked to a protected table are left untouched and unknown emails are
+    ignored.
+
+    Parameters:
+    session (Session): SQLAlchemy session object.
+    emails (list[str]): The emails of the users to delete.
+
+    Returns:
+    list[str]: The emails of the protected users that have not been deleted.
+    """
+    users = session.execute(
+        select(AuthUser.id, AuthUser.email).where(AuthUser.email.in_(emails))
+    ).all()
+
+    protected_ids = _get_protected_user_ids(session, [user.id for user in users])
+    protected_emails = [user.email for user in users if user.id in protected_ids]
+    user_ids = [user.id for user in users if user.id not in protected_ids]
+
+    if protected_emails:
+        logger.warning(f"{len(protected_emails)} users are linked to a protected table")
+
+    if user_ids:
+        _delete_users(session, user_ids)
+        logger.debug(f"Deleting {len(user_ids)} users")
+
+    return protected_emails
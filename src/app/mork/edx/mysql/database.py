@@ -1,31 +1,67 @@
 """Mork edx MySQL database connection."""
 
 import logging
+import os
 
-from sqlalchemy import create_engine
+from sqlalchemy import Engine, create_engine
 from sqlalchemy.orm import Session
 
 from mork.conf import settings
+from mork.utils import ProcessLocal
 
 logger = logging.getLogger(__name__)
 
 
+def _create_engine() -> Engine:
+    """Create the engine of the current process."""
+    logger.debug("Creating edX MySQL engine for process %s", os.getpid())
+    return create_engine(
+        settings.EDX_MYSQL_DB_URL,
+        echo=settings.EDX_MYSQL_DB_DEBUG,
+        pool_size=settings.EDX_MYSQL_DB_POOL_SIZE,
+        pool_recycle=settings.EDX_MYSQL_DB_POOL_RECYCLE,
+        pool_pre_ping=settings.EDX_MYSQL_DB_POOL_PRE_PING,
+    )
+
+
+def _dispose_engine(engine: Engine):
+    """Close the pooled connections of the engine of the current process."""
+    logger.debug("Disposing edX MySQL engine for process %s", os.getpid())
+    engine.dispose(close=True)
+
+
 class OpenEdxMySQLDB:
-    """Class to connect to the Open edX MySQL database."""
+    """Class to connect to the Open edX MySQL database.
+
+    Unless an engine is provided, sessions are bound to the engine of the current
+    process, whose connection pool is created once and shared by all instances.
+    """
 
     session = None
 
+    _process_engine = ProcessLocal(
+        _create_engine,
+        close=_dispose_engine,
+        release=lambda engine: engine.dispose(close=False),
+    )
+
     def __init__(self, engine=None, session=None):
         """Instantiate SQLAlchemy engine and session."""
         if engine is not None:
             self.engine = engine
         else:
-            self.engine = create_engine(
-                settings.EDX_MYSQL_DB_URL,
-                echo=settings.EDX_MYSQL_DB_DEBUG,
-                pool_pre_ping=True,
-            )
+            self.engine = self.get_process_engine()
         if session is not None:
             self.session = session
         else:
             self.session = Session(self.engine)
+
+    @classmethod
+    def get_process_engine(cls) -> Engine:
+        """Get the engine of the current process, creating it if needed."""
+        return cls._process_engine.get()
+
+    @classmethod
+    def dispose_process_engine(cls):
+        """Close the pooled connections of the current process engine, if any."""
+        cls._process_engine.close()
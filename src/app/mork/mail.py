@@ -1,23 +1,326 @@
 """Email related functions."""
 
+import os
 import smtplib
+import time
+from contextlib import contextmanager
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from functools import cache
 from logging import getLogger
-from smtplib import SMTPException
+from smtplib import SMTPException, SMTPRecipientsRefused, SMTPServerDisconnected
+from threading import Lock
+from typing import Iterator, Optional
 
-from jinja2 import Environment, FileSystemLoader
+import redis
+from celery.utils.time import rate
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template
 
 from mork.conf import settings
 from mork.exceptions import EmailSendError
 from mork.templatetags.extra_tags import SVGStaticTag
+from mork.utils import ProcessLocal
 
 logger = getLogger(__name__)
 
+EMAIL_RATE_LIMIT_KEY = "mork:emails:rate_limit"
 
-def render_template(template: str, context) -> str:
-    """Render a Jinja template into HTML."""
-    template_env = Environment(
+# Reserve a token of the bucket and return the delay before it is available. Tokens
+# can be reserved ahead of their refill, so that senders are served in order.
+EMAIL_RATE_LIMIT_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated_at, 0) * rate) - 1
+redis.call("HSET", KEYS[1], "tokens", tokens, "updated_at", now)
+redis.call("EXPIRE", KEYS[1], math.ceil((capacity - tokens) / rate) + 1)
+if tokens >= 0 then
+    return "0"
+end
+return tostring(-tokens / rate)
+"""
+
+
+class SMTPConnectionPool:
+    """Pool of authenticated SMTP connections reused to send emails.
+
+    Connections are opened lazily and kept open between emails. They are recycled
+    after sending `EMAIL_CONNECTION_MAX_MESSAGES` messages or being idle for
+    `EMAIL_CONNECTION_MAX_IDLE` seconds, and replaced when closed by the server.
+    Each process has its own pool.
+    """
+
+    _process_pool = ProcessLocal(
+        lambda: SMTPConnectionPool.from_settings(),
+        close=lambda pool: pool.close(),
+    )
+
+    def __init__(self, max_messages: int, max_idle: float):
+        """Create an empty pool."""
+        self.max_messages = max_messages
+        self.max_idle = max_idle
+        self._idle_connections = []
+        self._lock = Lock()
+
+    @classmethod
+    def from_settings(cls) -> "SMTPConnectionPool":
+        """Create a pool recycling connections as configured in the settings."""
+        logger.debug("Creating SMTP connection pool for process %s", os.getpid())
+        return cls(
+            max_messages=settings.EMAIL_CONNECTION_MAX_MESSAGES,
+            max_idle=settings.EMAIL_CONNECTION_MAX_IDLE,
+        )
+
+    @classmethod
+    def get_process_pool(cls) -> "SMTPConnectionPool":
+        """Get the pool of the current process, creating it if needed.
+
+        Connections of a pool inherited from a parent process are left to the
+        parent, without sending them a QUIT command.
+        """
+        return cls._process_pool.get()
+
+    @classmethod
+    def close_process_pool(cls):
+        """Close the connections of the current process pool, if any."""
+        cls._process_pool.close()
+
+    @staticmethod
+    def connect() -> smtplib.SMTP:
+        """Open a new SMTP connection, authenticated if credentials are set."""
+        connection = smtplib.SMTP(host=settings.EMAIL_HOST, port=settings.EMAIL_PORT)
+        try:
+            if settings.EMAIL_USE_TLS:
+                connection.starttls()
+            if settings.EMAIL_HOST_USER and settings.EMAIL_HOST_PASSWORD:
+                connection.login(
+                    user=settings.EMAIL_HOST_USER,
+                    password=settings.EMAIL_HOST_PASSWORD,
+                )
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    @staticmethod
+    def _quit(connection: smtplib.SMTP):
+        """Close an SMTP connection, politely if possible."""
+        try:
+            connection.quit()
+        except (SMTPException, OSError):
+            connection.close()
+
+    def acquire(self) -> tuple[smtplib.SMTP, int]:
+        """Get an idle connection, or a new one, with its number of messages sent."""
+        with self._lock:
+            while self._idle_connections:
+                connection, messages, released_at = self._idle_connections.pop()
+                if time.monotonic() - released_at <= self.max_idle:
+                    return connection, messages
+                self._quit(connection)
+        return self.connect(), 0
+
+    def release(self, connection: smtplib.SMTP, messages: int):
+        """Put a connection back in the pool, unless it must be recycled."""
+        if self.max_messages and messages >= self.max_messages:
+            self._quit(connection)
+            return
+        with self._lock:
+            self._idle_connections.append((connection, messages, time.monotonic()))
+
+    @contextmanager
+    def connection(self) -> Iterator["SMTPSession"]:
+        """Hold a connection of the pool to send many emails."""
+        session = SMTPSession(self)
+        try:
+            yield session
+        finally:
+            session.release()
+
+    def sendmail(self, from_addr: str, to_addrs: str | list[str], msg: str):
+        """Send an email with a pooled connection."""
+        with self.connection() as session:
+            session.sendmail(from_addr, to_addrs, msg)
+
+    def close(self):
+        """Close all idle connections of the pool."""
+        with self._lock:
+            connections, self._idle_connections = self._idle_connections, []
+        for connection, _, _ in connections:
+            self._quit(connection)
+
+
+class SMTPSession:
+    """SMTP connection held from a pool to send emails.
+
+    The connection is acquired on the first email. It is replaced when closed by
+    the server, or after an error leaving it in an unknown state, and recycled once
+    it has sent the maximum number of messages of the pool.
+    """
+
+    def __init__(self, pool: SMTPConnectionPool):
+        """Instantiate a session without connection."""
+        self.pool = pool
+        self.connection = None
+        self.messages = 0
+
+    def sendmail(self, from_addr: str, to_addrs: str | list[str], msg: str):
+        """Send an email with the connection of the session."""
+        if self.connection is None:
+            self.connection, self.messages = self.pool.acquire()
+
+        try:
+            try:
+                self.connection.sendmail(from_addr, to_addrs, msg)
+            except SMTPServerDisconnected:
+                logger.info("SMTP connection closed by the server, reconnecting")
+                self.connection.close()
+                self.connection, self.messages = self.pool.connect(), 0
+                self.connection.sendmail(from_addr, to_addrs, msg)
+        except SMTPRecipientsRefused:
+            # The connection can still be used for other recipients
+            self.messages += 1
+            raise
+        except BaseException:
+            self.connection.close()
+            self.connection = None
+            raise
+
+        self.messages += 1
+        if self.pool.max_messages and self.messages >= self.pool.max_messages:
+            self.release()
+
+    def release(self):
+        """Give the connection back to the pool."""
+        if self.connection is not None:
+            self.pool.release(self.connection, self.messages)
+            self.connection = None
+
+
+class EmailRateLimiter:
+    """Rate limit of emails shared by all senders of the cluster.
+
+    Senders reserve the tokens of a token bucket stored in the Celery Redis broker,
+    refilled at `EMAIL_GLOBAL_RATE_LIMIT` tokens per second up to
+    `EMAIL_GLOBAL_RATE_LIMIT_BURST` tokens, and wait until their token is available.
+    The total send rate thus does not grow with the number of workers. The time
+    waited and throttle events of each process are counted.
+    """
+
+    _process_limiter = ProcessLocal(
+        lambda: EmailRateLimiter.from_settings(),
+        close=lambda limiter: limiter.close(),
+    )
+
+    def __init__(self, client: redis.Redis, rate: float, capacity: int):
+        """Instantiate a rate limiter sharing its bucket through a Redis client."""
+        self.client = client
+        self.rate = rate
+        self.capacity = capacity
+        self._reserve = client.register_script(EMAIL_RATE_LIMIT_SCRIPT)
+        self.acquired = 0
+        self.throttled = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @classmethod
+    def from_settings(cls) -> "EmailRateLimiter":
+        """Create a rate limiter sharing its bucket through the Celery broker."""
+        return cls(
+            client=redis.Redis.from_url(settings.broker_url),
+            rate=rate(settings.EMAIL_GLOBAL_RATE_LIMIT),
+            capacity=settings.EMAIL_GLOBAL_RATE_LIMIT_BURST,
+        )
+
+    @classmethod
+    def get_process_limiter(cls) -> Optional["EmailRateLimiter"]:
+        """Get the rate limiter of the current process, or None if disabled."""
+        if not settings.EMAIL_GLOBAL_RATE_LIMIT:
+            return None
+        return cls._process_limiter.get()
+
+    @classmethod
+    def get_process_usage(cls) -> dict:
+        """Get the usage of the rate limit by the current process."""
+        limiter = cls._process_limiter.peek()
+        if limiter is None:
+            return {}
+        return limiter.get_usage()
+
+    @classmethod
+    def close_process_limiter(cls):
+        """Close the Redis connections of the current process limiter, if any."""
+        cls._process_limiter.close()
+
+    def close(self):
+        """Close the Redis connections of the rate limiter."""
+        logger.info(
+            "Closing email rate limiter for process %s, usage: %s",
+            os.getpid(),
+            self.get_usage(),
+        )
+        self.client.close()
+
+    def acquire(self) -> float:
+        """Wait until an email can be sent, and return the time waited."""
+        delay = float(
+            self._reserve(keys=[EMAIL_RATE_LIMIT_KEY], args=[self.rate, self.capacity])
+        )
+        self.acquired += 1
+        if delay > 0:
+            logger.debug(f"Email rate limit reached, waiting {delay:.2f}s")
+            self.throttled += 1
+            self.wait_time += delay
+            self.max_wait_time = max(self.max_wait_time, delay)
+            time.sleep(delay)
+        return delay
+
+    def get_usage(self) -> dict:
+        """Get the number of emails sent and throttled, and the time waited."""
+        return {
+            "rate": self.rate,
+            "capacity": self.capacity,
+            "acquired": self.acquired,
+            "throttled": self.throttled,
+            "wait_time": self.wait_time,
+            "max_wait_time": self.max_wait_time,
+        }
+
+
+def _acquire_rate_limit():
+    """Wait until the global rate limit allows sending an email, if enabled."""
+    limiter = EmailRateLimiter.get_process_limiter()
+    if limiter is None:
+        return
+
+    try:
+        limiter.acquire()
+    except redis.RedisError as exc:
+        logger.error(f"Acquiring email rate limit failed: {exc}")
+        raise EmailSendError("Failed acquiring the email rate limit") from exc
+
+
+@cache
+def get_template_environment() -> Environment:
+    """Get the Jinja environment of the process, creating it if needed.
+
+    Compiled templates are kept in memory by the environment. They are also stored
+    on disk if `EMAIL_TEMPLATES_BYTECODE_CACHE_PATH` is set, so that new processes
+    skip their compilation. Changes of template files are only checked if
+    `EMAIL_TEMPLATES_AUTO_RELOAD` is enabled.
+    """
+    bytecode_cache = None
+    if settings.EMAIL_TEMPLATES_BYTECODE_CACHE_PATH:
+        settings.EMAIL_TEMPLATES_BYTECODE_CACHE_PATH.mkdir(parents=True, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(
+            settings.EMAIL_TEMPLATES_BYTECODE_CACHE_PATH
+        )
+
+    return Environment(
         loader=FileSystemLoader(
             [
                 settings.ROOT_PATH / "templates/html",
@@ -26,13 +329,21 @@ def render_template(template: str, context) -> str:
         ),
         autoescape=True,
         extensions=[SVGStaticTag],
+        auto_reload=settings.EMAIL_TEMPLATES_AUTO_RELOAD,
+        bytecode_cache=bytecode_cache,
     )
-    template = template_env.get_template(template)
+
+
+def render_template(template: str, context) -> str:
+    """Render a Jinja template into HTML."""
+    template = get_template_environment().get_template(template)
     return template.render(**context)
 
 
-def send_email(email_address: str, username: str):
-    """Initialize connection to SMTP and send a warning email."""
+def _create_warning_message(
+    email_address: str, username: str, html_template: Template, text_template: Template
+) -> MIMEMultipart:
+    """Create the warning email of a user from the loaded templates."""
     template_vars = {
         "title": "Votre compte va être supprimé dans 30 jours.",
         "email": email_address,
@@ -43,15 +354,8 @@ def send_email(email_address: str, username: str):
             "login_url": settings.EMAIL_SITE_LOGIN_URL,
         },
     }
-    html = render_template(
-        "warning_email.html",
-        template_vars,
-    )
-
-    text = render_template(
-        "warning_email.txt",
-        template_vars,
-    )
+    html = html_template.render(**template_vars)
+    text = text_template.render(**template_vars)
 
     # Create a multipart message (with MIME type multipart/alternative) and set headers
     message = MIMEMultipart("alternative")
@@ -64,23 +368,76 @@ def send_email(email_address: str, username: str):
     message.attach(MIMEText(text, "plain"))
     message.attach(MIMEText(html, "html"))
 
+    return message
+
+
+def _get_warning_templates() -> tuple[Template, Template]:
+    """Load the HTML and text templates of the warning email."""
+    template_env = get_template_environment()
+    return (
+        template_env.get_template("warning_email.html"),
+        template_env.get_template("warning_email.txt"),
+    )
+
+
+def send_email(email_address: str, username: str):
+    """Send a warning email with a pooled SMTP connection."""
+    message = _create_warning_message(
+        email_address, username, *_get_warning_templates()
+    )
+
     # Send the email
-    with smtplib.SMTP(
-        host=settings.EMAIL_HOST, port=settings.EMAIL_PORT
-    ) as smtp_server:
-        if settings.EMAIL_USE_TLS:
-            smtp_server.starttls()
-        if settings.EMAIL_HOST_USER and settings.EMAIL_HOST_PASSWORD:
-            smtp_server.login(
-                user=settings.EMAIL_HOST_USER,
-                password=settings.EMAIL_HOST_PASSWORD,
-            )
-        try:
-            smtp_server.sendmail(
-                from_addr=settings.EMAIL_FROM,
-                to_addrs=email_address,
-                msg=message.as_string(),
-            )
-        except SMTPException as exc:
-            logger.error(f"Sending email failed: {exc} ")
-            raise EmailSendError("Failed sending an email") from exc
+    _acquire_rate_limit()
+    try:
+        SMTPConnectionPool.get_process_pool().sendmail(
+            from_addr=settings.EMAIL_FROM,
+            to_addrs=email_address,
+            msg=message.as_string(),
+        )
+    except (SMTPException, OSError) as exc:
+        logger.error(f"Sending email failed: {exc} ")
+        raise EmailSendError("Failed sending an email") from exc
+
+
+def send_emails(
+    users: list[tuple[str, str]], interval: float = 0
+) -> dict[str, EmailSendError]:
+    """Send warning emails to many users over a single SMTP connection.
+
+    Templates are loaded once for all emails, and a connection of the process pool
+    is held until all emails are sent. Emails are also paced by the global rate
+    limit, if enabled.
+
+    Parameters:
+    users (list): The `(email_address, username)` of the users to warn.
+    interval (float): The number of seconds to wait between two emails.
+
+    Returns the error of each email address whose email could not be sent.
+    """
+    templates = _get_warning_templates()
+
+    errors = {}
+    with SMTPConnectionPool.get_process_pool().connection() as smtp:
+        for index, (email_address, username) in enumerate(users):
+            if index and interval:
+                time.sleep(interval)
+
+            message = _create_warning_message(email_address, username, *templates)
+            try:
+                _acquire_rate_limit()
+            except EmailSendError as exc:
+                errors[email_address] = exc
+                continue
+            try:
+                smtp.sendmail(
+                    from_addr=settings.EMAIL_FROM,
+                    to_addrs=email_address,
+                    msg=message.as_string(),
+                )
+            except (SMTPException, OSError) as exc:
+                # Connection errors only fail the current email, the next one
+                # being sent over a new connection
+                logger.error(f"Sending email failed: {exc} ")
+                errors[email_address] = EmailSendError("Failed sending an email")
+
+    return errors
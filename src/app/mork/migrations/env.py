@@ -10,7 +10,7 @@ from mork.conf import settings
 
 # Nota bene: be sure to import all models that need to be migrated here
 from mork.models import Base
-from mork.models.tasks import EmailStatus
+from mork.models.tasks import EmailOutbox, EmailStatus, ScanCheckpoint
 from mork.models.users import UserServiceStatus, User
 
 # this is the Alembic Config object, which provides
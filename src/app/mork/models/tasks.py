@@ -1,9 +1,10 @@
 """Mork tasks models."""
 
 from datetime import datetime
+from typing import Optional
 from uuid import uuid4
 
-from sqlalchemy import DateTime, String
+from sqlalchemy import DateTime, Index, Integer, String, text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -20,3 +21,46 @@ class EmailStatus(Base):
     id: Mapped[int] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4)
     email: Mapped[str] = mapped_column(String(254), unique=True)
     sent_date: Mapped[datetime] = mapped_column(DateTime)
+
+
+class EmailOutbox(Base):
+    """Model for storing the warning emails waiting to be sent.
+
+    Pending emails have no `sent_date`. They are claimed by batches by the email
+    drainers, retried from `next_attempt_at` after a failure, and given up after
+    `EMAIL_MAX_RETRIES` failed `attempts`.
+    """
+
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        Index(
+            "idx_email_outbox_pending",
+            "created_at",
+            postgresql_where=text("sent_date IS NULL"),
+        ),
+    )
+
+    filtered_attrs = ["email", "username"]
+
+    id: Mapped[int] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    email: Mapped[str] = mapped_column(String(254), unique=True)
+    username: Mapped[str] = mapped_column(String(254))
+    sent_date: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    next_attempt_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+
+
+class ScanCheckpoint(Base):
+    """Model for storing the progress of inactive users scans.
+
+    A scan in progress is identified by its `threshold_date` and the `last_user_id`
+    watermark of the last processed edX user. Once the scan is completed, the
+    watermark is cleared and its threshold is kept as `completed_threshold_date`.
+    """
+
+    __tablename__ = "scan_checkpoints"
+
+    task_name: Mapped[str] = mapped_column(String(255), primary_key=True)
+    threshold_date: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    last_user_id: Mapped[Optional[int]] = mapped_column(Integer)
+    completed_threshold_date: Mapped[Optional[datetime]] = mapped_column(DateTime)
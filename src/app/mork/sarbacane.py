@@ -0,0 +1,166 @@
+"""Mork Sarbacane API client."""
+
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from logging import getLogger
+
+import httpx
+from celery.utils.time import rate
+
+from mork.conf import settings
+
+logger = getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket limiting the rate of requests.
+
+    Tokens are refilled at `rate` tokens per second, up to `capacity` tokens, and
+    each request consumes one token. The bucket can be paused, e.g. when the server
+    asks to slow down, so that no request is sent until the pause is over.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        """Create a full bucket."""
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+
+    def _refill(self):
+        """Add the tokens earned since the last refill or the end of the pause."""
+        now = time.monotonic()
+        if now <= self.updated_at:
+            return
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    async def acquire(self):
+        """Wait until a token is available, then consume it."""
+        while True:
+            now = time.monotonic()
+            if self.paused_until > now:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.requests += 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, delay: float):
+        """Stop handing out tokens for `delay` seconds, then restart from empty."""
+        self._refill()
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        # Tokens are not earned during the pause
+        self.updated_at = self.paused_until
+        self.throttled += 1
+
+    def get_usage(self) -> dict:
+        """Get the current usage of the bucket budget."""
+        self._refill()
+        return {
+            "rate": self.rate,
+            "capacity": self.capacity,
+            "available": int(self.tokens),
+            "requests": self.requests,
+            "throttled": self.throttled,
+        }
+
+
+class SarbacaneClient(httpx.AsyncClient):
+    """Asynchronous client of the Sarbacane API.
+
+    Requests of all clients of a process share a token bucket budget of
+    `SARBACANE_RATE_LIMIT` requests, with bursts of `SARBACANE_RATE_LIMIT_BURST`
+    requests. Throttled requests (`429` responses) pause the budget for the delay
+    of the `Retry-After` header, or a jittered exponential backoff, and are retried
+    up to `SARBACANE_MAX_RETRIES` times.
+    """
+
+    _bucket = None
+
+    def __init__(self, **kwargs):
+        """Instantiate the client with the Sarbacane API URL and credentials."""
+        super().__init__(
+            base_url=settings.SARBACANE_API_URL,
+            headers={
+                "accountId": f"{settings.SARBACANE_ACCOUNT_ID}",
+                "apiKey": f"{settings.SARBACANE_API_KEY}",
+            },
+            **kwargs,
+        )
+
+    @classmethod
+    def get_bucket(cls) -> TokenBucket:
+        """Get the token bucket of the current process, creating it if needed."""
+        if cls._bucket is None:
+            cls._bucket = TokenBucket(
+                rate=rate(settings.SARBACANE_RATE_LIMIT),
+                capacity=settings.SARBACANE_RATE_LIMIT_BURST,
+            )
+        return cls._bucket
+
+    @classmethod
+    def get_budget_usage(cls) -> dict:
+        """Get the current usage of the rate limit budget of the process."""
+        return cls.get_bucket().get_usage()
+
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        """Send a request within the rate limit budget, retrying throttled ones."""
+        bucket = self.get_bucket()
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            response = await super().send(request, **kwargs)
+            if (
+                response.status_code != httpx.codes.TOO_MANY_REQUESTS
+                or attempt >= settings.SARBACANE_MAX_RETRIES
+            ):
+                return response
+
+            await response.aclose()
+            delay = get_retry_delay(response, attempt)
+            logger.warning(
+                f"Sarbacane request throttled, retrying {request.url.path} "
+                f"in {delay:.2f}s"
+            )
+            bucket.pause(delay)
+            attempt += 1
+
+
+def get_retry_delay(response: httpx.Response, attempt: int) -> float:
+    """Get the delay before retrying a throttled request.
+
+    The delay of the `Retry-After` header, in seconds or as a date, is used when
+    provided, and an exponential backoff otherwise. A random jitter is added to
+    spread the retries of concurrent requests.
+    """
+    backoff = settings.SARBACANE_RETRY_BACKOFF
+    jitter = random.uniform(0, backoff)  # noqa: S311
+
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(float(retry_after), 0) + jitter
+        except ValueError:
+            pass
+        try:
+            retry_date = parsedate_to_datetime(retry_after)
+            delay = (retry_date - datetime.now(timezone.utc)).total_seconds()
+            return max(delay, 0) + jitter
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid Retry-After header: {retry_after}")
+
+    return backoff * 2**attempt + jitter
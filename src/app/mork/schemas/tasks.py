@@ -44,6 +44,7 @@ class DeleteInactiveUsers(TaskCreateBase):
 
     type: Literal[TaskType.DELETE_INACTIVE_USERS]
     limit: PositiveInt | None = None
+    incremental: bool | None = None
 
 
 class EmailInactiveUsers(TaskCreateBase):
@@ -51,6 +52,7 @@ class EmailInactiveUsers(TaskCreateBase):
 
     type: Literal[TaskType.EMAIL_INACTIVE_USERS]
     limit: PositiveInt | None = None
+    incremental: bool | None = None
 
 
 class DeleteUser(TaskCreateBase):
@@ -50,3 +50,9 @@ class UserStatusUpdate(BaseModel):
     id: UUID
     service_name: ServiceName
     status: DeletionStatus
+
+
+class UserStatusBulkUpdate(UserStatusUpdate):
+    """Model for response after updating many user statuses."""
+
+    updated: bool
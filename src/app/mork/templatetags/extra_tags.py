@@ -3,7 +3,7 @@
 from jinja2_simple_tags import StandaloneTag
 
 from mork.conf import settings
-from mork.utils import svg_to_datauri
+from mork.utils import get_svg_datauri
 
 
 class SVGStaticTag(StandaloneTag):
@@ -13,7 +13,4 @@ class SVGStaticTag(StandaloneTag):
 
     def render(self, path: str):
         """Return a SVG static file into data URI format."""
-        full_path = settings.STATIC_PATH / path
-        if full_path.exists():
-            return svg_to_datauri(full_path)
-        return ""
+        return get_svg_datauri(settings.STATIC_PATH / path) or ""
@@ -22,6 +22,7 @@ async def test_tasks_auth(http_client: AsyncClient):
     [
         {"type": "email_inactive_users", "dry_run": False},
         {"type": "email_inactive_users", "limit": 100, "dry_run": False},
+        {"type": "email_inactive_users", "incremental": True, "dry_run": False},
         {
             "type": "email_user",
             "email": "johndoe@example.com",
@@ -30,6 +31,7 @@ async def test_tasks_auth(http_client: AsyncClient):
         },
         {"type": "delete_inactive_users", "dry_run": False},
         {"type": "delete_inactive_users", "limit": 100, "dry_run": False},
+        {"type": "delete_inactive_users", "incremental": True, "dry_run": False},
         {"type": "delete_user", "email": "johndoe@example.com", "dry_run": False},
         {"type": "delete_user", "email": "johndoe@wrong.email.", "dry_run": False},
         {"type": "email_inactive_users", "dry_run": True},
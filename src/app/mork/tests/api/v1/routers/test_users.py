@@ -28,6 +28,7 @@ async def test_users_auth(http_client: AsyncClient):
     assert (await http_client.get("/v1/users/foo")).status_code == 403
     assert (await http_client.get("/v1/users/foo/status/bar")).status_code == 403
     assert (await http_client.patch("/v1/users/foo/status/bar")).status_code == 403
+    assert (await http_client.patch("/v1/users/status")).status_code == 403
 
 
 @pytest.mark.anyio
@@ -719,3 +720,95 @@ async def test_users_update_status_invalid_status(
 
     # Assert the request fails
     assert response.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_users_update_statuses(
+    db_session, http_client: AsyncClient, auth_headers: dict
+):
+    """Test the behavior of updating the deletion statuses of many users at once."""
+    UserServiceStatusFactory._meta.sqlalchemy_session = db_session
+    UserFactory._meta.sqlalchemy_session = db_session
+
+    user1, user2 = UserFactory.create_batch(2)
+    db_session.flush()
+    unknown_id = uuid4()
+    statuses = [
+        {"id": str(user1.id), "service_name": "edx", "status": "deleted"},
+        {"id": str(user2.id), "service_name": "edx", "status": "deleting"},
+        {"id": str(unknown_id), "service_name": "edx", "status": "deleted"},
+        {"id": str(user2.id), "service_name": "ashley", "status": "deleted"},
+    ]
+
+    response = await http_client.patch(
+        "/v1/users/status", headers=auth_headers, json=statuses
+    )
+
+    assert response.status_code == 200
+
+    # Assert each status is reported in the order of the request
+    assert response.json() == [
+        {**statuses[0], "updated": True},
+        {**statuses[1], "updated": True},
+        {**statuses[2], "updated": False},
+        {**statuses[3], "updated": True},
+    ]
+
+    # Assert the statuses have been updated
+    updated_statuses = db_session.execute(
+        select(
+            UserServiceStatus.user_id,
+            UserServiceStatus.service_name,
+            UserServiceStatus.status,
+        ).where(UserServiceStatus.status != DeletionStatus.TO_DELETE)
+    ).all()
+    assert sorted(updated_statuses, key=str) == sorted(
+        [
+            (user1.id, ServiceName.EDX, DeletionStatus.DELETED),
+            (user2.id, ServiceName.EDX, DeletionStatus.DELETING),
+            (user2.id, ServiceName.ASHLEY, DeletionStatus.DELETED),
+        ],
+        key=str,
+    )
+
+
+@pytest.mark.anyio
+async def test_users_update_statuses_invalid_params(
+    db_session, http_client: AsyncClient, auth_headers: dict
+):
+    """Test the behavior of updating many users statuses with invalid parameters."""
+    UserServiceStatusFactory._meta.sqlalchemy_session = db_session
+    UserFactory._meta.sqlalchemy_session = db_session
+
+    user = UserFactory.create()
+    db_session.flush()
+
+    response = await http_client.patch(
+        "/v1/users/status",
+        headers=auth_headers,
+        json=[
+            {"id": str(user.id), "service_name": "edx", "status": "deleted"},
+            {"id": str(user.id), "service_name": "foo", "status": "deleted"},
+        ],
+    )
+
+    assert response.status_code == 422
+
+    # Assert no status has been updated
+    assert (
+        db_session.scalar(
+            select(func.count()).where(
+                UserServiceStatus.status == DeletionStatus.DELETED
+            )
+        )
+        == 0
+    )
+
+    # Too many statuses
+    response = await http_client.patch(
+        "/v1/users/status",
+        headers=auth_headers,
+        json=[{"id": str(user.id), "service_name": "edx", "status": "deleted"}] * 10001,
+    )
+
+    assert response.status_code == 422
@@ -2,6 +2,7 @@
 
 import logging
 from unittest.mock import Mock, call, patch
+from uuid import uuid4
 
 import pytest
 from celery import group
@@ -10,25 +11,32 @@ from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
 
 from mork.celery.tasks.deletion import (
+    _update_service_statuses,
     delete_inactive_users,
     delete_user,
+    delete_users_batch,
     mark_user_for_deletion,
+    mark_users_for_deletion,
     remove_email_status,
+    remove_email_statuses,
 )
 from mork.conf import settings
+from mork.crud import enqueue_warning_emails
 from mork.edx.mysql.factories.auth import EdxAuthUserFactory
-from mork.exceptions import UserDeleteError
+from mork.exceptions import UserDeleteError, UserStatusError
 from mork.factories.tasks import EmailStatusFactory
 from mork.factories.users import UserFactory, UserServiceStatusFactory
-from mork.models.tasks import EmailStatus
+from mork.models.tasks import EmailOutbox, EmailStatus
 from mork.models.users import (
     DeletionReason,
     DeletionStatus,
+    ServiceName,
     User,
+    UserServiceStatus,
 )
 
 
-def test_delete_inactive_users(edx_mysql_db, monkeypatch):
+def test_delete_inactive_users(edx_mysql_db, db_session, monkeypatch):
     """Test the `delete_inactive_users` function."""
     # 2 users that did not log in for more than the deletion period
     EdxAuthUserFactory.create(
@@ -53,22 +61,26 @@ def test_delete_inactive_users(edx_mysql_db, monkeypatch):
         "mork.celery.tasks.deletion.OpenEdxMySQLDB", lambda *args: edx_mysql_db
     )
 
-    mock_group = Mock()
-    monkeypatch.setattr("mork.celery.tasks.deletion.group", mock_group)
-    mock_delete_user = Mock()
-    monkeypatch.setattr("mork.celery.tasks.deletion.delete_user", mock_delete_user)
+    class MockMorkDB:
+        session = db_session
+
+    monkeypatch.setattr("mork.celery.tasks.deletion.MorkDB", MockMorkDB)
+
+    mock_delete_users_batch = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.delete_users_batch", mock_delete_users_batch
+    )
 
     delete_inactive_users(dry_run=False)
 
-    mock_group.assert_called_once_with(
-        [
-            mock_delete_user.s(email="johndoe1@example.com", dry_run=False),
-            mock_delete_user.s(email="johndoe2@example.com", dry_run=False),
-        ]
+    mock_delete_users_batch.delay.assert_called_once_with(
+        emails=["johndoe1@example.com", "johndoe2@example.com"],
+        reason=DeletionReason.GDPR,
+        dry_run=False,
     )
 
 
-def test_delete_inactive_users_with_limit(edx_mysql_db, monkeypatch):
+def test_delete_inactive_users_with_limit(edx_mysql_db, db_session, monkeypatch):
     """Test the `delete_inactive_users` function with limit."""
     # 2 users that did not log in for more than the deletion period
     EdxAuthUserFactory.create(
@@ -84,21 +96,24 @@ def test_delete_inactive_users_with_limit(edx_mysql_db, monkeypatch):
         "mork.celery.tasks.deletion.OpenEdxMySQLDB", lambda *args: edx_mysql_db
     )
 
-    mock_group = Mock()
-    monkeypatch.setattr("mork.celery.tasks.deletion.group", mock_group)
-    mock_delete_user = Mock()
-    monkeypatch.setattr("mork.celery.tasks.deletion.delete_user", mock_delete_user)
+    class MockMorkDB:
+        session = db_session
+
+    monkeypatch.setattr("mork.celery.tasks.deletion.MorkDB", MockMorkDB)
+
+    mock_delete_users_batch = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.delete_users_batch", mock_delete_users_batch
+    )
 
     delete_inactive_users(limit=1, dry_run=False)
 
-    mock_group.assert_called_once_with(
-        [
-            mock_delete_user.s(email="johndoe1@example.com", dry_run=False),
-        ]
+    mock_delete_users_batch.delay.assert_called_once_with(
+        emails=["johndoe1@example.com"], reason=DeletionReason.GDPR, dry_run=False
     )
 
 
-def test_delete_inactive_users_with_batch_size(edx_mysql_db, monkeypatch):
+def test_delete_inactive_users_with_batch_size(edx_mysql_db, db_session, monkeypatch):
     """Test the `warn_inactive_users` function with batch size."""
     # 2 users that did not log in for more than the deletion period
     EdxAuthUserFactory.create(
@@ -114,10 +129,15 @@ def test_delete_inactive_users_with_batch_size(edx_mysql_db, monkeypatch):
         "mork.celery.tasks.deletion.OpenEdxMySQLDB", lambda *args: edx_mysql_db
     )
 
-    mock_group = Mock()
-    monkeypatch.setattr("mork.celery.tasks.deletion.group", mock_group)
-    mock_delete_user = Mock()
-    monkeypatch.setattr("mork.celery.tasks.deletion.delete_user", mock_delete_user)
+    class MockMorkDB:
+        session = db_session
+
+    monkeypatch.setattr("mork.celery.tasks.deletion.MorkDB", MockMorkDB)
+
+    mock_delete_users_batch = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.delete_users_batch", mock_delete_users_batch
+    )
 
     # Set batch size to 1
     monkeypatch.setattr(
@@ -126,25 +146,23 @@ def test_delete_inactive_users_with_batch_size(edx_mysql_db, monkeypatch):
 
     delete_inactive_users(dry_run=False)
 
-    mock_group.assert_has_calls(
+    mock_delete_users_batch.delay.assert_has_calls(
         [
             call(
-                [
-                    mock_delete_user.s(email="johndoe1@example.com", dry_run=False),
-                ]
+                emails=["johndoe1@example.com"],
+                reason=DeletionReason.GDPR,
+                dry_run=False,
             ),
-            call().delay(),
             call(
-                [
-                    mock_delete_user.s(email="johndoe2@example.com", dry_run=False),
-                ]
+                emails=["johndoe2@example.com"],
+                reason=DeletionReason.GDPR,
+                dry_run=False,
             ),
-            call().delay(),
         ]
     )
 
 
-def test_delete_inactive_users_with_dry_run(edx_mysql_db, monkeypatch):
+def test_delete_inactive_users_with_dry_run(edx_mysql_db, db_session, monkeypatch):
     """Test the `delete_inactive_users` function with dry run activated (by default)."""
     # 2 users that did not log in for more than the deletion period
     EdxAuthUserFactory.create(
@@ -160,18 +178,22 @@ def test_delete_inactive_users_with_dry_run(edx_mysql_db, monkeypatch):
         "mork.celery.tasks.deletion.OpenEdxMySQLDB", lambda *args: edx_mysql_db
     )
 
-    mock_group = Mock()
-    monkeypatch.setattr("mork.celery.tasks.deletion.group", mock_group)
-    mock_delete_user = Mock()
-    monkeypatch.setattr("mork.celery.tasks.deletion.delete_user", mock_delete_user)
+    class MockMorkDB:
+        session = db_session
+
+    monkeypatch.setattr("mork.celery.tasks.deletion.MorkDB", MockMorkDB)
+
+    mock_delete_users_batch = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.delete_users_batch", mock_delete_users_batch
+    )
 
     delete_inactive_users()
 
-    mock_group.assert_called_once_with(
-        [
-            mock_delete_user.s(email="johndoe1@example.com", dry_run=True),
-            mock_delete_user.s(email="johndoe2@example.com", dry_run=True),
-        ]
+    mock_delete_users_batch.delay.assert_called_once_with(
+        emails=["johndoe1@example.com", "johndoe2@example.com"],
+        reason=DeletionReason.GDPR,
+        dry_run=True,
     )
 
 
@@ -208,6 +230,284 @@ def test_delete_user_with_dry_run(monkeypatch):
         mock_chain.assert_not_called()
 
 
+def test_delete_users_batch(edx_mysql_db, db_session, monkeypatch):
+    """Test the `delete_users_batch` function."""
+
+    class MockMorkDB:
+        session = db_session
+
+    monkeypatch.setattr("mork.celery.tasks.deletion.MorkDB", MockMorkDB)
+    monkeypatch.setattr("mork.celery.utils.MorkDB", MockMorkDB)
+    monkeypatch.setattr("mork.celery.utils.settings.USER_STATUS_REPOSITORY", "database")
+
+    EdxAuthUserFactory._meta.sqlalchemy_session = edx_mysql_db.session
+    EdxAuthUserFactory._meta.sqlalchemy_session_persistence = "commit"
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.OpenEdxMySQLDB", lambda *args: edx_mysql_db
+    )
+    EdxAuthUserFactory.create(email="johndoe1@example.com")
+    EdxAuthUserFactory.create(email="johndoe2@example.com")
+
+    # Deletion of the second user from edX fails
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.delete_edx_platform_users",
+        lambda users: {
+            user.id: (
+                None if user.email == "johndoe2@example.com" else DeletionStatus.DELETED
+            )
+            for user in users
+        },
+    )
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.delete_sarbacane_platform_users",
+        lambda users: {user.id: DeletionStatus.DELETED for user in users},
+    )
+    mock_delete_edx_platform_user = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.delete_edx_platform_user",
+        mock_delete_edx_platform_user,
+    )
+
+    results = delete_users_batch(
+        emails=["johndoe1@example.com", "johndoe2@example.com", "unknown@example.com"],
+        reason=DeletionReason.GDPR,
+        dry_run=False,
+    )
+
+    assert results == {
+        "johndoe1@example.com": {"edx": "deleted", "sarbacane": "deleted"},
+        "johndoe2@example.com": {"edx": "to_delete", "sarbacane": "deleted"},
+        "unknown@example.com": {},
+    }
+
+    # The failed deletion is handed over to the per-user task
+    failed_user = db_session.scalar(
+        select(User).where(User.email == "johndoe2@example.com")
+    )
+    mock_delete_edx_platform_user.delay.assert_called_once_with(failed_user.id)
+
+    statuses = db_session.execute(
+        select(User.email, UserServiceStatus.status)
+        .join(UserServiceStatus)
+        .where(UserServiceStatus.service_name == ServiceName.EDX)
+    ).all()
+    assert sorted(statuses) == [
+        ("johndoe1@example.com", DeletionStatus.DELETED),
+        ("johndoe2@example.com", DeletionStatus.TO_DELETE),
+    ]
+
+    # Reset factory persistence
+    EdxAuthUserFactory._meta.sqlalchemy_session_persistence = None
+
+
+def test_delete_users_batch_status_update_failure(
+    edx_mysql_db, db_session, monkeypatch
+):
+    """Test users whose statuses are not saved are handed over to per-user tasks."""
+
+    class MockMorkDB:
+        session = db_session
+
+    monkeypatch.setattr("mork.celery.tasks.deletion.MorkDB", MockMorkDB)
+
+    EdxAuthUserFactory._meta.sqlalchemy_session = edx_mysql_db.session
+    EdxAuthUserFactory._meta.sqlalchemy_session_persistence = "commit"
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.OpenEdxMySQLDB", lambda *args: edx_mysql_db
+    )
+    EdxAuthUserFactory.create(email="johndoe@example.com")
+
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.delete_edx_platform_users",
+        lambda users: {user.id: DeletionStatus.DELETED for user in users},
+    )
+    mock_delete_sarbacane_platform_users = Mock(
+        side_effect=lambda users: {user.id: DeletionStatus.DELETED for user in users}
+    )
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.delete_sarbacane_platform_users",
+        mock_delete_sarbacane_platform_users,
+    )
+    mock_delete_edx_platform_user = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.delete_edx_platform_user",
+        mock_delete_edx_platform_user,
+    )
+    mock_delete_sarbacane_platform_user = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.delete_sarbacane_platform_user",
+        mock_delete_sarbacane_platform_user,
+    )
+
+    # Updating the statuses through the Mork API fails
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.update_statuses_in_mork", lambda statuses: None
+    )
+
+    results = delete_users_batch(emails=["johndoe@example.com"], dry_run=False)
+
+    # The next services are still processed
+    assert results == {
+        "johndoe@example.com": {"edx": "to_delete", "sarbacane": "to_delete"}
+    }
+    mock_delete_sarbacane_platform_users.assert_called_once()
+    user = db_session.scalar(select(User).where(User.email == "johndoe@example.com"))
+    mock_delete_edx_platform_user.delay.assert_called_once_with(user.id)
+    mock_delete_sarbacane_platform_user.delay.assert_called_once_with(user.id)
+
+    # Reset factory persistence
+    EdxAuthUserFactory._meta.sqlalchemy_session_persistence = None
+
+
+def test_delete_users_batch_mark_failure(monkeypatch):
+    """Test the `delete_users_batch` function is retried if users cannot be marked."""
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.remove_email_statuses", lambda emails: None
+    )
+
+    def mock_mark(*args):
+        raise UserDeleteError("Failed to read users from edX MySQL")
+
+    monkeypatch.setattr("mork.celery.tasks.deletion.mark_users_for_deletion", mock_mark)
+    mock_delete_edx_platform_users = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.delete_edx_platform_users",
+        mock_delete_edx_platform_users,
+    )
+
+    with pytest.raises(UserDeleteError, match="Failed to read users from edX MySQL"):
+        delete_users_batch(emails=["johndoe@example.com"], dry_run=False)
+
+    mock_delete_edx_platform_users.assert_not_called()
+
+
+def test_update_service_statuses(monkeypatch, caplog):
+    """Test the `_update_service_statuses` function."""
+    user_id, unknown_id, failed_id = uuid4(), uuid4(), uuid4()
+    mock_update_statuses_in_mork = Mock(return_value={(user_id, ServiceName.EDX)})
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.update_statuses_in_mork",
+        mock_update_statuses_in_mork,
+    )
+
+    with caplog.at_level(logging.WARNING):
+        _update_service_statuses(
+            ServiceName.EDX,
+            {
+                user_id: DeletionStatus.DELETED,
+                unknown_id: DeletionStatus.DELETED,
+                failed_id: None,
+            },
+        )
+
+    # Failed deletions are not updated
+    mock_update_statuses_in_mork.assert_called_once_with(
+        [
+            (user_id, ServiceName.EDX, DeletionStatus.DELETED),
+            (unknown_id, ServiceName.EDX, DeletionStatus.DELETED),
+        ]
+    )
+    assert (
+        "mork.celery.tasks.deletion",
+        logging.WARNING,
+        f"Status of user {unknown_id} for edx not found",
+    ) in caplog.record_tuples
+
+    # Nothing to update
+    _update_service_statuses(ServiceName.EDX, {failed_id: None})
+    mock_update_statuses_in_mork.assert_called_once()
+
+
+def test_update_service_statuses_failure(monkeypatch):
+    """Test the `_update_service_statuses` function when the update fails."""
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.update_statuses_in_mork", lambda *args: None
+    )
+
+    with pytest.raises(
+        UserStatusError, match="Failed to update deletion statuses for edx"
+    ):
+        _update_service_statuses(ServiceName.EDX, {uuid4(): DeletionStatus.DELETED})
+
+
+def test_delete_users_batch_with_dry_run(monkeypatch):
+    """Test the `delete_users_batch` function with dry run activated (by default)."""
+    mock_mark_users_for_deletion = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.mark_users_for_deletion",
+        mock_mark_users_for_deletion,
+    )
+
+    assert delete_users_batch(emails=["johndoe@example.com"]) == {}
+
+    mock_mark_users_for_deletion.assert_not_called()
+
+
+def test_mark_users_for_deletion(edx_mysql_db, db_session, monkeypatch):
+    """Test the `mark_users_for_deletion` function."""
+
+    UserServiceStatusFactory._meta.sqlalchemy_session = db_session
+    UserFactory._meta.sqlalchemy_session = db_session
+
+    class MockMorkDB:
+        session = db_session
+
+    monkeypatch.setattr("mork.celery.tasks.deletion.MorkDB", MockMorkDB)
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.OpenEdxMySQLDB", lambda *args: edx_mysql_db
+    )
+
+    EdxAuthUserFactory._meta.sqlalchemy_session = edx_mysql_db.session
+    EdxAuthUserFactory._meta.sqlalchemy_session_persistence = "commit"
+    auth_users = EdxAuthUserFactory.create_batch(2)
+
+    # The first user is already marked for deletion
+    existing_user = UserFactory.create(
+        email=auth_users[0].email, edx_user_id=auth_users[0].id
+    )
+    db_session.flush()
+    existing_user_id = existing_user.id
+
+    user_ids = mark_users_for_deletion(
+        [user.email for user in auth_users] + ["unknown@example.com"],
+        DeletionReason.GDPR,
+    )
+
+    inserted_user = db_session.scalar(
+        select(User).where(User.email == auth_users[1].email)
+    )
+    assert user_ids == {
+        auth_users[0].email: existing_user_id,
+        auth_users[1].email: inserted_user.id,
+    }
+    assert inserted_user.username == auth_users[1].username
+    assert inserted_user.edx_user_id == auth_users[1].id
+    assert inserted_user.reason == DeletionReason.GDPR
+    assert len(inserted_user.service_statuses) == len(ServiceName) - 1
+    assert all(
+        status.status == DeletionStatus.TO_DELETE
+        for status in inserted_user.service_statuses
+    )
+
+    # Reset factory persistence
+    EdxAuthUserFactory._meta.sqlalchemy_session_persistence = None
+
+
+def test_mark_users_for_deletion_read_failure(edx_mysql_db, monkeypatch):
+    """Test the `mark_users_for_deletion` function with a read failure from MySQL."""
+
+    def mock_get_users(*args, **kwargs):
+        raise SQLAlchemyError("An error occurred")
+
+    monkeypatch.setattr("mork.celery.tasks.deletion.crud.get_users", mock_get_users)
+    monkeypatch.setattr(
+        "mork.celery.tasks.deletion.OpenEdxMySQLDB", lambda *args: edx_mysql_db
+    )
+
+    with pytest.raises(UserDeleteError, match="Failed to read users from edX MySQL"):
+        mark_users_for_deletion(["johndoe@example.com"], reason=DeletionReason.GDPR)
+
+
 def test_mark_user_for_deletion(edx_mysql_db, db_session, caplog, monkeypatch):
     """Test the `mark_user_for_deletion` function."""
 
@@ -336,6 +636,31 @@ def test_remove_email_status(db_session, monkeypatch):
     assert not db_session.execute(query).scalars().first()
 
 
+def test_remove_email_status_outbox(db_session, monkeypatch):
+    """Test the `remove_email_status` function deletes the queued email."""
+
+    class MockMorkDB:
+        session = db_session
+
+    monkeypatch.setattr("mork.celery.tasks.deletion.MorkDB", MockMorkDB)
+
+    enqueue_warning_emails(
+        db_session,
+        [
+            ("johndoe1@example.com", "JohnDoe1"),
+            ("johndoe2@example.com", "JohnDoe2"),
+        ],
+        max_attempts=3,
+    )
+
+    # The email is still pending, without any email status
+    remove_email_status("johndoe1@example.com")
+
+    assert db_session.scalars(select(EmailOutbox.email)).all() == [
+        "johndoe2@example.com"
+    ]
+
+
 def test_remove_email_status_no_entry(caplog, db_session, monkeypatch):
     """Test the `remove_email_status` function when entry does not exist."""
 
@@ -384,3 +709,37 @@ def test_remove_email_status_with_failure(caplog, db_session, monkeypatch):
         logging.ERROR,
         "Failed to delete email status",
     ) in caplog.record_tuples
+
+
+def test_remove_email_statuses(db_session, monkeypatch):
+    """Test the `remove_email_statuses` function."""
+
+    class MockMorkDB:
+        session = db_session
+
+    EmailStatusFactory._meta.sqlalchemy_session = db_session
+    monkeypatch.setattr("mork.celery.tasks.deletion.MorkDB", MockMorkDB)
+
+    EmailStatusFactory.create(email="johndoe1@example.com")
+    EmailStatusFactory.create(email="johndoe2@example.com")
+    EmailStatusFactory.create(email="janedah@example.com")
+    enqueue_warning_emails(
+        db_session,
+        [
+            ("johndoe1@example.com", "JohnDoe1"),
+            ("johndoe3@example.com", "JohnDoe3"),
+            ("janedah@example.com", "JaneDah"),
+        ],
+        max_attempts=3,
+    )
+
+    remove_email_statuses(
+        ["johndoe1@example.com", "johndoe2@example.com", "johndoe3@example.com"]
+    )
+
+    assert db_session.scalars(select(EmailStatus.email)).all() == [
+        "janedah@example.com"
+    ]
+    assert db_session.scalars(select(EmailOutbox.email)).all() == [
+        "janedah@example.com"
+    ]
@@ -7,13 +7,18 @@ from uuid import uuid4
 import pytest
 from mongoengine.errors import OperationError
 from mongoengine.queryset.visitor import Q
+from pymongo.errors import PyMongoError
 from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
 
 from mork.celery.tasks.edx import (
+    check_comments_query_plan,
     delete_edx_mongo_user,
+    delete_edx_mongo_users,
     delete_edx_mysql_user,
+    delete_edx_mysql_users,
     delete_edx_platform_user,
+    delete_edx_platform_users,
 )
 from mork.edx.mongo.factories import CommentFactory, CommentThreadFactory
 from mork.edx.mongo.models import Comment, CommentThread
@@ -59,7 +64,9 @@ def test_delete_edx_platform_user(db_session, monkeypatch):
     delete_edx_platform_user(user.id)
 
     mock_delete_edx_mysql_user.assert_called_once_with(email=user.email)
-    mock_delete_edx_mongo_user.assert_called_once_with(username=user.username)
+    mock_delete_edx_mongo_user.assert_called_once_with(
+        username=user.username, author_id=user.edx_user_id
+    )
     mock_update_status_in_mork.assert_called_once_with(
         user_id=user.id, service=ServiceName.EDX, status=DeletionStatus.DELETED
     )
@@ -94,7 +101,9 @@ def test_delete_edx_platform_user_protected(db_session, monkeypatch):
     delete_edx_platform_user(user.id)
 
     mock_delete_edx_mysql_user.assert_called_once_with(email=user.email)
-    mock_delete_edx_mongo_user.assert_called_once_with(username=user.username)
+    mock_delete_edx_mongo_user.assert_called_once_with(
+        username=user.username, author_id=user.edx_user_id
+    )
     mock_update_status_in_mork.assert_called_once_with(
         user_id=user.id, service=ServiceName.EDX, status=DeletionStatus.PROTECTED
     )
@@ -274,6 +283,125 @@ def test_delete_edx_platform_user_failed_status_update(db_session, monkeypatch):
         delete_edx_platform_user(user.id)
 
 
+def test_delete_edx_platform_users(db_session, monkeypatch):
+    """Test to delete a batch of users from edX platform."""
+    UserServiceStatusFactory._meta.sqlalchemy_session = db_session
+    UserFactory._meta.sqlalchemy_session = db_session
+
+    UserFactory.create_batch(3)
+    users = [UserRead.model_validate(user) for user in db_session.scalars(select(User))]
+
+    monkeypatch.setattr(
+        "mork.celery.tasks.edx.delete_edx_mysql_users",
+        lambda emails: [users[1].email],
+    )
+    mock_delete_edx_mongo_users = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.edx.delete_edx_mongo_users", mock_delete_edx_mongo_users
+    )
+
+    assert delete_edx_platform_users(users) == {
+        users[0].id: DeletionStatus.DELETED,
+        users[1].id: DeletionStatus.PROTECTED,
+        users[2].id: DeletionStatus.DELETED,
+    }
+    mock_delete_edx_mongo_users.assert_called_once_with(
+        authors={user.edx_user_id: user.username for user in users}
+    )
+
+
+def test_delete_edx_platform_users_mysql_failure(db_session, monkeypatch):
+    """Test to delete a batch of users from edX platform when MySQL deletion fails."""
+    UserServiceStatusFactory._meta.sqlalchemy_session = db_session
+    UserFactory._meta.sqlalchemy_session = db_session
+
+    UserFactory.create_batch(2)
+    users = [UserRead.model_validate(user) for user in db_session.scalars(select(User))]
+
+    def mock_delete_edx_mysql_users(emails):
+        raise UserDeleteError("An error occurred")
+
+    monkeypatch.setattr(
+        "mork.celery.tasks.edx.delete_edx_mysql_users", mock_delete_edx_mysql_users
+    )
+    mock_delete_edx_mongo_users = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.edx.delete_edx_mongo_users", mock_delete_edx_mongo_users
+    )
+
+    assert delete_edx_platform_users(users) == {
+        users[0].id: None,
+        users[1].id: None,
+    }
+    mock_delete_edx_mongo_users.assert_not_called()
+
+
+def test_delete_edx_platform_users_mongo_failure(db_session, monkeypatch):
+    """Test to delete a batch of users from edX platform when MongoDB deletion fails."""
+    UserServiceStatusFactory._meta.sqlalchemy_session = db_session
+    UserFactory._meta.sqlalchemy_session = db_session
+
+    UserFactory.create_batch(2)
+    users = [UserRead.model_validate(user) for user in db_session.scalars(select(User))]
+
+    monkeypatch.setattr(
+        "mork.celery.tasks.edx.delete_edx_mysql_users", lambda emails: []
+    )
+
+    def mock_delete_edx_mongo_users(authors):
+        raise UserDeleteError("An error occurred")
+
+    monkeypatch.setattr(
+        "mork.celery.tasks.edx.delete_edx_mongo_users", mock_delete_edx_mongo_users
+    )
+
+    assert delete_edx_platform_users(users) == {
+        users[0].id: None,
+        users[1].id: None,
+    }
+
+
+def test_delete_edx_mysql_users(edx_mysql_db, monkeypatch):
+    """Test to delete a batch of users' data from MySQL."""
+    EdxAuthUserFactory._meta.sqlalchemy_session = edx_mysql_db.session
+    EdxAuthUserFactory.create(email="johndoe1@example.com")
+    EdxAuthUserFactory.create(email="johndoe2@example.com", with_protected_tables=True)
+    EdxAuthUserFactory.create(email="johndoe3@example.com")
+
+    monkeypatch.setattr(
+        "mork.celery.tasks.edx.OpenEdxMySQLDB", lambda *args: edx_mysql_db
+    )
+
+    protected_emails = delete_edx_mysql_users(
+        emails=["johndoe1@example.com", "johndoe2@example.com"]
+    )
+
+    assert protected_emails == ["johndoe2@example.com"]
+    assert not mysql.get_user(edx_mysql_db.session, email="johndoe1@example.com")
+    assert mysql.get_user(edx_mysql_db.session, email="johndoe2@example.com")
+    assert mysql.get_user(edx_mysql_db.session, email="johndoe3@example.com")
+
+
+def test_delete_edx_mysql_users_with_failure(edx_mysql_db, monkeypatch):
+    """Test to delete a batch of users' data from MySQL with a commit failure."""
+    EdxAuthUserFactory._meta.sqlalchemy_session = edx_mysql_db.session
+    EdxAuthUserFactory.create(email="johndoe1@example.com")
+
+    def mock_session_commit():
+        raise SQLAlchemyError("An error occurred")
+
+    monkeypatch.setattr(edx_mysql_db.session, "commit", mock_session_commit)
+    monkeypatch.setattr(
+        "mork.celery.tasks.edx.OpenEdxMySQLDB", lambda *args: edx_mysql_db
+    )
+
+    with pytest.raises(
+        UserDeleteError,
+        match="Failed to delete users from edX MySQL",
+    ):
+        delete_edx_mysql_users(emails=["johndoe1@example.com"])
+
+
 def test_delete_edx_mysql_user(edx_mysql_db, monkeypatch):
     """Test to delete user's data from MySQL."""
     EdxAuthUserFactory._meta.sqlalchemy_session = edx_mysql_db.session
@@ -376,7 +504,6 @@ def test_delete_edx_mongo_user(edx_mongo_db, monkeypatch):
     CommentFactory.create(author_username=user_2)
     CommentThreadFactory.create(author_username=user_2)
 
-    edx_mongo_db.disconnect = lambda: None
     monkeypatch.setattr(
         "mork.celery.tasks.edx.OpenEdxMongoDB", lambda *args: edx_mongo_db
     )
@@ -396,6 +523,25 @@ def test_delete_edx_mongo_user(edx_mongo_db, monkeypatch):
     assert CommentThread.objects(Q(author_username=user_2)).all().count() == 1
 
 
+def test_delete_edx_mongo_user_by_author_id(edx_mongo_db, monkeypatch):
+    """Test to delete user's data from MongoDB matching its author id."""
+    CommentFactory.create(author_id=1, author_username="Johndoe1")
+    CommentFactory.create(author_id=2, author_username="Johndoe2")
+    # Comment without the author id, matched on the username
+    CommentFactory.create(author_id=None, author_username="Johndoe2", body="old")
+
+    monkeypatch.setattr(
+        "mork.celery.tasks.edx.OpenEdxMongoDB", lambda *args: edx_mongo_db
+    )
+
+    delete_edx_mongo_user(username="Johndoe2", author_id=1)
+
+    assert Comment.objects(Q(author_username="Johndoe1")).count() == 0
+    assert Comment.objects(Q(body="old")).count() == 0
+    # Comments of another author with the same username are kept
+    assert Comment.objects(Q(author_username="Johndoe2")).count() == 1
+
+
 def test_delete_edx_mongo_user_with_failure(edx_mongo_db, monkeypatch):
     """Test to delete user's data from MongoDB with a operation failure."""
     username = "Johndoe1"
@@ -406,7 +552,7 @@ def test_delete_edx_mongo_user_with_failure(edx_mongo_db, monkeypatch):
         "mork.celery.tasks.edx.OpenEdxMongoDB", lambda *args: edx_mongo_db
     )
 
-    def mock_anonymize(*args):
+    def mock_anonymize(*args, **kwargs):
         raise OperationError("An error occurred")
 
     monkeypatch.setattr(
@@ -418,3 +564,114 @@ def test_delete_edx_mongo_user_with_failure(edx_mongo_db, monkeypatch):
         match="Failed to delete comments: An error occurred",
     ):
         delete_edx_mongo_user(username=username)
+
+
+def test_delete_edx_mongo_users(edx_mongo_db, monkeypatch):
+    """Test to delete a batch of users' data from MongoDB."""
+    CommentFactory.create(author_id=1, author_username="JohnDoe1")
+    CommentThreadFactory.create(author_id=2, author_username="JohnDoe2")
+    CommentFactory.create(author_id=3, author_username="JohnDoe3")
+    # Comments without the author id, only matched on the username
+    CommentFactory.create(author_id=None, author_username="JohnDoe1", body="old")
+    CommentFactory.create(author_id=None, author_username="JohnDoe4")
+    CommentFactory.create(author_id=None, author_username="JohnDoe5")
+
+    monkeypatch.setattr(
+        "mork.celery.tasks.edx.OpenEdxMongoDB", lambda *args: edx_mongo_db
+    )
+
+    delete_edx_mongo_users(authors={1: "JohnDoe1", 2: "JohnDoe2", 4: "JohnDoe4"})
+
+    assert Comment.objects(Q(author_id=1)).count() == 0
+    assert Comment.objects(Q(author_username="JohnDoe1")).count() == 0
+    assert Comment.objects(Q(body="old")).count() == 0
+    assert CommentThread.objects(Q(author_id=2)).count() == 0
+    assert Comment.objects(Q(author_username="JohnDoe4")).count() == 0
+    assert Comment.objects(Q(author_id=3)).count() == 1
+    assert Comment.objects(Q(author_username="JohnDoe5")).count() == 1
+
+
+def test_delete_edx_mongo_users_with_failure(edx_mongo_db, monkeypatch):
+    """Test to delete a batch of users' data from MongoDB with a failure."""
+    monkeypatch.setattr(
+        "mork.celery.tasks.edx.OpenEdxMongoDB", lambda *args: edx_mongo_db
+    )
+
+    def mock_anonymize(*args, **kwargs):
+        raise PyMongoError("An error occurred")
+
+    monkeypatch.setattr(
+        "mork.celery.tasks.edx.mongo.anonymize_authors_comments", mock_anonymize
+    )
+
+    with pytest.raises(
+        UserDeleteError,
+        match="Failed to delete comments: An error occurred",
+    ):
+        delete_edx_mongo_users(authors={1: "JohnDoe"})
+
+
+@pytest.mark.parametrize("indexed", [True, False])
+def test_check_comments_query_plan(monkeypatch, caplog, indexed):
+    """Test the check of the query plan used to match comments."""
+    check_comments_query_plan.cache_clear()
+    mock_is_authors_query_indexed = Mock(return_value=indexed)
+    monkeypatch.setattr(
+        "mork.celery.tasks.edx.mongo.is_authors_query_indexed",
+        mock_is_authors_query_indexed,
+    )
+
+    with caplog.at_level(logging.ERROR):
+        assert check_comments_query_plan("author_id") == indexed
+        # The query plan is only checked once
+        assert check_comments_query_plan("author_id") == indexed
+
+    mock_is_authors_query_indexed.assert_called_once_with("author_id")
+    collection_scan_logged = (
+        "mork.celery.tasks.edx",
+        logging.ERROR,
+        "Matching comments on author_id requires a collection scan (COLLSCAN), "
+        "an index should be created on this field",
+    ) in caplog.record_tuples
+    assert collection_scan_logged is not indexed
+    check_comments_query_plan.cache_clear()
+
+
+def test_check_comments_query_plan_failure(monkeypatch, caplog):
+    """Test the check of the query plan used to match comments with a failure."""
+    check_comments_query_plan.cache_clear()
+
+    def mock_is_authors_query_indexed(field):
+        raise PyMongoError("An error occurred")
+
+    monkeypatch.setattr(
+        "mork.celery.tasks.edx.mongo.is_authors_query_indexed",
+        mock_is_authors_query_indexed,
+    )
+
+    with caplog.at_level(logging.WARNING):
+        assert check_comments_query_plan("author_id") is None
+
+    assert (
+        "mork.celery.tasks.edx",
+        logging.WARNING,
+        "Failed to check comments query plan on author_id: An error occurred",
+    ) in caplog.record_tuples
+    check_comments_query_plan.cache_clear()
+
+
+def test_check_comments_query_plan_disabled(monkeypatch):
+    """Test the check of the query plan used to match comments when disabled."""
+    check_comments_query_plan.cache_clear()
+    monkeypatch.setattr(
+        "mork.celery.tasks.edx.settings.EDX_MONGO_CHECK_QUERY_PLAN", False
+    )
+    mock_is_authors_query_indexed = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.edx.mongo.is_authors_query_indexed",
+        mock_is_authors_query_indexed,
+    )
+
+    assert check_comments_query_plan("author_id") is None
+    mock_is_authors_query_indexed.assert_not_called()
+    check_comments_query_plan.cache_clear()
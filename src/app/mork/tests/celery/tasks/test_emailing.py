@@ -1,23 +1,33 @@
 """Tests for Mork Celery emailing tasks."""
 
+from datetime import datetime, timedelta
 from unittest.mock import Mock, call
 
 import pytest
 from faker import Faker
+from sqlalchemy import delete, select, update
 
+from mork.celery.celery_app import app
 from mork.celery.tasks.emailing import (
     check_email_already_sent,
+    drain_email_outbox,
+    get_emails_already_sent,
+    get_send_interval,
     mark_email_status,
+    mark_emails_status,
     warn_inactive_users,
     warn_user,
+    warn_users_batch,
 )
 from mork.conf import settings
+from mork.crud import enqueue_warning_emails
 from mork.edx.mysql.factories.auth import EdxAuthUserFactory
 from mork.exceptions import EmailSendError
 from mork.factories.tasks import EmailStatusFactory
+from mork.models.tasks import EmailOutbox
 
 
-def test_warn_inactive_users(edx_mysql_db, monkeypatch):
+def test_warn_inactive_users(edx_mysql_db, db_session, monkeypatch):
     """Test the `warn_inactive_users` function."""
     # 2 users that did not log in for more than the warning period
     EdxAuthUserFactory.create(
@@ -46,26 +56,118 @@ def test_warn_inactive_users(edx_mysql_db, monkeypatch):
         "mork.celery.tasks.emailing.OpenEdxMySQLDB", lambda *args: edx_mysql_db
     )
 
-    mock_group = Mock()
-    monkeypatch.setattr("mork.celery.tasks.emailing.group", mock_group)
-    mock_warn_user = Mock()
-    monkeypatch.setattr("mork.celery.tasks.emailing.warn_user", mock_warn_user)
+    class MockMorkDB:
+        session = db_session
+
+    monkeypatch.setattr("mork.celery.tasks.emailing.MorkDB", MockMorkDB)
+
+    mock_warn_users_batch = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.emailing.warn_users_batch", mock_warn_users_batch
+    )
+
+    warn_inactive_users(dry_run=False)
+
+    mock_warn_users_batch.delay.assert_called_once_with(
+        users=[
+            ("johndoe1@example.com", "JohnDoe1"),
+            ("johndoe2@example.com", "JohnDoe2"),
+        ],
+        dry_run=False,
+    )
+
+
+def test_warn_inactive_users_already_sent(edx_mysql_db, db_session, monkeypatch):
+    """Test the `warn_inactive_users` function skips users already warned."""
+    for index in range(1, 4):
+        EdxAuthUserFactory.create(
+            last_login=Faker().date_time_between(end_date=-settings.WARNING_PERIOD),
+            username=f"JohnDoe{index}",
+            email=f"johndoe{index}@example.com",
+        )
+
+    monkeypatch.setattr(
+        "mork.celery.tasks.emailing.OpenEdxMySQLDB", lambda *args: edx_mysql_db
+    )
+
+    class MockMorkDB:
+        session = db_session
+
+    EmailStatusFactory._meta.sqlalchemy_session = db_session
+    monkeypatch.setattr("mork.celery.tasks.emailing.MorkDB", MockMorkDB)
+    EmailStatusFactory.create(email="johndoe1@example.com")
+    EmailStatusFactory.create(email="johndoe3@example.com")
+
+    mock_warn_users_batch = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.emailing.warn_users_batch", mock_warn_users_batch
+    )
+
+    # Set batch size to 1
+    monkeypatch.setattr(
+        "mork.celery.tasks.emailing.settings.EDX_MYSQL_QUERY_BATCH_SIZE", 1
+    )
 
     warn_inactive_users(dry_run=False)
 
-    mock_group.assert_called_once_with(
-        [
-            mock_warn_user.s(
-                email="johndoe1@example.com", username="JohnDoe1", dry_run=False
-            ),
-            mock_warn_user.s(
-                email="johndoe2@example.com", username="JohnDoe2", dry_run=False
-            ),
-        ]
+    # No task is created for batches of users who were all warned
+    mock_warn_users_batch.delay.assert_called_once_with(
+        users=[("johndoe2@example.com", "JohnDoe2")], dry_run=False
+    )
+
+
+def test_warn_inactive_users_outbox(edx_mysql_db, db_session, monkeypatch):
+    """Test the `warn_inactive_users` function queues emails in the outbox."""
+    for index in range(1, 3):
+        EdxAuthUserFactory.create(
+            last_login=Faker().date_time_between(end_date=-settings.WARNING_PERIOD),
+            username=f"JohnDoe{index}",
+            email=f"johndoe{index}@example.com",
+        )
+
+    monkeypatch.setattr(
+        "mork.celery.tasks.emailing.OpenEdxMySQLDB", lambda *args: edx_mysql_db
+    )
+
+    class MockMorkDB:
+        session = db_session
+
+    EmailStatusFactory._meta.sqlalchemy_session = db_session
+    monkeypatch.setattr("mork.celery.tasks.emailing.MorkDB", MockMorkDB)
+    # Keep the test transaction when the task closes its session
+    monkeypatch.setattr(db_session, "close", lambda: None)
+    EmailStatusFactory.create(email="johndoe1@example.com")
+
+    monkeypatch.setattr("mork.celery.tasks.emailing.settings.EMAIL_DELIVERY", "outbox")
+    monkeypatch.setattr("mork.celery.tasks.emailing.settings.EMAIL_OUTBOX_DRAINERS", 2)
+    mock_warn_users_batch = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.emailing.warn_users_batch", mock_warn_users_batch
     )
+    mock_drain_email_outbox = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.emailing.drain_email_outbox", mock_drain_email_outbox
+    )
+
+    warn_inactive_users(dry_run=False)
+    warn_inactive_users(dry_run=False)
+
+    # Emails are queued once, and sent by the drainers instead of batch tasks
+    outbox = db_session.scalars(select(EmailOutbox)).all()
+    assert [(email.email, email.username) for email in outbox] == [
+        ("johndoe2@example.com", "JohnDoe2")
+    ]
+    mock_warn_users_batch.delay.assert_not_called()
+    assert mock_drain_email_outbox.delay.call_count == 4
+
+    # Nothing is queued in dry run mode
+    db_session.execute(delete(EmailOutbox))
+    warn_inactive_users()
+    assert db_session.scalars(select(EmailOutbox)).all() == []
+    assert mock_drain_email_outbox.delay.call_count == 4
 
 
-def test_warn_inactive_users_with_limit(edx_mysql_db, monkeypatch):
+def test_warn_inactive_users_with_limit(edx_mysql_db, db_session, monkeypatch):
     """Test the `warn_inactive_users` function with limit."""
     # 2 users that did not log in for more than the warning period
     EdxAuthUserFactory.create(
@@ -83,23 +185,24 @@ def test_warn_inactive_users_with_limit(edx_mysql_db, monkeypatch):
         "mork.celery.tasks.emailing.OpenEdxMySQLDB", lambda *args: edx_mysql_db
     )
 
-    mock_group = Mock()
-    monkeypatch.setattr("mork.celery.tasks.emailing.group", mock_group)
-    mock_warn_user = Mock()
-    monkeypatch.setattr("mork.celery.tasks.emailing.warn_user", mock_warn_user)
+    class MockMorkDB:
+        session = db_session
+
+    monkeypatch.setattr("mork.celery.tasks.emailing.MorkDB", MockMorkDB)
+
+    mock_warn_users_batch = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.emailing.warn_users_batch", mock_warn_users_batch
+    )
 
     warn_inactive_users(limit=1, dry_run=False)
 
-    mock_group.assert_called_once_with(
-        [
-            mock_warn_user.s(
-                email="johndoe1@example.com", username="JohnDoe1", dry_run=False
-            )
-        ]
+    mock_warn_users_batch.delay.assert_called_once_with(
+        users=[("johndoe1@example.com", "JohnDoe1")], dry_run=False
     )
 
 
-def test_warn_inactive_users_with_batch_size(edx_mysql_db, monkeypatch):
+def test_warn_inactive_users_with_batch_size(edx_mysql_db, db_session, monkeypatch):
     """Test the `warn_inactive_users` function with batch size."""
     # 2 users that did not log in for more than the warning period
     EdxAuthUserFactory.create(
@@ -117,10 +220,15 @@ def test_warn_inactive_users_with_batch_size(edx_mysql_db, monkeypatch):
         "mork.celery.tasks.emailing.OpenEdxMySQLDB", lambda *args: edx_mysql_db
     )
 
-    mock_group = Mock()
-    monkeypatch.setattr("mork.celery.tasks.emailing.group", mock_group)
-    mock_warn_user = Mock()
-    monkeypatch.setattr("mork.celery.tasks.emailing.warn_user", mock_warn_user)
+    class MockMorkDB:
+        session = db_session
+
+    monkeypatch.setattr("mork.celery.tasks.emailing.MorkDB", MockMorkDB)
+
+    mock_warn_users_batch = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.emailing.warn_users_batch", mock_warn_users_batch
+    )
 
     # Set batch size to 1
     monkeypatch.setattr(
@@ -129,29 +237,14 @@ def test_warn_inactive_users_with_batch_size(edx_mysql_db, monkeypatch):
 
     warn_inactive_users(dry_run=False)
 
-    mock_group.assert_has_calls(
-        [
-            call(
-                [
-                    mock_warn_user.s(
-                        email="johndoe1@example.com", username="JohnDoe1", dry_run=False
-                    ),
-                ]
-            ),
-            call().delay(),
-            call(
-                [
-                    mock_warn_user.s(
-                        email="johndoe2@example.com", username="JohnDoe2", dry_run=False
-                    ),
-                ]
-            ),
-            call().delay(),
-        ]
-    )
-
-
-def test_warn_inactive_users_with_dry_run(edx_mysql_db, monkeypatch):
+    # One batch task is created per page of users
+    assert mock_warn_users_batch.delay.call_args_list == [
+        call(users=[("johndoe1@example.com", "JohnDoe1")], dry_run=False),
+        call(users=[("johndoe2@example.com", "JohnDoe2")], dry_run=False),
+    ]
+
+
+def test_warn_inactive_users_with_dry_run(edx_mysql_db, db_session, monkeypatch):
     """Test the `warn_inactive_users` function with dry run activated (by default)."""
     # 2 users that did not log in for more than the warning period
     EdxAuthUserFactory.create(
@@ -168,22 +261,24 @@ def test_warn_inactive_users_with_dry_run(edx_mysql_db, monkeypatch):
         "mork.celery.tasks.emailing.OpenEdxMySQLDB", lambda *args: edx_mysql_db
     )
 
-    mock_group = Mock()
-    monkeypatch.setattr("mork.celery.tasks.emailing.group", mock_group)
-    mock_warn_user = Mock()
-    monkeypatch.setattr("mork.celery.tasks.emailing.warn_user", mock_warn_user)
+    class MockMorkDB:
+        session = db_session
+
+    monkeypatch.setattr("mork.celery.tasks.emailing.MorkDB", MockMorkDB)
+
+    mock_warn_users_batch = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.emailing.warn_users_batch", mock_warn_users_batch
+    )
 
     warn_inactive_users()
 
-    mock_group.assert_called_once_with(
-        [
-            mock_warn_user.s(
-                email="johndoe1@example.com", username="JohnDoe1", dry_run=True
-            ),
-            mock_warn_user.s(
-                email="johndoe2@example.com", username="JohnDoe2", dry_run=True
-            ),
-        ]
+    mock_warn_users_batch.delay.assert_called_once_with(
+        users=[
+            ("johndoe1@example.com", "JohnDoe1"),
+            ("johndoe2@example.com", "JohnDoe2"),
+        ],
+        dry_run=True,
     )
 
 
@@ -260,6 +355,154 @@ def test_warn_user_sending_failure(monkeypatch):
         warn_user("johndoe@example.com", "JohnDoe", dry_run=False)
 
 
+def test_warn_users_batch(monkeypatch, db_session):
+    """Test the `warn_users_batch` function."""
+
+    class MockMorkDB:
+        session = db_session
+
+    EmailStatusFactory._meta.sqlalchemy_session = db_session
+    monkeypatch.setattr("mork.celery.tasks.emailing.MorkDB", MockMorkDB)
+    monkeypatch.setattr("mork.celery.tasks.emailing.settings.EMAIL_RATE_LIMIT", "2/s")
+    EmailStatusFactory.create(email="johndoe1@example.com")
+
+    mock_send_emails = Mock(
+        return_value={"johndoe3@example.com": EmailSendError("An error occurred")}
+    )
+    monkeypatch.setattr("mork.celery.tasks.emailing.send_emails", mock_send_emails)
+    mock_warn_user = Mock()
+    monkeypatch.setattr("mork.celery.tasks.emailing.warn_user", mock_warn_user)
+
+    users = [
+        ("johndoe1@example.com", "JohnDoe1"),
+        ("johndoe2@example.com", "JohnDoe2"),
+        ("johndoe3@example.com", "JohnDoe3"),
+    ]
+    statuses = warn_users_batch(users, dry_run=False)
+
+    assert statuses == {
+        "johndoe1@example.com": "already_sent",
+        "johndoe2@example.com": "sent",
+        "johndoe3@example.com": "failed",
+    }
+    mock_send_emails.assert_called_once_with(users[1:], interval=0.5)
+    assert get_emails_already_sent(db_session, [email for email, _ in users]) == {
+        "johndoe1@example.com",
+        "johndoe2@example.com",
+    }
+
+    # Failed emails are retried individually
+    mock_warn_user.delay.assert_called_once_with(
+        email="johndoe3@example.com", username="JohnDoe3", dry_run=False
+    )
+
+
+def test_warn_users_batch_with_dry_run(monkeypatch, db_session):
+    """Test the `warn_users_batch` function with dry run activated (by default)."""
+
+    class MockMorkDB:
+        session = db_session
+
+    monkeypatch.setattr("mork.celery.tasks.emailing.MorkDB", MockMorkDB)
+    mock_send_emails = Mock()
+    monkeypatch.setattr("mork.celery.tasks.emailing.send_emails", mock_send_emails)
+
+    statuses = warn_users_batch([("johndoe@example.com", "JohnDoe")])
+
+    assert statuses == {}
+    mock_send_emails.assert_not_called()
+    assert not check_email_already_sent("johndoe@example.com")
+
+
+def test_drain_email_outbox(monkeypatch, db_session):
+    """Test the `drain_email_outbox` function."""
+
+    class MockMorkDB:
+        session = db_session
+
+    EmailStatusFactory._meta.sqlalchemy_session = db_session
+    monkeypatch.setattr("mork.celery.tasks.emailing.MorkDB", MockMorkDB)
+    monkeypatch.setattr("mork.celery.tasks.emailing.settings.EMAIL_RATE_LIMIT", "2/s")
+    monkeypatch.setattr("mork.celery.tasks.emailing.settings.EMAIL_MAX_RETRIES", 2)
+    monkeypatch.setattr("mork.celery.tasks.emailing.settings.EMAIL_RETRY_BACKOFF", 10.0)
+    mock_apply_async = Mock()
+    monkeypatch.setattr(drain_email_outbox, "apply_async", mock_apply_async)
+
+    users = [
+        ("johndoe1@example.com", "JohnDoe1"),
+        ("johndoe2@example.com", "JohnDoe2"),
+        ("johndoe3@example.com", "JohnDoe3"),
+    ]
+    enqueue_warning_emails(db_session, users, max_attempts=2)
+    EmailStatusFactory.create(email="johndoe1@example.com")
+
+    mock_send_emails = Mock(
+        return_value={"johndoe3@example.com": EmailSendError("An error occurred")}
+    )
+    monkeypatch.setattr("mork.celery.tasks.emailing.send_emails", mock_send_emails)
+
+    before = datetime.now()
+    assert drain_email_outbox(batch_size=10) == {"sent": 2, "failed": 1}
+
+    # Emails already sent are skipped, and failed ones are not retried by the
+    # same drain
+    mock_send_emails.assert_called_once()
+    assert sorted(mock_send_emails.call_args.args[0]) == users[1:]
+    assert mock_send_emails.call_args.kwargs == {"interval": 0.5}
+
+    outbox = {email.email: email for email in db_session.scalars(select(EmailOutbox))}
+    assert outbox["johndoe1@example.com"].sent_date is not None
+    assert outbox["johndoe2@example.com"].sent_date is not None
+    failed = outbox["johndoe3@example.com"]
+    assert failed.sent_date is None
+    assert failed.attempts == 1
+    assert failed.next_attempt_at >= before + timedelta(seconds=10)
+    assert get_emails_already_sent(db_session, [email for email, _ in users]) == {
+        "johndoe1@example.com",
+        "johndoe2@example.com",
+    }
+    # A drain is scheduled to retry the failed email after the backoff
+    mock_apply_async.assert_called_once_with(kwargs={"batch_size": 10}, countdown=10.0)
+
+    # The failed email is not retried before the backoff
+    assert drain_email_outbox() == {"sent": 0, "failed": 0}
+    mock_send_emails.assert_called_once()
+
+    # The backoff doubles at each attempt, and the email is given up after the
+    # maximum number of attempts
+    retry_now = update(EmailOutbox).values(next_attempt_at=datetime.now())
+    db_session.execute(retry_now)
+    before = datetime.now()
+    assert drain_email_outbox() == {"sent": 0, "failed": 1}
+    assert mock_send_emails.call_args.args[0] == [users[2]]
+    failed = db_session.scalars(
+        select(EmailOutbox).where(EmailOutbox.email == "johndoe3@example.com")
+    ).one()
+    assert failed.attempts == 2
+    assert failed.next_attempt_at >= before + timedelta(seconds=20)
+    mock_apply_async.assert_called_once()
+
+    db_session.execute(retry_now)
+    assert drain_email_outbox() == {"sent": 0, "failed": 0}
+    assert mock_send_emails.call_count == 2
+
+
+def test_get_send_interval(monkeypatch):
+    """Test the `get_send_interval` function."""
+    monkeypatch.setattr("mork.celery.tasks.emailing.settings.EMAIL_RATE_LIMIT", "4/s")
+    assert get_send_interval() == 0.25
+
+    # The rate is shared by the pool processes of the worker
+    monkeypatch.setattr(app.conf, "worker_concurrency", 4)
+    assert get_send_interval() == 1
+
+    # Emails are paced by the global rate limit instead
+    monkeypatch.setattr(
+        "mork.celery.tasks.emailing.settings.EMAIL_GLOBAL_RATE_LIMIT", "4/s"
+    )
+    assert get_send_interval() == 0
+
+
 def test_check_email_already_sent(monkeypatch, db_session):
     """Test the `check_email_already_sent` function."""
     email_address = "test_email@example.com"
@@ -290,3 +533,19 @@ def test_mark_email_status(monkeypatch, db_session):
     new_email = "test_email@example.com"
     mark_email_status(new_email)
     assert check_email_already_sent(new_email)
+
+
+def test_mark_emails_status(monkeypatch, db_session):
+    """Test the `mark_emails_status` function."""
+
+    class MockMorkDB:
+        session = db_session
+
+    EmailStatusFactory._meta.sqlalchemy_session = db_session
+    monkeypatch.setattr("mork.celery.tasks.emailing.MorkDB", MockMorkDB)
+    EmailStatusFactory.create(email="johndoe1@example.com")
+
+    # Emails already marked are ignored
+    new_emails = ["johndoe1@example.com", "johndoe2@example.com"]
+    mark_emails_status(new_emails)
+    assert get_emails_already_sent(db_session, new_emails) == set(new_emails)
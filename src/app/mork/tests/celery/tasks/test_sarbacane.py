@@ -1,5 +1,6 @@
 """Tests for Mork Celery Sarbacane tasks."""
 
+import asyncio
 import logging
 import uuid
 from unittest.mock import Mock
@@ -7,11 +8,16 @@ from uuid import uuid4
 
 import httpx
 import pytest
+import redis
 from sqlalchemy import select
 
 from mork.celery.tasks.sarbacane import (
     delete_sarbacane_platform_user,
+    delete_sarbacane_platform_users,
     delete_sarbacane_user,
+    delete_sarbacane_users,
+    get_contact_lists,
+    invalidate_contact_lists_cache,
 )
 from mork.conf import settings
 from mork.exceptions import (
@@ -21,9 +27,17 @@ from mork.exceptions import (
 )
 from mork.factories.users import UserFactory, UserServiceStatusFactory
 from mork.models.users import DeletionStatus, ServiceName, User
+from mork.sarbacane import SarbacaneClient
 from mork.schemas.users import UserRead
 
 
+@pytest.fixture(autouse=True)
+def reset_sarbacane_state(monkeypatch):
+    """Clear the contact lists cached and the budget used by previous tests."""
+    invalidate_contact_lists_cache()
+    monkeypatch.setattr(SarbacaneClient, "_bucket", None)
+
+
 def test_delete_sarbacane_platform_user(db_session, monkeypatch):
     """Test to delete user from Sarbacane platform."""
 
@@ -231,6 +245,54 @@ def test_delete_sarbacane_platform_user_failed_status_update(db_session, monkeyp
         delete_sarbacane_platform_user(user.id)
 
 
+def test_delete_sarbacane_platform_users(db_session, monkeypatch):
+    """Test to delete a batch of users from Sarbacane platform."""
+    UserServiceStatusFactory._meta.sqlalchemy_session = db_session
+    UserFactory._meta.sqlalchemy_session = db_session
+
+    UserFactory.create_batch(2)
+    users = [UserRead.model_validate(user) for user in db_session.scalars(select(User))]
+
+    error = UserDeleteError("An error occurred")
+    monkeypatch.setattr(
+        "mork.celery.tasks.sarbacane.delete_sarbacane_users",
+        lambda emails: {users[1].email: error},
+    )
+
+    assert delete_sarbacane_platform_users(users) == {
+        users[0].id: DeletionStatus.DELETED,
+        users[1].id: None,
+    }
+
+    # All users fail if the lists of contacts cannot be retrieved
+    def mock_delete_sarbacane_users(emails):
+        raise UserDeleteError("Network error while retrieving lists of contacts")
+
+    monkeypatch.setattr(
+        "mork.celery.tasks.sarbacane.delete_sarbacane_users",
+        mock_delete_sarbacane_users,
+    )
+
+    assert delete_sarbacane_platform_users(users) == {
+        users[0].id: None,
+        users[1].id: None,
+    }
+
+
+def test_delete_sarbacane_platform_users_empty_setting(monkeypatch):
+    """Test to delete a batch of users from Sarbacane when the API URL is not set."""
+    monkeypatch.setattr("mork.celery.tasks.sarbacane.settings.SARBACANE_API_URL", "")
+
+    mock_delete_sarbacane_users = Mock()
+    monkeypatch.setattr(
+        "mork.celery.tasks.sarbacane.delete_sarbacane_users",
+        mock_delete_sarbacane_users,
+    )
+
+    assert delete_sarbacane_platform_users([Mock()]) == {}
+    mock_delete_sarbacane_users.assert_not_called()
+
+
 def test_delete_sarbacane_user(httpx_mock):
     """Test to delete user's data from Sarbacane."""
 
@@ -296,6 +358,73 @@ def test_delete_sarbacane_user(httpx_mock):
     delete_sarbacane_user(email)
 
 
+def test_delete_sarbacane_users(sarbacane_server, monkeypatch):
+    """Test to delete many users' data from Sarbacane by chunks of emails."""
+    monkeypatch.setattr(
+        "mork.celery.tasks.sarbacane.settings.SARBACANE_DELETE_BATCH_SIZE", 100
+    )
+    emails = [f"johndoe{i}@example.com" for i in range(3)]
+    sarbacane_server.add_list("list0", [*emails, "janedoe@example.com"])
+    sarbacane_server.add_list("list1", emails[:1])
+    sarbacane_server.add_blacklist("blacklist0", emails[1:], [])
+
+    assert delete_sarbacane_users(emails) == {}
+
+    assert sarbacane_server.contacts == {
+        "/lists/list0/contacts": {"janedoe@example.com"},
+        "/lists/list1/contacts": set(),
+        "/blacklists/blacklist0/unsubscribers": set(),
+        "/blacklists/blacklist0/complaints": set(),
+    }
+
+    # Lists are retrieved once, then each endpoint is called once for all emails,
+    # instead of once per email
+    assert len(sarbacane_server.requests) == 2 + 4
+
+
+def test_delete_sarbacane_users_failure(sarbacane_server, monkeypatch):
+    """Test to delete many users' data from Sarbacane with failing deletions."""
+    monkeypatch.setattr(
+        "mork.celery.tasks.sarbacane.settings.SARBACANE_DELETE_BATCH_SIZE", 2
+    )
+    emails = [f"johndoe{i}@example.com" for i in range(3)]
+    sarbacane_server.add_list("list0", emails)
+    sarbacane_server.failing_emails = {emails[0]}
+
+    errors = delete_sarbacane_users(emails)
+
+    # Each email of the failing chunk is reported as failed
+    assert set(errors) == set(emails[:2])
+    assert str(errors[emails[0]]) == (
+        "Failed to delete user contact at /lists/list0/contacts"
+    )
+    assert sarbacane_server.contacts == {"/lists/list0/contacts": set(emails[:2])}
+    assert len(sarbacane_server.requests) == 2 + 2
+
+
+def test_delete_sarbacane_platform_users_fake_server(
+    db_session, sarbacane_server, monkeypatch
+):
+    """Test to delete a batch of users from a fake Sarbacane platform."""
+    UserServiceStatusFactory._meta.sqlalchemy_session = db_session
+    UserFactory._meta.sqlalchemy_session = db_session
+
+    UserFactory.create_batch(3)
+    users = [UserRead.model_validate(user) for user in db_session.scalars(select(User))]
+    sarbacane_server.add_list("list0", [user.email for user in users])
+    sarbacane_server.add_blacklist("blacklist0", [users[0].email], [])
+    sarbacane_server.failing_emails = {users[2].email}
+    monkeypatch.setattr(
+        "mork.celery.tasks.sarbacane.settings.SARBACANE_DELETE_BATCH_SIZE", 2
+    )
+
+    assert delete_sarbacane_platform_users(users) == {
+        users[0].id: DeletionStatus.DELETED,
+        users[1].id: DeletionStatus.DELETED,
+        users[2].id: None,
+    }
+
+
 def test_delete_sarbacane_user_request_error(httpx_mock, monkeypatch):
     """Test to delete user's data from Sarbacane with a request error."""
 
@@ -316,11 +445,11 @@ def test_delete_sarbacane_user_request_error(httpx_mock, monkeypatch):
         json=[],
     )
 
-    def mock_httpx_delete(*args, **kwars):
+    async def mock_httpx_delete(*args, **kwars):
         raise httpx.RequestError("An error occurred")
 
     monkeypatch.setattr(
-        "mork.celery.tasks.sarbacane.httpx.Client.delete", mock_httpx_delete
+        "mork.celery.tasks.sarbacane.httpx.AsyncClient.delete", mock_httpx_delete
     )
 
     with pytest.raises(
@@ -330,10 +459,14 @@ def test_delete_sarbacane_user_request_error(httpx_mock, monkeypatch):
         delete_sarbacane_user("johndoe@example.com")
 
     # User request error when retrieving the list ids
-    def mock_httpx_get(*args, **kwars):
+    invalidate_contact_lists_cache()
+
+    async def mock_httpx_get(*args, **kwars):
         raise httpx.RequestError("An error occurred")
 
-    monkeypatch.setattr("mork.celery.tasks.sarbacane.httpx.Client.get", mock_httpx_get)
+    monkeypatch.setattr(
+        "mork.celery.tasks.sarbacane.httpx.AsyncClient.get", mock_httpx_get
+    )
 
     with pytest.raises(
         UserDeleteError, match="Network error while retrieving lists of contacts"
@@ -417,3 +550,220 @@ def test_delete_sarbacane_user_delete_error(httpx_mock):
         UserDeleteError, match="Failed to delete user contact at /lists/list0/contacts"
     ):
         delete_sarbacane_user("johndoe@example.com")
+
+
+def test_delete_sarbacane_user_concurrency(httpx_mock, monkeypatch):
+    """Test contact deletions are sent concurrently, with a bounded concurrency."""
+    email = "johndoe@example.com"
+    monkeypatch.setattr("mork.celery.tasks.sarbacane.settings.SARBACANE_CONCURRENCY", 2)
+
+    httpx_mock.add_response(
+        url=f"{settings.SARBACANE_API_URL}/lists",
+        method="GET",
+        json=[{"id": f"list{i}"} for i in range(5)],
+    )
+    httpx_mock.add_response(
+        url=f"{settings.SARBACANE_API_URL}/blacklists", method="GET", json=[]
+    )
+
+    in_flight = []
+    max_in_flight = 0
+
+    async def delete_contact(request: httpx.Request):
+        nonlocal max_in_flight
+        in_flight.append(request)
+        max_in_flight = max(max_in_flight, len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(request)
+        if request.url.path.endswith("/list3/contacts"):
+            return httpx.Response(status_code=500)
+        return httpx.Response(status_code=200)
+
+    httpx_mock.add_callback(delete_contact, method="DELETE", is_reusable=True)
+
+    # All deletions are run before raising the error
+    with pytest.raises(
+        UserDeleteError, match="Failed to delete user contact at /lists/list3/contacts"
+    ):
+        delete_sarbacane_user(email)
+
+    assert len(httpx_mock.get_requests(method="DELETE")) == 5
+    assert max_in_flight == 2
+
+
+def test_delete_sarbacane_user_list_not_found(httpx_mock, monkeypatch, caplog):
+    """Test to delete user's data from Sarbacane when a cached list was removed."""
+    email = "johndoe@example.com"
+    contact_lists_cache = {
+        "lists": {"list0"},
+        "blacklists": set(),
+        "expires_at": float("inf"),
+    }
+    monkeypatch.setattr(
+        "mork.celery.tasks.sarbacane._contact_lists_cache", contact_lists_cache
+    )
+
+    httpx_mock.add_response(
+        url=f"{settings.SARBACANE_API_URL}/lists/list0/contacts?email={email}",
+        method="DELETE",
+        status_code=404,
+    )
+
+    with caplog.at_level(logging.WARNING):
+        delete_sarbacane_user(email)
+
+    assert (
+        "mork.celery.tasks.sarbacane",
+        logging.WARNING,
+        "Contact list not found at /lists/list0/contacts",
+    ) in caplog.record_tuples
+
+    # The cache has been invalidated
+    assert contact_lists_cache == {}
+
+
+@pytest.mark.anyio
+async def test_get_contact_lists_cache(httpx_mock, monkeypatch):
+    """Test contact lists are cached by the worker for the configured TTL."""
+    monkeypatch.setattr("mork.celery.tasks.sarbacane.settings.SARBACANE_CACHE_TTL", 60)
+    monkeypatch.setattr("mork.celery.tasks.sarbacane.time.monotonic", lambda: 0)
+
+    for _ in range(2):
+        httpx_mock.add_response(
+            url=f"{settings.SARBACANE_API_URL}/lists",
+            method="GET",
+            json=[{"id": "list0"}],
+        )
+        httpx_mock.add_response(
+            url=f"{settings.SARBACANE_API_URL}/blacklists",
+            method="GET",
+            json=[{"id": "blacklist0"}],
+        )
+
+    async with httpx.AsyncClient(base_url=settings.SARBACANE_API_URL) as client:
+        assert await get_contact_lists(client) == ({"list0"}, {"blacklist0"})
+        assert await get_contact_lists(client) == ({"list0"}, {"blacklist0"})
+        assert len(httpx_mock.get_requests()) == 2
+
+        # Contact lists are retrieved again once the cache has expired
+        monkeypatch.setattr("mork.celery.tasks.sarbacane.time.monotonic", lambda: 61)
+        assert await get_contact_lists(client) == ({"list0"}, {"blacklist0"})
+        assert len(httpx_mock.get_requests()) == 4
+
+
+@pytest.mark.anyio
+async def test_get_contact_lists_cache_disabled(httpx_mock, monkeypatch):
+    """Test contact lists are retrieved on each call when the cache is disabled."""
+    monkeypatch.setattr("mork.celery.tasks.sarbacane.settings.SARBACANE_CACHE_TTL", 0)
+
+    for _ in range(2):
+        httpx_mock.add_response(
+            url=f"{settings.SARBACANE_API_URL}/lists", method="GET", json=[]
+        )
+        httpx_mock.add_response(
+            url=f"{settings.SARBACANE_API_URL}/blacklists", method="GET", json=[]
+        )
+
+    async with httpx.AsyncClient(base_url=settings.SARBACANE_API_URL) as client:
+        await get_contact_lists(client)
+        await get_contact_lists(client)
+
+    assert len(httpx_mock.get_requests()) == 4
+
+
+@pytest.mark.anyio
+async def test_get_contact_lists_redis_cache(httpx_mock, monkeypatch):
+    """Test contact lists are shared through Redis when configured."""
+    store = {}
+    mock_redis = Mock(
+        get=Mock(side_effect=store.get),
+        set=Mock(side_effect=lambda key, value, ex: store.update({key: value})),
+        delete=Mock(side_effect=lambda key: store.pop(key, None)),
+    )
+    monkeypatch.setattr(
+        "mork.celery.tasks.sarbacane.settings.SARBACANE_CACHE_REDIS_URL",
+        "redis://redis:6379/1",
+    )
+    monkeypatch.setattr(
+        "mork.celery.tasks.sarbacane._get_redis_client", lambda: mock_redis
+    )
+
+    httpx_mock.add_response(
+        url=f"{settings.SARBACANE_API_URL}/lists", method="GET", json=[{"id": "list0"}]
+    )
+    httpx_mock.add_response(
+        url=f"{settings.SARBACANE_API_URL}/blacklists", method="GET", json=[]
+    )
+
+    async with httpx.AsyncClient(base_url=settings.SARBACANE_API_URL) as client:
+        assert await get_contact_lists(client) == ({"list0"}, set())
+        assert await get_contact_lists(client) == ({"list0"}, set())
+
+    assert len(httpx_mock.get_requests()) == 2
+    mock_redis.set.assert_called_once_with(
+        "mork:sarbacane:contact_lists",
+        '{"lists": ["list0"], "blacklists": []}',
+        ex=settings.SARBACANE_CACHE_TTL,
+    )
+
+    invalidate_contact_lists_cache()
+    assert store == {}
+
+
+@pytest.mark.anyio
+async def test_get_contact_lists_redis_error(httpx_mock, monkeypatch):
+    """Test contact lists are retrieved from Sarbacane when Redis is unavailable."""
+    mock_redis = Mock(
+        get=Mock(side_effect=redis.ConnectionError("Connection refused")),
+        set=Mock(side_effect=redis.ConnectionError("Connection refused")),
+    )
+    monkeypatch.setattr(
+        "mork.celery.tasks.sarbacane.settings.SARBACANE_CACHE_REDIS_URL",
+        "redis://redis:6379/1",
+    )
+    monkeypatch.setattr(
+        "mork.celery.tasks.sarbacane._get_redis_client", lambda: mock_redis
+    )
+
+    httpx_mock.add_response(
+        url=f"{settings.SARBACANE_API_URL}/lists", method="GET", json=[{"id": "list0"}]
+    )
+    httpx_mock.add_response(
+        url=f"{settings.SARBACANE_API_URL}/blacklists", method="GET", json=[]
+    )
+
+    async with httpx.AsyncClient(base_url=settings.SARBACANE_API_URL) as client:
+        assert await get_contact_lists(client) == ({"list0"}, set())
+
+
+@pytest.mark.anyio
+async def test_get_contact_lists_error_response(httpx_mock, monkeypatch):
+    """Test failed or invalid responses of contact lists are not cached."""
+    monkeypatch.setattr("mork.celery.tasks.sarbacane.settings.SARBACANE_CACHE_TTL", 60)
+    monkeypatch.setattr("mork.celery.tasks.sarbacane.settings.SARBACANE_MAX_RETRIES", 0)
+
+    httpx_mock.add_response(
+        url=f"{settings.SARBACANE_API_URL}/lists",
+        method="GET",
+        status_code=429,
+        json={"message": "Too many requests"},
+    )
+    httpx_mock.add_response(
+        url=f"{settings.SARBACANE_API_URL}/blacklists", method="GET", json=[]
+    )
+    httpx_mock.add_response(
+        url=f"{settings.SARBACANE_API_URL}/lists", method="GET", text="Bad gateway"
+    )
+    httpx_mock.add_response(
+        url=f"{settings.SARBACANE_API_URL}/blacklists", method="GET", json=[]
+    )
+
+    async with httpx.AsyncClient(base_url=settings.SARBACANE_API_URL) as client:
+        with pytest.raises(
+            UserDeleteError, match="Failed to retrieve lists of contacts at"
+        ):
+            await get_contact_lists(client)
+        with pytest.raises(UserDeleteError, match="Invalid lists of contacts"):
+            await get_contact_lists(client)
+
+    assert len(httpx_mock.get_requests()) == 4
@@ -1,17 +1,25 @@
 """Tests for Mork Celery utils."""
 
 import re
+from datetime import timedelta
+from uuid import uuid4
 
+from faker import Faker
 from pytest_httpx import HTTPXMock
 from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
 
 from mork.celery.utils import (
     get_service_status,
     get_user_from_mork,
+    scan_inactive_users,
     update_status_in_mork,
+    update_statuses_in_mork,
 )
+from mork.edx.mysql.factories.auth import EdxAuthUserFactory
 from mork.factories.users import UserFactory, UserServiceStatusFactory
-from mork.models.users import DeletionStatus, ServiceName, User
+from mork.models.tasks import ScanCheckpoint
+from mork.models.users import DeletionStatus, ServiceName, User, UserServiceStatus
 from mork.schemas.users import UserRead
 
 
@@ -146,3 +154,289 @@ def test_update_user_status_invalid(db_session, httpx_mock: HTTPXMock):
 
     success = update_status_in_mork(user_id, ServiceName.ASHLEY, DeletionStatus.DELETED)
     assert not success
+
+
+def test_get_user_from_mork_db(db_session, monkeypatch):
+    """Test the behavior of getting a user straight from the Mork database."""
+
+    class MockMorkDB:
+        session = db_session
+
+    monkeypatch.setattr("mork.celery.utils.MorkDB", MockMorkDB)
+    monkeypatch.setattr("mork.celery.utils.settings.USER_STATUS_REPOSITORY", "database")
+
+    UserServiceStatusFactory._meta.sqlalchemy_session = db_session
+    UserFactory._meta.sqlalchemy_session = db_session
+
+    # Create one user in the database
+    UserFactory.create()
+
+    # Get user from db
+    expected_user = UserRead.model_validate(db_session.scalar(select(User)))
+
+    assert get_user_from_mork(expected_user.id) == expected_user
+    assert get_user_from_mork(uuid4()) is None
+
+
+def test_update_status_in_mork_db(db_session, monkeypatch):
+    """Test the behavior of updating the user status straight in the Mork database."""
+
+    class MockMorkDB:
+        session = db_session
+
+    monkeypatch.setattr("mork.celery.utils.MorkDB", MockMorkDB)
+    monkeypatch.setattr("mork.celery.utils.settings.USER_STATUS_REPOSITORY", "database")
+
+    UserServiceStatusFactory._meta.sqlalchemy_session = db_session
+    UserFactory._meta.sqlalchemy_session = db_session
+
+    # Create one user in the database
+    UserFactory.create()
+
+    # Get id of one of the newly created user
+    user_id = db_session.scalar(select(User.id))
+
+    assert update_status_in_mork(user_id, ServiceName.ASHLEY, DeletionStatus.DELETED)
+
+    status = db_session.scalar(
+        select(UserServiceStatus.status).where(
+            UserServiceStatus.user_id == user_id,
+            UserServiceStatus.service_name == ServiceName.ASHLEY,
+        )
+    )
+    assert status == DeletionStatus.DELETED
+
+    # Updating the status of an unknown user fails
+    assert not update_status_in_mork(
+        uuid4(), ServiceName.ASHLEY, DeletionStatus.DELETED
+    )
+
+
+def test_update_status_in_mork_db_failure(db_session, monkeypatch):
+    """Test the behavior of updating the user status in database with a failure."""
+
+    class MockMorkDB:
+        session = db_session
+
+    monkeypatch.setattr("mork.celery.utils.MorkDB", MockMorkDB)
+    monkeypatch.setattr("mork.celery.utils.settings.USER_STATUS_REPOSITORY", "database")
+
+    def mock_session_commit():
+        raise SQLAlchemyError("An error occurred")
+
+    monkeypatch.setattr(db_session, "commit", mock_session_commit)
+
+    UserServiceStatusFactory._meta.sqlalchemy_session = db_session
+    UserFactory._meta.sqlalchemy_session = db_session
+
+    # Create one user in the database
+    UserFactory.create()
+
+    # Get id of one of the newly created user
+    user_id = db_session.scalar(select(User.id))
+
+    assert not update_status_in_mork(
+        user_id, ServiceName.ASHLEY, DeletionStatus.DELETED
+    )
+
+
+def test_update_statuses_in_mork(httpx_mock: HTTPXMock):
+    """Test the behavior of updating many users statuses with the Mork API."""
+    user_id, unknown_id = uuid4(), uuid4()
+    statuses = [
+        (user_id, ServiceName.EDX, DeletionStatus.DELETED),
+        (unknown_id, ServiceName.EDX, DeletionStatus.DELETED),
+    ]
+
+    httpx_mock.add_response(
+        url=re.compile(r".*v1/users/status"),
+        method="PATCH",
+        match_json=[
+            {"id": str(user_id), "service_name": "edx", "status": "deleted"},
+            {"id": str(unknown_id), "service_name": "edx", "status": "deleted"},
+        ],
+        json=[
+            {
+                "id": str(user_id),
+                "service_name": "edx",
+                "status": "deleted",
+                "updated": True,
+            },
+            {
+                "id": str(unknown_id),
+                "service_name": "edx",
+                "status": "deleted",
+                "updated": False,
+            },
+        ],
+    )
+
+    assert update_statuses_in_mork(statuses) == {(user_id, ServiceName.EDX)}
+
+    # The update fails
+    httpx_mock.add_response(
+        url=re.compile(r".*v1/users/status"), method="PATCH", status_code=500
+    )
+
+    assert update_statuses_in_mork(statuses) is None
+
+
+def test_update_statuses_in_mork_db(db_session, monkeypatch):
+    """Test the behavior of updating many users statuses in the Mork database."""
+
+    class MockMorkDB:
+        session = db_session
+
+    monkeypatch.setattr("mork.celery.utils.MorkDB", MockMorkDB)
+    monkeypatch.setattr("mork.celery.utils.settings.USER_STATUS_REPOSITORY", "database")
+
+    UserServiceStatusFactory._meta.sqlalchemy_session = db_session
+    UserFactory._meta.sqlalchemy_session = db_session
+
+    # Create two users in the database
+    UserFactory.create_batch(2)
+    user_id1, user_id2 = db_session.scalars(select(User.id)).all()
+    unknown_id = uuid4()
+
+    updated = update_statuses_in_mork(
+        [
+            (user_id1, ServiceName.ASHLEY, DeletionStatus.DELETED),
+            (user_id2, ServiceName.ASHLEY, DeletionStatus.DELETING),
+            (unknown_id, ServiceName.ASHLEY, DeletionStatus.DELETED),
+        ]
+    )
+    assert updated == {
+        (user_id1, ServiceName.ASHLEY),
+        (user_id2, ServiceName.ASHLEY),
+    }
+
+    statuses = db_session.execute(
+        select(UserServiceStatus.user_id, UserServiceStatus.status).where(
+            UserServiceStatus.service_name == ServiceName.ASHLEY
+        )
+    ).all()
+    assert set(statuses) == {
+        (user_id1, DeletionStatus.DELETED),
+        (user_id2, DeletionStatus.DELETING),
+    }
+
+    # The update fails
+    def mock_session_commit():
+        raise SQLAlchemyError("An error occurred")
+
+    monkeypatch.setattr(db_session, "commit", mock_session_commit)
+
+    assert (
+        update_statuses_in_mork([(user_id1, ServiceName.EDX, DeletionStatus.DELETED)])
+        is None
+    )
+
+
+def test_scan_inactive_users(edx_mysql_db, db_session, monkeypatch):
+    """Test scanning inactive users by batches and checkpointing the scan."""
+    period = timedelta(days=365 * 3)
+    inactive_users = EdxAuthUserFactory.create_batch(
+        3, last_login=Faker().date_time_between(end_date="-4y")
+    )
+    EdxAuthUserFactory.create_batch(
+        2, last_login=Faker().date_time_between(start_date="-2y")
+    )
+
+    monkeypatch.setattr("mork.celery.utils.settings.EDX_MYSQL_QUERY_BATCH_SIZE", 2)
+
+    batches = scan_inactive_users(
+        edx_mysql_db.session, db_session, task_name="test_scan", period=period
+    )
+
+    # The checkpoint is saved once a batch has been processed
+    assert [user.id for user in next(batches)] == [
+        user.id for user in inactive_users[:2]
+    ]
+    assert db_session.get(ScanCheckpoint, "test_scan") is not None
+    assert next(batches)[0].id == inactive_users[2].id
+    checkpoint = db_session.get(ScanCheckpoint, "test_scan")
+    assert checkpoint.last_user_id == inactive_users[1].id
+
+    # Once the scan is completed, the watermark is cleared
+    assert next(batches, None) is None
+    assert checkpoint.last_user_id is None
+    assert checkpoint.threshold_date is None
+    assert checkpoint.completed_threshold_date is not None
+
+
+def test_scan_inactive_users_resume(edx_mysql_db, db_session):
+    """Test resuming an inactive users scan stopped by a limit."""
+    period = timedelta(days=365 * 3)
+    inactive_users = EdxAuthUserFactory.create_batch(
+        3, last_login=Faker().date_time_between(end_date="-4y")
+    )
+
+    batches = scan_inactive_users(
+        edx_mysql_db.session, db_session, task_name="test_scan", period=period, limit=2
+    )
+    assert [user.id for batch in batches for user in batch] == [
+        user.id for user in inactive_users[:2]
+    ]
+
+    # The scan is not completed
+    checkpoint = db_session.get(ScanCheckpoint, "test_scan")
+    assert checkpoint.last_user_id == inactive_users[1].id
+    assert checkpoint.completed_threshold_date is None
+
+    # The next run resumes the scan after the last processed user
+    batches = scan_inactive_users(
+        edx_mysql_db.session, db_session, task_name="test_scan", period=period
+    )
+    assert [user.id for batch in batches for user in batch] == [inactive_users[2].id]
+    assert checkpoint.last_user_id is None
+
+
+def test_scan_inactive_users_incremental(edx_mysql_db, db_session):
+    """Test scanning only users that became inactive since the last scan."""
+    period = timedelta(days=365 * 3)
+    EdxAuthUserFactory.create_batch(
+        2, last_login=Faker().date_time_between(end_date="-5y")
+    )
+    recently_inactive_user = EdxAuthUserFactory.create(
+        last_login=Faker().date_time_between(start_date="-1400d", end_date="-1200d")
+    )
+
+    # Complete a first scan, as if it had been performed one year ago
+    list(
+        scan_inactive_users(
+            edx_mysql_db.session,
+            db_session,
+            task_name="test_scan",
+            period=period + timedelta(days=365),
+        )
+    )
+
+    batches = scan_inactive_users(
+        edx_mysql_db.session,
+        db_session,
+        task_name="test_scan",
+        period=period,
+        incremental=True,
+    )
+    assert [user.id for batch in batches for user in batch] == [
+        recently_inactive_user.id
+    ]
+
+
+def test_scan_inactive_users_no_checkpoint(edx_mysql_db, db_session):
+    """Test scanning inactive users without saving the scan progress."""
+    EdxAuthUserFactory.create_batch(
+        2, last_login=Faker().date_time_between(end_date="-4y")
+    )
+
+    batches = scan_inactive_users(
+        edx_mysql_db.session,
+        db_session,
+        task_name="test_scan",
+        period=timedelta(days=365 * 3),
+        checkpoint=False,
+    )
+    assert len([user for batch in batches for user in batch]) == 2
+
+    db_session.rollback()
+    assert db_session.get(ScanCheckpoint, "test_scan") is None
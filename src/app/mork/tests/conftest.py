@@ -14,5 +14,6 @@ from .fixtures.db import (
     edx_mysql_db,
     override_db_test_session,
 )
+from .fixtures.sarbacane import sarbacane_server
 
 TEST_STATIC_PATH = Path(__file__).parent / "static"
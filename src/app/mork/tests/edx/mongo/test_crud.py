@@ -1,5 +1,9 @@
 """Tests of the MongoDB related CRUD functions."""
 
+from unittest.mock import Mock
+
+import pytest
+
 from mork.conf import settings
 from mork.edx.mongo import crud
 from mork.edx.mongo.factories import CommentFactory, CommentThreadFactory
@@ -30,3 +34,134 @@ def test_edx_mongo_crud_anonymize_comments(edx_mongo_db):
     assert comment_thread.body == "[deleted]"
     assert comment_thread.author_id == settings.EDX_FORUM_PLACEHOLDER_USER_ID
     assert comment_thread.anonymous
+
+
+def test_edx_mongo_crud_anonymize_users_comments(edx_mongo_db):
+    """Test the `anonymize_users_comments` method."""
+    CommentFactory.create_batch(3, author_username="JohnDoe")
+    CommentThreadFactory.create_batch(2, author_username="JohnDoe")
+    CommentThreadFactory.create_batch(2, author_username="JaneDoe")
+    CommentFactory.create(author_username="JamesDoe")
+
+    counts = crud.anonymize_users_comments(["JohnDoe", "JaneDoe", "Unknown"])
+
+    assert counts == {"JohnDoe": 5, "JaneDoe": 2}
+    assert Comment.objects(author_username="[deleted]").count() == 3
+    assert CommentThread.objects(title="[deleted]").count() == 4
+    assert Comment.objects(author_username="JamesDoe").count() == 1
+    assert crud.anonymize_users_comments([]) == {}
+
+
+def test_edx_mongo_crud_anonymize_authors_comments(edx_mongo_db):
+    """Test the `anonymize_authors_comments` method."""
+    CommentFactory.create_batch(2, author_id=1)
+    CommentThreadFactory.create(author_id=2)
+    CommentFactory.create(author_id=3)
+
+    counts = crud.anonymize_authors_comments({1: "JohnDoe1", 2: "JohnDoe2"})
+
+    assert counts == {1: 2, 2: 1}
+    assert (
+        Comment.objects(author_id=settings.EDX_FORUM_PLACEHOLDER_USER_ID).count() == 2
+    )
+    assert CommentThread.objects(author_username="[deleted]").count() == 1
+    assert Comment.objects(author_id=3).count() == 1
+    assert crud.anonymize_authors_comments({}) == {}
+
+
+def test_edx_mongo_crud_anonymize_authors_comments_without_id(edx_mongo_db):
+    """Test the `anonymize_authors_comments` method on comments without author id."""
+    CommentFactory.create(author_id=1, author_username="JohnDoe1")
+    CommentFactory.create(author_id=None, author_username="JohnDoe1", body="old")
+    CommentThreadFactory.create(author_id=None, author_username="JohnDoe2")
+    CommentFactory.create(author_id=None, author_username="JohnDoe3")
+
+    counts = crud.anonymize_authors_comments({1: "JohnDoe1", 2: "JohnDoe2"})
+
+    # Comments are matched on the username as well as the author id
+    assert counts == {1: 2, 2: 1}
+    assert Comment.objects(body="old").count() == 0
+    assert Comment.objects(author_username="JohnDoe1").count() == 0
+    assert CommentThread.objects(author_username="JohnDoe2").count() == 0
+    assert Comment.objects(author_username="JohnDoe3").count() == 1
+
+
+def test_edx_mongo_crud_anonymize_comments_by_author_id(edx_mongo_db):
+    """Test the `anonymize_comments` method matching the author id."""
+    CommentFactory.create_batch(2, author_id=1, author_username="JohnDoe")
+    CommentFactory.create(author_id=2, author_username="JohnDoe")
+
+    CommentFactory.create(author_id=None, author_username="JohnDoe")
+
+    # Comments left without the author id are matched on the username
+    assert crud.anonymize_comments("JohnDoe", author_id=1) == 3
+    assert Comment.objects(author_username="JohnDoe").count() == 1
+    assert Comment.objects(author_id=2).count() == 1
+
+
+@pytest.mark.parametrize(
+    "winning_plan, indexed",
+    [
+        ({"stage": "COLLSCAN"}, False),
+        (
+            {
+                "stage": "FETCH",
+                "inputStage": {"stage": "IXSCAN", "keyPattern": {"author_id": 1}},
+            },
+            True,
+        ),
+        (
+            {
+                "queryPlan": {
+                    "stage": "FETCH",
+                    "inputStage": {
+                        "stage": "IXSCAN",
+                        "keyPattern": {"author_id": 1, "_type": 1},
+                    },
+                },
+                "slotBasedPlan": {},
+            },
+            True,
+        ),
+        (
+            {
+                "stage": "FETCH",
+                "inputStage": {
+                    "stage": "IXSCAN",
+                    "keyPattern": {"_type": 1, "author_id": 1},
+                },
+            },
+            False,
+        ),
+        (
+            {
+                "stage": "SUBPLAN",
+                "inputStage": {
+                    "stage": "OR",
+                    "inputStages": [
+                        {"stage": "IXSCAN", "keyPattern": {"author_id": 1}},
+                        {"stage": "COLLSCAN"},
+                    ],
+                },
+            },
+            False,
+        ),
+    ],
+)
+def test_edx_mongo_crud_is_authors_query_indexed(
+    edx_mongo_db, monkeypatch, winning_plan, indexed
+):
+    """Test the `is_authors_query_indexed` method."""
+    mock_collection = Mock()
+    mock_collection.find.return_value.explain.return_value = {
+        "queryPlanner": {"winningPlan": winning_plan}
+    }
+    monkeypatch.setattr(Comment, "_get_collection", lambda: mock_collection)
+
+    assert crud.is_authors_query_indexed("author_id") == indexed
+    mock_collection.find.assert_called_once_with(
+        {
+            "author_id": {"$in": [settings.EDX_FORUM_PLACEHOLDER_USER_ID]},
+            "_type": "Comment",
+        }
+    )
@@ -0,0 +1,44 @@
+"""Tests of the MongoDB database connection."""
+
+from unittest.mock import Mock
+
+from mork.edx.mongo.database import OpenEdxMongoDB
+
+
+def test_edx_mongo_database_process_connection(monkeypatch):
+    """Test the connection of a process is opened once and reused."""
+    mock_connect = Mock(side_effect=[Mock(), Mock()])
+    mock_disconnect = Mock()
+    monkeypatch.setattr("mork.edx.mongo.database.connect", mock_connect)
+    monkeypatch.setattr("mork.edx.mongo.database.disconnect", mock_disconnect)
+    monkeypatch.setattr("mork.utils.os.getpid", lambda: 1)
+
+    connection = OpenEdxMongoDB().connection
+    assert OpenEdxMongoDB().connection is connection
+    assert OpenEdxMongoDB.get_process_connection() is connection
+    assert mock_connect.call_count == 1
+
+    # A new connection is opened in a forked process
+    monkeypatch.setattr("mork.utils.os.getpid", lambda: 2)
+    forked_connection = OpenEdxMongoDB().connection
+    assert forked_connection is not connection
+    assert mock_connect.call_count == 2
+    mock_disconnect.assert_called_once()
+
+    OpenEdxMongoDB.close_process_connection()
+    assert mock_disconnect.call_count == 2
+    assert OpenEdxMongoDB._process_connection.peek() is None
+
+    # Closing a process without connection does nothing
+    OpenEdxMongoDB.close_process_connection()
+    assert mock_disconnect.call_count == 2
+
+
+def test_edx_mongo_database_provided_connection(monkeypatch):
+    """Test a provided connection is used instead of the process connection."""
+    mock_connect = Mock()
+    monkeypatch.setattr("mork.edx.mongo.database.connect", mock_connect)
+
+    connection = Mock()
+    assert OpenEdxMongoDB(connection).connection is connection
+    mock_connect.assert_not_called()
@@ -4,9 +4,11 @@ from datetime import datetime, timedelta
 
 import pytest
 from faker import Faker
+from sqlalchemy import distinct, event, select
 
 from mork.edx.mysql import crud
 from mork.edx.mysql.factories.auth import EdxAuthtokenTokenFactory, EdxAuthUserFactory
+from mork.edx.mysql.factories.base import engine
 from mork.edx.mysql.factories.certificates import (
     EdxCertificatesCertificatehtmlviewconfigurationFactory,
 )
@@ -25,15 +27,20 @@ from mork.edx.mysql.factories.util import EdxUtilRatelimitconfigurationFactory
 from mork.edx.mysql.factories.verify import (
     EdxVerifyStudentHistoricalverificationdeadlineFactory,
 )
+from mork.edx.mysql.factories.wiki import WikiArticleFactory
 from mork.edx.mysql.models.auth import AuthUser
 from mork.edx.mysql.models.base import Base
+from mork.edx.mysql.models.student import (
+    StudentCourseenrollment,
+    StudentCourseenrollmentallowed,
+)
 from mork.exceptions import UserNotFound, UserProtected
 
 
-def test_edx_crud_get_inactive_users_count(edx_mysql_db):
-    """Test the `get_inactive_users_count` method."""
+def test_edx_crud_iter_inactive_users(edx_mysql_db):
+    """Test the `iter_inactive_users` method."""
     # 3 users that did not log in for 3 years
-    EdxAuthUserFactory.create_batch(
+    inactive_users = EdxAuthUserFactory.create_batch(
         3, last_login=Faker().date_time_between(end_date="-3y")
     )
     # 4 users that logged in recently
@@ -43,97 +50,75 @@ def test_edx_crud_get_inactive_users_count(edx_mysql_db):
 
     threshold_date = datetime.now() - timedelta(days=365 * 3)
 
-    # Get count of users inactive for more than 3 years
-    users_count = crud.get_inactive_users_count(edx_mysql_db.session, threshold_date)
-
-    assert users_count == 3
-
-
-def test_edx_crud_get_inactive_users_count_empty(edx_mysql_db):
-    """Test the `get_inactive_users_count` method with no inactive users."""
-    threshold_date = datetime.now() - timedelta(days=365 * 3)
-
-    # Get count of users inactive for more than 3 years
-    users_count = crud.get_inactive_users_count(edx_mysql_db.session, threshold_date)
-
-    assert users_count == 0
+    users = crud.iter_inactive_users(edx_mysql_db.session, threshold_date, 2)
 
+    assert [tuple(user) for user in users] == [
+        (user.id, user.username, user.email) for user in inactive_users
+    ]
 
-def test_edx_crud_get_inactive_users(edx_mysql_db):
-    """Test the `get_inactive_users` method."""
 
+def test_edx_crud_iter_inactive_users_limit(edx_mysql_db):
+    """Test the `iter_inactive_users` method with a limit and a last seen id."""
     # 3 users that did not log in for 3 years
     inactive_users = EdxAuthUserFactory.create_batch(
         3, last_login=Faker().date_time_between(end_date="-3y")
     )
-    # 4 users that logged in recently
-    EdxAuthUserFactory.create_batch(
-        4, last_login=Faker().date_time_between(start_date="-3y")
-    )
 
     threshold_date = datetime.now() - timedelta(days=365 * 3)
 
-    # Get all users inactive for more than 3 years
-    users = crud.get_inactive_users(
-        edx_mysql_db.session, threshold_date, offset=0, limit=9
+    users = crud.iter_inactive_users(
+        edx_mysql_db.session,
+        threshold_date,
+        chunk_size=1,
+        limit=1,
+        last_seen_id=inactive_users[0].id,
     )
 
-    assert len(users) == 3
-    assert users == inactive_users
+    assert [user.email for user in users] == [inactive_users[1].email]
 
 
-def test_edx_crud_get_inactive_users_empty(edx_mysql_db):
-    """Test the `get_inactive_users` method with no inactive users."""
-
-    threshold_date = datetime.now() - timedelta(days=365 * 3)
-
-    users = crud.get_inactive_users(
-        edx_mysql_db.session, threshold_date, offset=0, limit=9
-    )
-
-    assert users == []
-
-
-def test_edx_crud_get_inactive_users_slice(edx_mysql_db):
-    """Test the `get_inactive_users` method with a slice."""
-    # 3 users that did not log in for 3 years
-    inactive_users = EdxAuthUserFactory.create_batch(
-        3, last_login=Faker().date_time_between(end_date="-3y")
-    )
-    # 4 users that logged in recently
+def test_edx_crud_iter_inactive_users_since_date(edx_mysql_db):
+    """Test the `iter_inactive_users` method with a since date."""
+    # 3 users that did not log in for 4 years
     EdxAuthUserFactory.create_batch(
-        4, last_login=Faker().date_time_between(start_date="-3y")
+        3, last_login=Faker().date_time_between(end_date="-4y")
+    )
+    # 1 user that did not log in for 3 years but logged in less than 4 years ago
+    user = EdxAuthUserFactory.create(
+        last_login=Faker().date_time_between(start_date="-4y", end_date="-3y")
     )
 
     threshold_date = datetime.now() - timedelta(days=365 * 3)
+    since_date = datetime.now() - timedelta(days=365 * 4)
 
-    # Get two users inactive for more than 3 years
-    users = crud.get_inactive_users(
-        edx_mysql_db.session, threshold_date, offset=0, limit=2
+    users = crud.iter_inactive_users(
+        edx_mysql_db.session, threshold_date, chunk_size=10, since_date=since_date
     )
 
-    assert len(users) == 2
-    assert users == inactive_users[:2]
+    assert [row.id for row in users] == [user.id]
 
 
-def test_edx_crud_get_inactive_users_slice_empty(edx_mysql_db):
-    """Test the `get_inactive_users` method with an empty slice ."""
-    # 3 users that did not log in for 3 years
-    EdxAuthUserFactory.create_batch(
-        3, last_login=Faker().date_time_between(end_date="-3y")
-    )
-    # 4 users that logged in recently
-    EdxAuthUserFactory.create_batch(
-        4, last_login=Faker().date_time_between(start_date="-3y")
-    )
+def test_edx_crud_iter_inactive_users_exclude_protected(edx_mysql_db):
+    """Test the `iter_inactive_users` method excluding users that cannot be deleted."""
+    last_login = Faker().date_time_between(end_date="-3y")
+    users = EdxAuthUserFactory.create_batch(2, last_login=last_login)
+    EdxAuthUserFactory.create(last_login=last_login, is_staff=True)
+    EdxAuthUserFactory.create(last_login=last_login, is_superuser=True)
+    protected_users = EdxAuthUserFactory.create_batch(2, last_login=last_login)
+    EdxAuthtokenTokenFactory.create(user_id=protected_users[0].id)
+    WikiArticleFactory.create(owner_id=protected_users[1].id)
 
-    threshold_date = datetime.now() - timedelta(days=365 * 3)
+    threshold_date = datetime.now() - timedelta(days=365 * 2)
 
-    users = crud.get_inactive_users(
-        edx_mysql_db.session, threshold_date, offset=4, limit=9
+    inactive_users = crud.iter_inactive_users(
+        edx_mysql_db.session, threshold_date, chunk_size=10
     )
+    assert len(list(inactive_users)) == 6
 
-    assert users == []
+    inactive_users = crud.iter_inactive_users(
+        edx_mysql_db.session, threshold_date, chunk_size=10, exclude_protected=True
+    )
+    assert [row.id for row in inactive_users] == [user.id for user in users]
 
 
 def test_edx_crud_get_user_missing(edx_mysql_db):
@@ -153,6 +138,20 @@ def test_edx_crud_get_user(edx_mysql_db):
     assert user.email == email
 
 
+def test_edx_crud_get_users(edx_mysql_db):
+    """Test the `get_users` method."""
+    users = EdxAuthUserFactory.create_batch(3)
+
+    rows = crud.get_users(
+        edx_mysql_db.session,
+        emails=[users[0].email, users[2].email, "john_doe@example.com"],
+    )
+
+    assert sorted(rows) == sorted(
+        (user.id, user.username, user.email) for user in (users[0], users[2])
+    )
+
+
 def test_edx_crud_delete_user_missing(edx_mysql_db):
     """Test the `delete_user` method with missing user in the database."""
 
@@ -289,6 +288,85 @@ def test_edx_crud_delete_user_protected_table(edx_mysql_db):
         assert edx_mysql_db.session.query(table).count() > 0
 
 
+def test_edx_crud_delete_users(edx_mysql_db):
+    """Test the `delete_users` method."""
+    EdxAuthUserFactory.create(email="johndoe1@example.com")
+    EdxAuthUserFactory.create(email="johndoe2@example.com")
+    EdxAuthUserFactory.create(email="johndoe3@example.com", with_protected_tables=True)
+    EdxAuthUserFactory.create(email="janedoe@example.com")
+    EdxStudentCourseenrollmentallowedFactory.create(email="johndoe1@example.com")
+    EdxStudentCourseenrollmentallowedFactory.create(email="janedoe@example.com")
+
+    protected_emails = crud.delete_users(
+        edx_mysql_db.session,
+        emails=[
+            "johndoe1@example.com",
+            "johndoe2@example.com",
+            "johndoe3@example.com",
+            "unknown@example.com",
+        ],
+    )
+
+    # Protected users are left untouched
+    assert protected_emails == ["johndoe3@example.com"]
+    assert sorted(edx_mysql_db.session.scalars(select(AuthUser.email)).all()) == [
+        "janedoe@example.com",
+        "johndoe3@example.com",
+    ]
+
+    # Children of the other users have not been deleted
+    allowed_emails = edx_mysql_db.session.scalars(
+        select(StudentCourseenrollmentallowed.email)
+    ).all()
+    assert allowed_emails == ["janedoe@example.com"]
+    enrollments_users = edx_mysql_db.session.scalars(
+        select(distinct(StudentCourseenrollment.user_id))
+    ).all()
+    assert len(enrollments_users) == 2
+
+
+def test_edx_crud_delete_users_literal_ids(edx_mysql_db, monkeypatch):
+    """Test children tables are cleaned without subqueries, by chunks of ids."""
+    monkeypatch.setattr("mork.edx.mysql.crud._IDS_CHUNK_SIZE", 2)
+    EdxAuthUserFactory.create(email="johndoe1@example.com")
+    EdxAuthUserFactory.create(email="johndoe2@example.com")
+    EdxAuthUserFactory.create(email="janedoe@example.com")
+    history = Base.metadata.tables["courseware_studentmodulehistory"]
+    remaining_history = edx_mysql_db.session.query(history).count()
+    assert remaining_history > 0
+
+    statements = []
+
+    def listener(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        crud.delete_users(
+            edx_mysql_db.session,
+            emails=["johndoe1@example.com", "johndoe2@example.com"],
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    # Grandchildren tables are cleaned from the ids of their parents
+    modifications = [
+        statement
+        for statement in statements
+        if statement.startswith(("DELETE", "UPDATE"))
+    ]
+    assert modifications
+    assert not any("SELECT" in statement for statement in modifications)
+    assert any(
+        statement.startswith("DELETE FROM courseware_studentmodulehistory")
+        for statement in modifications
+    )
+
+    janedoe = edx_mysql_db.session.scalar(select(AuthUser))
+    assert janedoe.email == "janedoe@example.com"
+    assert 0 < edx_mysql_db.session.query(history).count() < remaining_history
+
+
 def test_edx_crud_has_protected_children(edx_mysql_db):
     """Test the `_has_protected_children` method."""
     id = 123
@@ -308,3 +386,15 @@ def test_edx_crud_has_protected_children(edx_mysql_db):
     EdxCourseActionStateCoursererunstateFactory.create(updated_user_id=user_id)
 
     assert crud._has_protected_children(edx_mysql_db.session, user_id)
+
+
+def test_edx_crud_get_protected_user_ids(edx_mysql_db):
+    """Test the `_get_protected_user_ids` method."""
+    EdxAuthtokenTokenFactory.create(user_id=1)
+    EdxCourseActionStateCoursererunstateFactory.create(updated_user_id=2)
+    EdxDarkLangDarklangconfigFactory.create(changed_by_id=2)
+    EdxUtilRatelimitconfigurationFactory.create(changed_by_id=3)
+
+    assert crud._get_protected_user_ids(edx_mysql_db.session, [1, 2, 4, 5]) == {1, 2}
+    assert crud._get_protected_user_ids(edx_mysql_db.session, [4, 5]) == set()
+    assert crud._get_protected_user_ids(edx_mysql_db.session, []) == set()
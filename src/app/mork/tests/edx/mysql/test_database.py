@@ -0,0 +1,54 @@
+"""Tests of the MySQL database connection."""
+
+from unittest.mock import Mock
+
+from mork.conf import settings
+from mork.edx.mysql.database import OpenEdxMySQLDB
+
+
+def test_edx_mysql_database_process_engine(monkeypatch):
+    """Test the engine of a process is created once and shared by sessions."""
+    mock_create_engine = Mock(side_effect=[Mock(), Mock()])
+    monkeypatch.setattr("mork.edx.mysql.database.create_engine", mock_create_engine)
+    monkeypatch.setattr("mork.edx.mysql.database.Session", Mock())
+    monkeypatch.setattr("mork.utils.os.getpid", lambda: 1)
+
+    engine = OpenEdxMySQLDB().engine
+    assert OpenEdxMySQLDB().engine is engine
+    assert OpenEdxMySQLDB.get_process_engine() is engine
+    mock_create_engine.assert_called_once_with(
+        settings.EDX_MYSQL_DB_URL,
+        echo=settings.EDX_MYSQL_DB_DEBUG,
+        pool_size=settings.EDX_MYSQL_DB_POOL_SIZE,
+        pool_recycle=settings.EDX_MYSQL_DB_POOL_RECYCLE,
+        pool_pre_ping=settings.EDX_MYSQL_DB_POOL_PRE_PING,
+    )
+
+    # A new engine is created in a forked process, without closing the connections
+    # of the parent process
+    monkeypatch.setattr("mork.utils.os.getpid", lambda: 2)
+    forked_engine = OpenEdxMySQLDB().engine
+    assert forked_engine is not engine
+    assert mock_create_engine.call_count == 2
+    engine.dispose.assert_called_once_with(close=False)
+
+    OpenEdxMySQLDB.dispose_process_engine()
+    forked_engine.dispose.assert_called_once_with(close=True)
+    assert OpenEdxMySQLDB._process_engine.peek() is None
+
+    # Disposing a process without engine does nothing
+    OpenEdxMySQLDB.dispose_process_engine()
+    assert forked_engine.dispose.call_count == 1
+
+
+def test_edx_mysql_database_provided_engine(monkeypatch):
+    """Test a provided engine is used instead of the process engine."""
+    mock_create_engine = Mock()
+    monkeypatch.setattr("mork.edx.mysql.database.create_engine", mock_create_engine)
+
+    engine = Mock()
+    session = Mock()
+    db = OpenEdxMySQLDB(engine, session)
+    assert db.engine is engine
+    assert db.session is session
+    mock_create_engine.assert_not_called()
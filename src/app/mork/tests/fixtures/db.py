@@ -30,8 +30,10 @@ def edx_mysql_db():
 
 
 @pytest.fixture
-def edx_mongo_db():
+def edx_mongo_db(monkeypatch):
     """Test edx MongoDB database fixture."""
+    # Query plans cannot be explained with mongomock
+    monkeypatch.setattr(settings, "EDX_MONGO_CHECK_QUERY_PLAN", False)
     connection = connect(
         host=settings.EDX_MONGO_DB_HOST,
         db=settings.EDX_MONGO_DB_NAME,
@@ -0,0 +1,72 @@
+"""Fixtures for a fake Sarbacane API."""
+
+import re
+
+import httpx
+import pytest
+
+from mork.conf import settings
+
+
+class FakeSarbacane:
+    """Fake Sarbacane API storing contacts of lists and blacklists in memory.
+
+    Contacts are stored by endpoint, e.g. `/lists/list0/contacts`. Deleting contacts
+    that are not found at an endpoint fails with the Sarbacane error message.
+    """
+
+    def __init__(self):
+        """Initialize an empty Sarbacane account."""
+        self.contacts = {}
+        self.failing_emails = set()
+        self.requests = []
+
+    def add_list(self, list_id: str, emails: list[str]):
+        """Add a list of contacts."""
+        self.contacts[f"/lists/{list_id}/contacts"] = set(emails)
+
+    def add_blacklist(
+        self, blacklist_id: str, unsubscribers: list[str], complaints: list[str]
+    ):
+        """Add a blacklist of unsubscribers and complaints."""
+        self.contacts[f"/blacklists/{blacklist_id}/unsubscribers"] = set(unsubscribers)
+        self.contacts[f"/blacklists/{blacklist_id}/complaints"] = set(complaints)
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        """Handle a request to the Sarbacane API."""
+        self.requests.append(request)
+        path = request.url.path.removeprefix(httpx.URL(settings.SARBACANE_API_URL).path)
+
+        if request.method == "GET" and path in ("/lists", "/blacklists"):
+            ids = {
+                endpoint.split("/")[2]
+                for endpoint in self.contacts
+                if endpoint.startswith(f"{path}/")
+            }
+            return httpx.Response(200, json=[{"id": id_} for id_ in sorted(ids)])
+
+        if request.method == "DELETE" and path in self.contacts:
+            emails = set(request.url.params.get_list("email"))
+            if emails & self.failing_emails:
+                return httpx.Response(500, json={"message": "Internal error"})
+            if not emails & self.contacts[path]:
+                return httpx.Response(
+                    500, json={"message": "No contacts versions to delete"}
+                )
+            self.contacts[path] -= emails
+            return httpx.Response(200)
+
+        return httpx.Response(404)
+
+
+@pytest.fixture
+def sarbacane_server(httpx_mock) -> FakeSarbacane:
+    """Serve the requests to the Sarbacane API with a fake Sarbacane API."""
+    server = FakeSarbacane()
+    httpx_mock.add_callback(
+        server.handle,
+        url=re.compile(rf"^{re.escape(settings.SARBACANE_API_URL)}/"),
+        is_reusable=True,
+        is_optional=True,
+    )
+    return server
@@ -0,0 +1,156 @@
+"""Tests for Mork database CRUD functions."""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+from mork.crud import claim_warning_emails, enqueue_warning_emails
+from mork.models.tasks import EmailOutbox
+
+
+def test_enqueue_warning_emails(db_session):
+    """Test warning emails are only queued once in the outbox."""
+    users = [
+        ("johndoe1@example.com", "JohnDoe1"),
+        ("johndoe2@example.com", "JohnDoe2"),
+    ]
+    assert enqueue_warning_emails(db_session, users, max_attempts=3) == 2
+    assert enqueue_warning_emails(db_session, users, max_attempts=3) == 0
+    assert enqueue_warning_emails(db_session, [], max_attempts=3) == 0
+
+    emails = db_session.scalars(select(EmailOutbox.email)).all()
+    assert sorted(emails) == ["johndoe1@example.com", "johndoe2@example.com"]
+
+
+def test_enqueue_warning_emails_given_up(db_session):
+    """Test warning emails given up are queued again."""
+    users = [
+        ("johndoe1@example.com", "JohnDoe1"),
+        ("johndoe2@example.com", "JohnDoe2"),
+        ("johndoe3@example.com", "JohnDoe3"),
+    ]
+    enqueue_warning_emails(db_session, users, max_attempts=3)
+    db_session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.email == "johndoe1@example.com")
+        .values(attempts=3, next_attempt_at=EmailOutbox.created_at)
+    )
+    db_session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.email == "johndoe2@example.com")
+        .values(attempts=3, sent_date=EmailOutbox.created_at)
+    )
+    db_session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.email == "johndoe3@example.com")
+        .values(attempts=2)
+    )
+
+    # Only the pending email without attempts left is queued again
+    assert enqueue_warning_emails(db_session, users, max_attempts=3) == 1
+
+    db_session.expire_all()
+    outbox = {email.email: email for email in db_session.scalars(select(EmailOutbox))}
+    assert outbox["johndoe1@example.com"].attempts == 0
+    assert outbox["johndoe1@example.com"].next_attempt_at is None
+    assert outbox["johndoe2@example.com"].attempts == 3
+    assert outbox["johndoe3@example.com"].attempts == 2
+
+
+def test_claim_warning_emails(db_session):
+    """Test only pending emails with attempts left are claimed."""
+    enqueue_warning_emails(
+        db_session,
+        [
+            ("johndoe1@example.com", "JohnDoe1"),
+            ("johndoe2@example.com", "JohnDoe2"),
+            ("johndoe3@example.com", "JohnDoe3"),
+        ],
+        max_attempts=3,
+    )
+    db_session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.email == "johndoe1@example.com")
+        .values(sent_date=EmailOutbox.created_at)
+    )
+    db_session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.email == "johndoe2@example.com")
+        .values(attempts=3)
+    )
+
+    now = datetime.now()
+    emails = claim_warning_emails(db_session, limit=10, max_attempts=3, until=now)
+    assert [email.email for email in emails] == ["johndoe3@example.com"]
+
+    emails = claim_warning_emails(db_session, limit=10, max_attempts=4, until=now)
+    assert sorted(email.email for email in emails) == [
+        "johndoe2@example.com",
+        "johndoe3@example.com",
+    ]
+
+
+def test_claim_warning_emails_next_attempt(db_session):
+    """Test failed emails are only claimed from their next attempt date."""
+    enqueue_warning_emails(
+        db_session,
+        [
+            ("johndoe1@example.com", "JohnDoe1"),
+            ("johndoe2@example.com", "JohnDoe2"),
+        ],
+        max_attempts=3,
+    )
+    now = datetime.now()
+    db_session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.email == "johndoe1@example.com")
+        .values(attempts=1, next_attempt_at=now + timedelta(minutes=1))
+    )
+
+    emails = claim_warning_emails(db_session, limit=10, max_attempts=3, until=now)
+    assert [email.email for email in emails] == ["johndoe2@example.com"]
+
+    emails = claim_warning_emails(
+        db_session, limit=10, max_attempts=3, until=now + timedelta(minutes=1)
+    )
+    assert sorted(email.email for email in emails) == [
+        "johndoe1@example.com",
+        "johndoe2@example.com",
+    ]
+
+
+def test_claim_warning_emails_concurrent_drainers(db_engine):
+    """Test concurrent drainers claim distinct emails."""
+    users = [(f"johndoe{index}@example.com", f"JohnDoe{index}") for index in range(3)]
+    with Session(db_engine) as session:
+        enqueue_warning_emails(session, users, max_attempts=3)
+        session.commit()
+
+    now = datetime.now()
+    try:
+        with Session(db_engine) as session1, Session(db_engine) as session2:
+            claimed1 = claim_warning_emails(
+                session1, limit=2, max_attempts=3, until=now
+            )
+            claimed2 = claim_warning_emails(
+                session2, limit=10, max_attempts=3, until=now
+            )
+
+            # Rows locked by the first drainer are skipped by the second one
+            assert len(claimed1) == 2
+            assert len(claimed2) == 1
+            assert {email.email for email in claimed1 + claimed2} == {
+                email for email, _ in users
+            }
+
+            # Rows are released at the end of the transaction
+            session1.rollback()
+            claimed2 = claim_warning_emails(
+                session2, limit=10, max_attempts=3, until=now
+            )
+            assert len(claimed2) == 3
+    finally:
+        with Session(db_engine) as session:
+            session.execute(delete(EmailOutbox))
+            session.commit()
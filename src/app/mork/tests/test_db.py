@@ -1,9 +1,14 @@
 """Tests for Mork database module."""
 
+from unittest.mock import Mock
+
 import pytest
 from sqlalchemy import text
 from sqlalchemy.exc import OperationalError
 
+from mork.conf import settings
+from mork.db import MorkDB
+
 
 def test_database_connection(db_session):
     """Test the PostgreSQL database connection."""
@@ -11,3 +16,43 @@ def test_database_connection(db_session):
         db_session.execute(text("SELECT 42 as life"))
     except OperationalError:
         pytest.fail("Cannot connect to configured database")
+
+
+def test_mork_db_process_engine(monkeypatch):
+    """Test the engine of a process is created once and shared by sessions."""
+    monkeypatch.setattr("mork.utils.os.getpid", lambda: 1)
+    monkeypatch.setattr("mork.db.settings.DB_NAME", settings.TEST_DB_NAME)
+    MorkDB.dispose_process_engine()
+
+    db = MorkDB()
+    db.session.execute(text("SELECT 1"))
+    db.session.close()
+    db = MorkDB()
+    db.session.execute(text("SELECT 1"))
+
+    engine = MorkDB.get_process_engine()
+    assert db.engine is engine
+    assert MorkDB.get_pool_metrics() == {
+        "connect": 1,
+        "close": 0,
+        "checkout": 2,
+        "checkin": 1,
+        "pool_size": 5,
+        "checked_in": 0,
+        "checked_out": 1,
+        "overflow": -4,
+    }
+    db.session.close()
+
+    # A new engine is created in a forked process, without closing the connections
+    # of the parent process
+    monkeypatch.setattr("mork.utils.os.getpid", lambda: 2)
+    assert MorkDB.get_pool_metrics() == {}
+    mock_dispose = Mock()
+    monkeypatch.setattr(engine, "dispose", mock_dispose)
+    assert MorkDB().engine is not engine
+    mock_dispose.assert_called_once_with(close=False)
+    assert MorkDB.get_pool_metrics()["connect"] == 0
+
+    MorkDB.dispose_process_engine()
+    assert MorkDB.get_pool_metrics() == {}
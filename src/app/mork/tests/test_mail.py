@@ -1,12 +1,34 @@
 """Tests for Mork mail functions."""
 
+import os
 import smtplib
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, Mock
 
 import pytest
+import redis
 
+from mork.conf import settings
 from mork.exceptions import EmailSendError
-from mork.mail import render_template, send_email
+from mork.mail import (
+    EMAIL_RATE_LIMIT_KEY,
+    EmailRateLimiter,
+    SMTPConnectionPool,
+    get_template_environment,
+    render_template,
+    send_email,
+    send_emails,
+)
+
+
+@pytest.fixture
+def templates_path(tmp_path, monkeypatch):
+    """Use a template directory created for the test."""
+    (tmp_path / "templates/html").mkdir(parents=True)
+    (tmp_path / "templates/html/hello.html").write_text("Hello {{ name }}")
+    monkeypatch.setattr("mork.mail.settings.ROOT_PATH", tmp_path)
+    get_template_environment.cache_clear()
+    yield tmp_path / "templates/html"
+    get_template_environment.cache_clear()
 
 
 def test_render_template():
@@ -40,6 +62,22 @@ def test_render_template():
     assert "data:" in render_text
 
 
+@pytest.fixture(autouse=True)
+def smtp_pool():
+    """Use a new SMTP connection pool for each test."""
+    SMTPConnectionPool.close_process_pool()
+    yield
+    SMTPConnectionPool.close_process_pool()
+
+
+@pytest.fixture(autouse=True)
+def email_rate_limiter():
+    """Use a new email rate limiter for each test."""
+    EmailRateLimiter.close_process_limiter()
+    yield
+    EmailRateLimiter.close_process_limiter()
+
+
 def test_send_email(monkeypatch):
     """Test the `send_email` function."""
 
@@ -50,16 +88,14 @@ def test_send_email(monkeypatch):
     test_username = "JohnDoe"
     send_email(email_address=test_address, username=test_username)
 
-    assert mock_SMTP.return_value.__enter__.return_value.sendmail.call_count == 1
+    assert mock_SMTP.return_value.sendmail.call_count == 1
 
 
 def test_send_email_with_smtp_exception(monkeypatch):
     """Test the `send_email` function with an SMTP exception."""
 
     mock_SMTP = MagicMock()
-    mock_SMTP.return_value.__enter__.return_value.sendmail.side_effect = (
-        smtplib.SMTPException
-    )
+    mock_SMTP.return_value.sendmail.side_effect = smtplib.SMTPException
 
     monkeypatch.setattr("mork.mail.smtplib.SMTP", mock_SMTP)
 
@@ -68,3 +104,301 @@ def test_send_email_with_smtp_exception(monkeypatch):
 
     with pytest.raises(EmailSendError, match="Failed sending an email"):
         send_email(email_address=test_address, username=test_username)
+
+
+def test_send_emails(templates_path, monkeypatch):
+    """Test the `send_emails` function sends emails over a single connection."""
+    (templates_path / "warning_email.html").write_text("<p>Hello {{ fullname }}</p>")
+    (templates_path.parent / "text").mkdir()
+    (templates_path.parent / "text/warning_email.txt").write_text("Hi {{ fullname }}")
+    connection = MagicMock()
+    connection.sendmail.side_effect = [None, smtplib.SMTPRecipientsRefused({}), None]
+    mock_SMTP = MagicMock(return_value=connection)
+    monkeypatch.setattr("mork.mail.smtplib.SMTP", mock_SMTP)
+    mock_sleep = Mock()
+    monkeypatch.setattr("mork.mail.time.sleep", mock_sleep)
+
+    users = [
+        ("johndoe1@example.com", "JohnDoe1"),
+        ("johndoe2@example.com", "JohnDoe2"),
+        ("johndoe3@example.com", "JohnDoe3"),
+    ]
+    errors = send_emails(users, interval=0.5)
+
+    # The failure of an email does not prevent sending the next ones
+    assert list(errors) == ["johndoe2@example.com"]
+    assert isinstance(errors["johndoe2@example.com"], EmailSendError)
+    mock_SMTP.assert_called_once()
+    assert connection.sendmail.call_count == 3
+    assert "Hello JohnDoe3" in connection.sendmail.call_args.args[2]
+    assert mock_sleep.call_count == 2
+    mock_sleep.assert_called_with(0.5)
+
+    # The connection is given back to the pool
+    connection.sendmail.side_effect = None
+    send_emails([], interval=0.5)
+    send_emails(users[:1])
+    mock_SMTP.assert_called_once()
+
+
+def test_send_emails_connection_error(templates_path, monkeypatch):
+    """Test the `send_emails` function when the SMTP server cannot be reached."""
+    (templates_path / "warning_email.html").write_text("<p>Hello {{ fullname }}</p>")
+    (templates_path.parent / "text").mkdir()
+    (templates_path.parent / "text/warning_email.txt").write_text("Hi {{ fullname }}")
+    connection = MagicMock()
+    mock_SMTP = MagicMock(side_effect=[ConnectionRefusedError, connection])
+    monkeypatch.setattr("mork.mail.smtplib.SMTP", mock_SMTP)
+
+    users = [
+        ("johndoe1@example.com", "JohnDoe1"),
+        ("johndoe2@example.com", "JohnDoe2"),
+    ]
+    errors = send_emails(users)
+
+    # Only the email sent during the outage fails, the next one reconnecting
+    assert list(errors) == ["johndoe1@example.com"]
+    assert str(errors["johndoe1@example.com"]) == "Failed sending an email"
+    assert mock_SMTP.call_count == 2
+    connection.sendmail.assert_called_once()
+
+    # Connection errors when reconnecting to the server are also caught
+    connection.sendmail.side_effect = smtplib.SMTPServerDisconnected
+    mock_SMTP.side_effect = TimeoutError
+    errors = send_emails(users[:1])
+    assert list(errors) == ["johndoe1@example.com"]
+
+
+def test_send_emails_rate_limit(templates_path, monkeypatch):
+    """Test the `send_emails` function waits for the global rate limit."""
+    (templates_path / "warning_email.html").write_text("<p>Hello {{ fullname }}</p>")
+    (templates_path.parent / "text").mkdir()
+    (templates_path.parent / "text/warning_email.txt").write_text("Hi {{ fullname }}")
+    mock_SMTP = MagicMock()
+    monkeypatch.setattr("mork.mail.smtplib.SMTP", mock_SMTP)
+    mock_reserve = Mock(side_effect=["0", redis.ConnectionError("Connection refused")])
+    mock_redis = Mock(register_script=Mock(return_value=mock_reserve))
+    monkeypatch.setattr("mork.mail.redis.Redis.from_url", lambda url: mock_redis)
+    monkeypatch.setattr("mork.mail.settings.EMAIL_GLOBAL_RATE_LIMIT", "10/s")
+
+    users = [
+        ("johndoe1@example.com", "JohnDoe1"),
+        ("johndoe2@example.com", "JohnDoe2"),
+    ]
+    errors = send_emails(users)
+
+    # Emails are not sent without a token of the rate limit
+    assert list(errors) == ["johndoe2@example.com"]
+    assert (
+        str(errors["johndoe2@example.com"]) == "Failed acquiring the email rate limit"
+    )
+    assert mock_SMTP.return_value.sendmail.call_count == 1
+
+
+def test_email_rate_limiter(monkeypatch):
+    """Test the rate limiter waits for the tokens reserved in Redis."""
+    mock_reserve = Mock(side_effect=["0", "0.5", "1.5"])
+    mock_redis = Mock(register_script=Mock(return_value=mock_reserve))
+    mock_sleep = Mock()
+    monkeypatch.setattr("mork.mail.time.sleep", mock_sleep)
+
+    limiter = EmailRateLimiter(mock_redis, rate=2, capacity=1)
+    assert limiter.acquire() == 0
+    assert limiter.acquire() == 0.5
+    assert limiter.acquire() == 1.5
+
+    mock_reserve.assert_called_with(keys=[EMAIL_RATE_LIMIT_KEY], args=[2, 1])
+    assert mock_sleep.call_args_list == [((0.5,),), ((1.5,),)]
+    assert limiter.get_usage() == {
+        "rate": 2,
+        "capacity": 1,
+        "acquired": 3,
+        "throttled": 2,
+        "wait_time": 2.0,
+        "max_wait_time": 1.5,
+    }
+
+
+def test_email_rate_limiter_process_limiter(monkeypatch):
+    """Test the rate limiter of a process is created once and closed on shutdown."""
+    mock_from_url = Mock(side_effect=lambda url: Mock())
+    monkeypatch.setattr("mork.mail.redis.Redis.from_url", mock_from_url)
+    monkeypatch.setattr("mork.utils.os.getpid", lambda: 1)
+
+    # The rate limiter is disabled by default
+    assert EmailRateLimiter.get_process_limiter() is None
+    assert EmailRateLimiter.get_process_usage() == {}
+
+    monkeypatch.setattr("mork.mail.settings.EMAIL_GLOBAL_RATE_LIMIT", "60/m")
+    monkeypatch.setattr("mork.mail.settings.EMAIL_GLOBAL_RATE_LIMIT_BURST", 5)
+    limiter = EmailRateLimiter.get_process_limiter()
+    assert EmailRateLimiter.get_process_limiter() is limiter
+    assert (limiter.rate, limiter.capacity) == (1, 5)
+    mock_from_url.assert_called_once_with(settings.broker_url)
+    assert EmailRateLimiter.get_process_usage()["acquired"] == 0
+
+    # A new limiter is created in a forked process
+    monkeypatch.setattr("mork.utils.os.getpid", lambda: 2)
+    forked_limiter = EmailRateLimiter.get_process_limiter()
+    assert forked_limiter is not limiter
+
+    EmailRateLimiter.close_process_limiter()
+    forked_limiter.client.close.assert_called_once()
+    limiter.client.close.assert_not_called()
+    assert EmailRateLimiter._process_limiter.peek() is None
+
+
+def test_smtp_connection_pool_reuse(monkeypatch):
+    """Test authenticated connections are reused to send many emails."""
+    monkeypatch.setattr("mork.mail.settings.EMAIL_USE_TLS", True)
+    monkeypatch.setattr("mork.mail.settings.EMAIL_HOST_USER", "user")
+    monkeypatch.setattr("mork.mail.settings.EMAIL_HOST_PASSWORD", "password")
+    mock_SMTP = MagicMock()
+    monkeypatch.setattr("mork.mail.smtplib.SMTP", mock_SMTP)
+
+    pool = SMTPConnectionPool(max_messages=0, max_idle=60)
+    for _ in range(3):
+        pool.sendmail("from@example.com", "to@example.com", "message")
+
+    mock_SMTP.assert_called_once()
+    connection = mock_SMTP.return_value
+    connection.starttls.assert_called_once()
+    connection.login.assert_called_once_with(user="user", password="password")
+    assert connection.sendmail.call_count == 3
+
+    pool.close()
+    connection.quit.assert_called_once()
+
+
+def test_smtp_connection_pool_recycle(monkeypatch):
+    """Test connections are recycled after many messages or being idle."""
+    mock_SMTP = MagicMock(side_effect=lambda **kwargs: MagicMock())
+    monkeypatch.setattr("mork.mail.smtplib.SMTP", mock_SMTP)
+    now = [0.0]
+    monkeypatch.setattr("mork.mail.time.monotonic", lambda: now[0])
+
+    pool = SMTPConnectionPool(max_messages=2, max_idle=60)
+
+    # The connection is recycled after two messages
+    pool.sendmail("from@example.com", "to@example.com", "message")
+    pool.sendmail("from@example.com", "to@example.com", "message")
+    assert mock_SMTP.call_count == 1
+    pool.sendmail("from@example.com", "to@example.com", "message")
+    assert mock_SMTP.call_count == 2
+
+    # The connection is recycled after being idle for too long
+    now[0] = 61
+    pool.sendmail("from@example.com", "to@example.com", "message")
+    assert mock_SMTP.call_count == 3
+
+
+def test_smtp_connection_pool_server_disconnected(monkeypatch):
+    """Test a connection closed by the server is replaced by a new one."""
+    closed_connection = MagicMock()
+    closed_connection.sendmail.side_effect = smtplib.SMTPServerDisconnected
+    connection = MagicMock()
+    mock_SMTP = MagicMock(side_effect=[closed_connection, connection])
+    monkeypatch.setattr("mork.mail.smtplib.SMTP", mock_SMTP)
+
+    pool = SMTPConnectionPool(max_messages=0, max_idle=60)
+    pool.sendmail("from@example.com", "to@example.com", "message")
+
+    closed_connection.close.assert_called_once()
+    connection.sendmail.assert_called_once_with(
+        "from@example.com", "to@example.com", "message"
+    )
+
+
+def test_smtp_connection_pool_errors(monkeypatch):
+    """Test connections are only kept after an error on the recipient."""
+    connection = MagicMock()
+    mock_SMTP = MagicMock(return_value=connection)
+    monkeypatch.setattr("mork.mail.smtplib.SMTP", mock_SMTP)
+
+    pool = SMTPConnectionPool(max_messages=0, max_idle=60)
+
+    connection.sendmail.side_effect = smtplib.SMTPRecipientsRefused({})
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        pool.sendmail("from@example.com", "to@example.com", "message")
+    connection.close.assert_not_called()
+
+    connection.sendmail.side_effect = smtplib.SMTPDataError(554, "Rejected")
+    with pytest.raises(smtplib.SMTPDataError):
+        pool.sendmail("from@example.com", "to@example.com", "message")
+    connection.close.assert_called_once()
+    assert mock_SMTP.call_count == 1
+
+    # A new connection is opened for the next email
+    connection.sendmail.side_effect = None
+    pool.sendmail("from@example.com", "to@example.com", "message")
+    assert mock_SMTP.call_count == 2
+
+
+def test_smtp_connection_pool_process_pool(monkeypatch):
+    """Test the pool of a process is created once and closed on shutdown."""
+    mock_SMTP = MagicMock()
+    monkeypatch.setattr("mork.mail.smtplib.SMTP", mock_SMTP)
+    monkeypatch.setattr("mork.utils.os.getpid", lambda: 1)
+
+    pool = SMTPConnectionPool.get_process_pool()
+    assert SMTPConnectionPool.get_process_pool() is pool
+    pool.sendmail("from@example.com", "to@example.com", "message")
+
+    # A new pool is created in a forked process, without closing the connections
+    # of the parent process
+    monkeypatch.setattr("mork.utils.os.getpid", lambda: 2)
+    forked_pool = SMTPConnectionPool.get_process_pool()
+    assert forked_pool is not pool
+    mock_SMTP.return_value.quit.assert_not_called()
+
+    forked_pool.sendmail("from@example.com", "to@example.com", "message")
+    SMTPConnectionPool.close_process_pool()
+    mock_SMTP.return_value.quit.assert_called_once()
+    assert SMTPConnectionPool._process_pool.peek() is None
+
+    # Closing a process without pool does nothing
+    SMTPConnectionPool.close_process_pool()
+    mock_SMTP.return_value.quit.assert_called_once()
+
+
+def test_render_template_cached_environment(templates_path):
+    """Test templates are rendered with a single environment per process."""
+    assert render_template("hello.html", {"name": "John"}) == "Hello John"
+    assert get_template_environment() is get_template_environment()
+
+    # The compiled template is reused
+    (templates_path / "hello.html").write_text("Goodbye {{ name }}")
+    assert render_template("hello.html", {"name": "John"}) == "Hello John"
+
+
+def test_render_template_auto_reload(templates_path, monkeypatch):
+    """Test template changes are picked up when auto reload is enabled."""
+    monkeypatch.setattr("mork.mail.settings.EMAIL_TEMPLATES_AUTO_RELOAD", True)
+    assert render_template("hello.html", {"name": "John"}) == "Hello John"
+
+    template_path = templates_path / "hello.html"
+    template_path.write_text("Goodbye {{ name }}")
+    mtime = template_path.stat().st_mtime + 10
+    os.utime(template_path, (mtime, mtime))
+    assert render_template("hello.html", {"name": "John"}) == "Goodbye John"
+
+
+def test_render_template_bytecode_cache(templates_path, tmp_path, monkeypatch):
+    """Test compiled templates are stored on disk when a cache path is set."""
+    cache_path = tmp_path / "cache"
+    monkeypatch.setattr(
+        "mork.mail.settings.EMAIL_TEMPLATES_BYTECODE_CACHE_PATH", cache_path
+    )
+
+    assert render_template("hello.html", {"name": "John"}) == "Hello John"
+    assert len(list(cache_path.iterdir())) == 1
+
+    # A new environment loads the template from the bytecode cache
+    get_template_environment.cache_clear()
+    bytecode_cache = get_template_environment().bytecode_cache
+    monkeypatch.setattr(
+        bytecode_cache,
+        "dump_bytecode",
+        Mock(side_effect=AssertionError("Template compiled again")),
+    )
+    assert render_template("hello.html", {"name": "John"}) == "Hello John"
@@ -0,0 +1,167 @@
+"""Tests for the Sarbacane API client."""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import pytest
+
+from mork.conf import settings
+from mork.sarbacane import SarbacaneClient, TokenBucket, get_retry_delay
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace the monotonic clock and asynchronous sleeps with a fake clock."""
+    now = [0.0]
+    sleeps = []
+    sleep = asyncio.sleep
+
+    async def mock_sleep(delay):
+        # Still yield to the event loop, which also sleeps for no time
+        if delay:
+            sleeps.append(delay)
+            now[0] += delay
+        await sleep(0)
+
+    monkeypatch.setattr("mork.sarbacane.time.monotonic", lambda: now[0])
+    monkeypatch.setattr("mork.sarbacane.asyncio.sleep", mock_sleep)
+    return sleeps
+
+
+@pytest.fixture(autouse=True)
+def reset_bucket(monkeypatch):
+    """Reset the budget used by previous tests and remove the retry jitter."""
+    monkeypatch.setattr(SarbacaneClient, "_bucket", None)
+    monkeypatch.setattr("mork.sarbacane.random.uniform", lambda a, b: 0)
+
+
+@pytest.mark.anyio
+async def test_token_bucket(clock):
+    """Test the token bucket limits the rate of requests after a burst."""
+    bucket = TokenBucket(rate=2, capacity=3)
+
+    # The burst capacity is available at once
+    for _ in range(3):
+        await bucket.acquire()
+    assert clock == []
+
+    # Then tokens are handed out at the bucket rate
+    await bucket.acquire()
+    await bucket.acquire()
+    assert clock == [0.5, 0.5]
+
+    assert bucket.get_usage() == {
+        "rate": 2,
+        "capacity": 3,
+        "available": 0,
+        "requests": 5,
+        "throttled": 0,
+    }
+
+
+@pytest.mark.anyio
+async def test_token_bucket_pause(clock):
+    """Test no token is handed out while the bucket is paused."""
+    bucket = TokenBucket(rate=1, capacity=5)
+
+    bucket.pause(10)
+    await bucket.acquire()
+
+    assert clock == [10, 1]
+    assert bucket.get_usage()["throttled"] == 1
+
+
+@pytest.mark.anyio
+async def test_sarbacane_client_budget(httpx_mock, clock, monkeypatch):
+    """Test requests of all clients share the budget of the process."""
+    monkeypatch.setattr("mork.sarbacane.settings.SARBACANE_RATE_LIMIT", "60/m")
+    monkeypatch.setattr("mork.sarbacane.settings.SARBACANE_RATE_LIMIT_BURST", 2)
+    httpx_mock.add_response(
+        url=f"{settings.SARBACANE_API_URL}/lists", json=[], is_reusable=True
+    )
+
+    for _ in range(3):
+        async with SarbacaneClient() as client:
+            response = await client.get("/lists")
+            assert response.status_code == 200
+
+    assert clock == [1]
+    assert SarbacaneClient.get_budget_usage() == {
+        "rate": 1,
+        "capacity": 2,
+        "available": 0,
+        "requests": 3,
+        "throttled": 0,
+    }
+
+    request = httpx_mock.get_requests()[-1]
+    assert request.headers["accountId"] == settings.SARBACANE_ACCOUNT_ID
+    assert request.headers["apiKey"] == settings.SARBACANE_API_KEY
+
+
+@pytest.mark.anyio
+async def test_sarbacane_client_throttled(httpx_mock, clock, monkeypatch):
+    """Test throttled requests are retried after the Retry-After delay."""
+    monkeypatch.setattr("mork.sarbacane.settings.SARBACANE_RATE_LIMIT", "4/s")
+    monkeypatch.setattr("mork.sarbacane.settings.SARBACANE_RATE_LIMIT_BURST", 10)
+    httpx_mock.add_response(
+        url=f"{settings.SARBACANE_API_URL}/lists",
+        status_code=429,
+        headers={"Retry-After": "5"},
+    )
+    httpx_mock.add_response(url=f"{settings.SARBACANE_API_URL}/lists", json=[])
+
+    async with SarbacaneClient() as client:
+        response = await client.get("/lists")
+
+    # The budget restarts from empty after the delay
+    assert response.status_code == 200
+    assert clock == [5, 0.25]
+    assert SarbacaneClient.get_budget_usage()["throttled"] == 1
+
+
+@pytest.mark.anyio
+async def test_sarbacane_client_throttled_max_retries(httpx_mock, clock, monkeypatch):
+    """Test throttled requests are given up after the maximum number of retries."""
+    monkeypatch.setattr("mork.sarbacane.settings.SARBACANE_MAX_RETRIES", 2)
+    monkeypatch.setattr("mork.sarbacane.settings.SARBACANE_RATE_LIMIT", "4/s")
+    monkeypatch.setattr("mork.sarbacane.settings.SARBACANE_RATE_LIMIT_BURST", 10)
+    httpx_mock.add_response(
+        url=f"{settings.SARBACANE_API_URL}/lists", status_code=429, is_reusable=True
+    )
+
+    async with SarbacaneClient() as client:
+        response = await client.get("/lists")
+
+    # The last throttled response is returned after exponential backoffs
+    assert response.status_code == 429
+    assert len(httpx_mock.get_requests()) == 3
+    assert clock == [1, 0.25, 2, 0.25]
+
+
+def test_get_retry_delay(monkeypatch):
+    """Test the delay before retrying a throttled request."""
+    monkeypatch.setattr("mork.sarbacane.settings.SARBACANE_RETRY_BACKOFF", 2)
+
+    # Delay in seconds
+    response = httpx.Response(429, headers={"Retry-After": "30"})
+    assert get_retry_delay(response, attempt=0) == 30
+
+    # Delay as a date
+    retry_date = datetime.now(timezone.utc) + timedelta(seconds=60)
+    response = httpx.Response(
+        429, headers={"Retry-After": format_datetime(retry_date, usegmt=True)}
+    )
+    assert 58 < get_retry_delay(response, attempt=0) <= 60
+
+    # Exponential backoff without or with an invalid header
+    assert get_retry_delay(httpx.Response(429), attempt=0) == 2
+    assert get_retry_delay(httpx.Response(429), attempt=2) == 8
+    response = httpx.Response(429, headers={"Retry-After": "foo"})
+    assert get_retry_delay(response, attempt=1) == 4
+
+    # The jitter is added to the delay
+    monkeypatch.setattr("mork.sarbacane.random.uniform", lambda a, b: b)
+    assert get_retry_delay(httpx.Response(429), attempt=0) == 4
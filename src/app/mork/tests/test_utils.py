@@ -1,7 +1,19 @@
 """Tests for utility functions."""
 
+import json
+import os
+import shutil
+from unittest.mock import Mock
+
+import pytest
+
 from mork.tests.conftest import TEST_STATIC_PATH
-from mork.utils import svg_to_datauri
+from mork.utils import (
+    ProcessLocal,
+    get_svg_datauri,
+    load_svg_datauris,
+    svg_to_datauri,
+)
 
 
 def test_utils_svg_to_datauri_path():
@@ -12,3 +24,116 @@ def test_utils_svg_to_datauri_path():
     assert (
         svg_to_datauri(TEST_STATIC_PATH / "images/red-square.svg") == red_square_base64
     )
+
+
+@pytest.fixture
+def svg_datauris(monkeypatch):
+    """Use an empty memo of SVG data URIs."""
+    datauris = {}
+    monkeypatch.setattr("mork.utils._svg_datauris", datauris)
+    return datauris
+
+
+def test_utils_get_svg_datauri(svg_datauris, tmp_path, monkeypatch):
+    """Test data URIs of SVG images are memoized."""
+    image_path = tmp_path / "red-square.svg"
+    shutil.copy(TEST_STATIC_PATH / "images/red-square.svg", image_path)
+    mock_svg_to_datauri = Mock(wraps=svg_to_datauri)
+    monkeypatch.setattr("mork.utils.svg_to_datauri", mock_svg_to_datauri)
+
+    datauri = get_svg_datauri(image_path)
+    assert datauri == svg_to_datauri(image_path)
+    assert get_svg_datauri(str(image_path)) == datauri
+    assert mock_svg_to_datauri.call_count == 1
+
+    # Changes of the file are ignored without auto reload
+    image_path.write_text('<svg xmlns="http://www.w3.org/2000/svg"/>')
+    mtime = image_path.stat().st_mtime + 10
+    os.utime(image_path, (mtime, mtime))
+    assert get_svg_datauri(image_path) == datauri
+
+    # Changes of the file are picked up with auto reload
+    monkeypatch.setattr("mork.utils.settings.EMAIL_TEMPLATES_AUTO_RELOAD", True)
+    assert get_svg_datauri(image_path) == svg_to_datauri(image_path) != datauri
+    assert get_svg_datauri(image_path) == svg_to_datauri(image_path)
+    assert mock_svg_to_datauri.call_count == 2
+
+
+def test_utils_get_svg_datauri_unknown_file(svg_datauris, tmp_path):
+    """Test no data URI is returned for an unknown file."""
+    assert get_svg_datauri(tmp_path / "unknown.svg") is None
+    assert svg_datauris == {tmp_path / "unknown.svg": (None, None)}
+
+
+def test_utils_load_svg_datauris(svg_datauris, tmp_path, monkeypatch):
+    """Test data URIs of static SVG images are preloaded."""
+    static_path = tmp_path / "static"
+    (static_path / "images").mkdir(parents=True)
+    for name in ("red-square.svg", "blue-square.svg"):
+        shutil.copy(
+            TEST_STATIC_PATH / "images/red-square.svg", static_path / "images" / name
+        )
+    datauris_path = tmp_path / "static.json"
+    datauris_path.write_text(json.dumps({"images/blue-square.svg": "data:pre-encoded"}))
+
+    load_svg_datauris(static_path, datauris_path)
+
+    mock_svg_to_datauri = Mock()
+    monkeypatch.setattr("mork.utils.svg_to_datauri", mock_svg_to_datauri)
+    assert get_svg_datauri(static_path / "images/blue-square.svg") == "data:pre-encoded"
+    assert get_svg_datauri(static_path / "images/red-square.svg") == svg_to_datauri(
+        TEST_STATIC_PATH / "images/red-square.svg"
+    )
+    mock_svg_to_datauri.assert_not_called()
+
+    # Without pre-encoded data URIs, all images are encoded
+    svg_datauris.clear()
+    load_svg_datauris(static_path, tmp_path / "unknown.json")
+    assert len(svg_datauris) == 2
+    assert mock_svg_to_datauri.call_count == 2
+
+
+def test_utils_process_local(monkeypatch):
+    """Test a process local resource is created once per process."""
+    mock_create = Mock(side_effect=lambda: Mock())
+    mock_close = Mock()
+    mock_release = Mock()
+    holder = ProcessLocal(mock_create, close=mock_close, release=mock_release)
+    monkeypatch.setattr("mork.utils.os.getpid", lambda: 1)
+
+    assert holder.peek() is None
+    resource = holder.get()
+    assert holder.get() is resource
+    assert holder.peek() is resource
+    mock_create.assert_called_once()
+
+    # The resource inherited from the parent process is released and replaced
+    monkeypatch.setattr("mork.utils.os.getpid", lambda: 2)
+    assert holder.peek() is None
+    forked_resource = holder.get()
+    assert forked_resource is not resource
+    mock_release.assert_called_once_with(resource)
+    mock_close.assert_not_called()
+
+    holder.close()
+    mock_close.assert_called_once_with(forked_resource)
+    assert holder.peek() is None
+
+    # Closing without resource does nothing
+    holder.close()
+    mock_close.assert_called_once()
+
+
+def test_utils_process_local_close_inherited(monkeypatch):
+    """Test an inherited resource is released instead of closed."""
+    mock_close = Mock()
+    mock_release = Mock()
+    holder = ProcessLocal(Mock, close=mock_close, release=mock_release)
+    monkeypatch.setattr("mork.utils.os.getpid", lambda: 1)
+    resource = holder.get()
+
+    monkeypatch.setattr("mork.utils.os.getpid", lambda: 2)
+    holder.close()
+    mock_release.assert_called_once_with(resource)
+    mock_close.assert_not_called()
+    assert holder.get() is not resource
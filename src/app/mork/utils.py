@@ -1,10 +1,125 @@
 """Utility functions."""
 
+import json
+import os
 from pathlib import Path
+from typing import Callable, Generic, Optional, TypeVar
 
 from datauri import DataURI
 
+from mork.conf import settings
+
+T = TypeVar("T")
+
+# Memoized data URIs of SVG images, by path, with the modification time of the file
+_svg_datauris: dict[Path, tuple[int | None, str | None]] = {}
+
 
 def svg_to_datauri(path: Path | str):
     """Return the data URI string of an SVG image."""
     return str(DataURI.from_file(path))
+
+
+def _get_mtime(path: Path) -> int | None:
+    """Return the modification time of a file, or None if it does not exist."""
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_svg_datauri(path: Path | str) -> str | None:
+    """Return the data URI of an SVG image, memoized by path and modification time.
+
+    Once memoized, the file is only checked for changes if the
+    `EMAIL_TEMPLATES_AUTO_RELOAD` setting is enabled.
+
+    Returns None if the file does not exist.
+    """
+    path = Path(path)
+    memoized = _svg_datauris.get(path)
+    if memoized is not None and not settings.EMAIL_TEMPLATES_AUTO_RELOAD:
+        return memoized[1]
+
+    mtime = _get_mtime(path)
+    if memoized is None or memoized[0] != mtime:
+        memoized = (mtime, svg_to_datauri(path) if mtime is not None else None)
+        _svg_datauris[path] = memoized
+    return memoized[1]
+
+
+def load_svg_datauris(static_path: Path, datauris_path: Path | None = None):
+    """Memoize the data URIs of all SVG images of a static directory.
+
+    Data URIs pre-encoded when building the email templates are read from the
+    `datauris_path` JSON file, by path relative to the static directory. Other
+    images are encoded.
+    """
+    pre_encoded = {}
+    if datauris_path is not None and datauris_path.exists():
+        pre_encoded = json.loads(datauris_path.read_text())
+
+    for path in static_path.rglob("*.svg"):
+        relative_path = path.relative_to(static_path).as_posix()
+        if relative_path in pre_encoded:
+            _svg_datauris[path] = (_get_mtime(path), pre_encoded[relative_path])
+        else:
+            get_svg_datauri(path)
+
+
+class ProcessLocal(Generic[T]):
+    """Resource created once per process and shared by all its users.
+
+    Clients holding connections cannot be shared across processes, and Celery forks
+    its pool processes. A resource inherited from a parent process is thus
+    released, leaving its connections to the parent, and replaced by a new one.
+
+    Parameters:
+    create (Callable): Create the resource of the current process.
+    close (Callable): Close the resource of the current process.
+    release (Callable): Release a resource inherited from a parent process.
+    """
+
+    def __init__(
+        self,
+        create: Callable[[], T],
+        close: Optional[Callable[[T], None]] = None,
+        release: Optional[Callable[[T], None]] = None,
+    ):
+        """Instantiate an empty holder."""
+        self._create = create
+        self._close = close
+        self._release = release
+        self._resource: Optional[T] = None
+        self._pid: Optional[int] = None
+
+    def get(self) -> T:
+        """Get the resource of the current process, creating it if needed."""
+        if self._resource is not None and self._pid == os.getpid():
+            return self._resource
+
+        if self._resource is not None and self._release is not None:
+            self._release(self._resource)
+        self._resource = self._create()
+        self._pid = os.getpid()
+        return self._resource
+
+    def peek(self) -> Optional[T]:
+        """Get the resource of the current process, or None if not created yet."""
+        if self._pid != os.getpid():
+            return None
+        return self._resource
+
+    def close(self):
+        """Close the resource of the current process, or release an inherited one."""
+        if self._resource is None:
+            return
+
+        if self._pid == os.getpid():
+            callback = self._close
+        else:
+            callback = self._release
+        if callback is not None:
+            callback(self._resource)
+        self._resource = None
+        self._pid = None